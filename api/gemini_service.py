@@ -1,11 +1,123 @@
+import functools
+import hashlib
 import json
 import logging
 import os
-import google.generativeai as genai
-from google.generativeai import types
+import threading
+from collections import OrderedDict
 
-# Initialize Gemini client
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# Nothing here touches the Gemini SDK at import time: on Vercel every cold start pays for
+# module imports, and requests like /api/health never need the SDK at all.
+_genai = None
+_glm = None
+
+# Primary model, then lighter models tried in order while it is overloaded (same settings as the app)
+MODEL_NAMES = list(dict.fromkeys(
+    [os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")]
+    + [name.strip() for name in os.environ.get("GEMINI_FALLBACK_MODELS", "gemini-2.5-flash-lite").split(",") if name.strip()]
+))
+
+
+# Variations per request unless the caller asks for fewer or more (same settings as the app)
+DEFAULT_VARIATIONS = int(os.environ.get("DEFAULT_VARIATIONS", 3))
+MAX_VARIATIONS = int(os.environ.get("MAX_VARIATIONS", 5))
+
+# Base URL of a REST stand-in for the Gemini API, e.g. http://127.0.0.1:8766 from fake_gemini.py;
+# unset uses the real API
+GEMINI_REST_ENDPOINT = os.environ.get("GEMINI_REST_ENDPOINT") or None
+
+
+def _response_schema(variations):
+    """The OUTPUT SCHEMA below as a machine-readable response schema with `variations` entries per array"""
+    def array_of(items):
+        return {"type": "array", "items": items, "min_items": variations, "max_items": variations}
+
+    return {
+        "type": "object",
+        "properties": {
+            "story_scripts": array_of({
+                "type": "object",
+                "properties": {
+                    "version": {"type": "integer"},
+                    "script": {"type": "string"},
+                    "word_count": {"type": "integer"},
+                    "estimated_duration": {"type": "string"}
+                },
+                "required": ["version", "script", "word_count", "estimated_duration"]
+            }),
+            "video_titles": array_of({"type": "string"}),
+            "descriptions": array_of({"type": "string"}),
+            "tags": array_of({"type": "array", "items": {"type": "string"}})
+        },
+        "required": ["story_scripts", "video_titles", "descriptions", "tags"]
+    }
+
+
+def _variations_phrase(variations):
+    return "1 variation" if variations == 1 else f"{variations} variations"
+
+
+# Upper bound on cached per-key models (same setting as the app); the environment key is never evicted
+MAX_CLIENTS = int(os.environ.get("GEMINI_CLIENT_CACHE_SIZE", 32))
+_models_lock = threading.Lock()
+_env_models = {}
+_user_models = OrderedDict()
+
+
+def _sdk():
+    """Import the Gemini SDK on first use"""
+    global _genai, _glm
+    if _genai is None:
+        import google.generativeai as genai
+        from google.ai import generativelanguage as glm
+        _genai, _glm = genai, glm
+    return _genai, _glm
+
+
+def _model(model_name, api_key=None):
+    """
+    Return a GenerativeModel bound to its own REST client for the given key (or GEMINI_API_KEY)
+
+    Like gemini_clients.ClientRegistry in the app, each key gets its own service client
+    instead of switching the process-global genai.configure(), so concurrent requests with
+    different keys on a warm instance never send each other's key.
+    """
+    env_api_key = os.environ.get("GEMINI_API_KEY")
+    api_key = api_key or env_api_key
+    is_env_key = api_key == env_api_key
+    cache_key = (hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12], model_name)
+
+    with _models_lock:
+        models = _env_models if is_env_key else _user_models
+        model = models.get(cache_key)
+        if model is not None:
+            if not is_env_key:
+                _user_models.move_to_end(cache_key)
+            return model
+
+        genai, glm = _sdk()
+        client_options = {"api_key": api_key}
+        if GEMINI_REST_ENDPOINT:
+            client_options["api_endpoint"] = GEMINI_REST_ENDPOINT
+        model = genai.GenerativeModel(model_name)
+        model._client = glm.GenerativeServiceClient(client_options=client_options, transport="rest")
+        models[cache_key] = model
+        if not is_env_key and len(_user_models) > MAX_CLIENTS:
+            _user_models.popitem(last=False)
+        return model
+
+
+def _generate_content(prompt, generation_config, custom_api_key=None):
+    """Call the first model that is not overloaded; returns (response, model_name)"""
+    for index, model_name in enumerate(MODEL_NAMES):
+        try:
+            model = _model(model_name, custom_api_key)
+            return model.generate_content(prompt, generation_config=generation_config), model_name
+        except Exception as e:
+            overloaded = any(marker in str(e) for marker in ("503", "429", "overloaded"))
+            if index + 1 == len(MODEL_NAMES) or not overloaded:
+                raise
+            logging.warning(f"{model_name} unavailable, falling back to {MODEL_NAMES[index + 1]}: {str(e)}")
 
 # System instructions optimized for storytelling and content creation
 SYSTEM_INSTRUCTIONS = """You are an advanced storytel            # Validate title lengths (max 70 characters)
@@ -81,7 +193,7 @@ CORE_PROMPT = """Follow the SYSTEM INSTRUCTIONS for storytelling and content cre
 
 For each input, you must generate the following:
 
-STORY SCRIPT (3 variations):
+STORY SCRIPT (one per requested variation):
 - Written in compelling, conversational style
 - Structured to retain attention until the very end
 - Optimized for short-form pacing (30–60 seconds)
@@ -92,13 +204,13 @@ STORY SCRIPT (3 variations):
 - Concise but powerful delivery (every word adds value)
 - Call-to-thought (thought-provoking ending)
 
-VIDEO TITLE (3 variations):
+VIDEO TITLE (one per requested variation):
 - Click-worthy and curiosity-driven
 - Includes relevant keywords for better ranking
 - Short (max 70 characters)
 - Emotional triggers and hooks
 
-DESCRIPTION (3 variations):
+DESCRIPTION (one per requested variation):
 - Engaging and SEO-friendly
 - Includes relevant hashtags and keywords
 - Highlights core message/value of video
@@ -124,7 +236,7 @@ OUTPUT REQUIREMENTS:
 - Use natural, emotionally engaging language
 - Ensure the final script feels original and not copied from input
 
-OUTPUT SCHEMA:
+OUTPUT SCHEMA (every array has exactly one entry per requested variation, in the same order):
 {
   "story_scripts": [
     {
@@ -132,38 +244,32 @@ OUTPUT SCHEMA:
       "script": "Compelling story script text",
       "word_count": 120,
       "estimated_duration": "45 seconds"
-    },
-    {
-      "version": 2, 
-      "script": "Alternative story script text",
-      "word_count": 125,
-      "estimated_duration": "47 seconds"
-    },
-    {
-      "version": 3,
-      "script": "Third story script variation",
-      "word_count": 115,
-      "estimated_duration": "43 seconds"
     }
   ],
   "video_titles": [
-    "First title variation (max 70 chars)",
-    "Second title variation (max 70 chars)", 
-    "Third title variation (max 70 chars)"
+    "Title variation (max 70 chars)"
   ],
   "descriptions": [
-    "First description variation with SEO optimization",
-    "Second description with different angle",
-    "Third description focusing on engagement"
+    "Description variation with SEO optimization"
   ],
   "tags": [
-    ["tag1", "tag2", "tag3", "etc - at least 10 tags"],
-    ["different", "tag", "set", "for variation 2"],
-    ["third", "tag", "variation", "set"]
+    ["tag1", "tag2", "tag3", "etc - at least 10 tags"]
   ]
 }"""
 
-def generate_story_script(input_payload, custom_api_key=None):
+@functools.lru_cache(maxsize=None)
+def _generate_prefix(genre):
+    """Static part of the generate prompt for one genre, built on first use"""
+    genre_guidance = GENRE_GUIDELINES[genre]
+    return f"""{SYSTEM_INSTRUCTIONS}
+
+{CORE_PROMPT}
+
+GENRE-SPECIFIC GUIDELINES:
+{genre_guidance}"""
+
+
+def generate_story_script(input_payload, custom_api_key=None, variations=DEFAULT_VARIATIONS):
     """
     Generate English YouTube Shorts script using Gemini API with storytelling techniques
     """
@@ -177,19 +283,11 @@ def generate_story_script(input_payload, custom_api_key=None):
         description = content.get('description', '')
         duration_seconds = generation.get('duration_seconds', 45)
         
-        # Get genre-specific guidelines
-        genre_guidance = GENRE_GUIDELINES.get(genre, GENRE_GUIDELINES['informative'])
-        
         # Calculate target word count
         target_words = int((duration_seconds / 60) * 150)
         
         # Construct storytelling prompt
-        prompt = f"""{SYSTEM_INSTRUCTIONS}
-
-{CORE_PROMPT}
-
-GENRE-SPECIFIC GUIDELINES:
-{genre_guidance}
+        prompt = f"""{_generate_prefix(genre if genre in GENRE_GUIDELINES else 'informative')}
 
 INPUT CONTENT TO TRANSFORM:
 - Topic/Raw Content: {topic}
@@ -207,19 +305,17 @@ TRANSFORM THIS CONTENT INTO COMPELLING STORYTELLING:
 5. End with thought-provoking conclusion
 6. Target timing: {duration_seconds} seconds = ~{target_words} words
 
-Generate 3 variations following the OUTPUT SCHEMA with story scripts, titles, descriptions, and tags."""
+Generate {_variations_phrase(variations)} following the OUTPUT SCHEMA with story scripts, titles, descriptions, and tags."""
         
-        # Use custom API key if provided
-        if custom_api_key:
-            genai.configure(api_key=custom_api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(
+        response, model_name = _generate_content(
             prompt,
-            generation_config=types.GenerationConfig(
-                temperature=0.7,
-                top_p=0.9,
-                response_mime_type="application/json"
-            )
+            {
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "response_mime_type": "application/json",
+                "response_schema": _response_schema(variations)
+            },
+            custom_api_key  # Use custom API key if provided
         )
         
         if not response.text:
@@ -258,6 +354,7 @@ Generate 3 variations following the OUTPUT SCHEMA with story scripts, titles, de
                 "description": result["descriptions"][0] if result.get("descriptions") else "",
                 "hashtags": result["tags"][0] if result.get("tags") else [],
                 "notes": {
+                    "model": model_name,
                     "word_count": result["story_scripts"][0].get("word_count", 0) if result.get("story_scripts") and len(result["story_scripts"]) > 0 else 0,
                     "duration_seconds": result["story_scripts"][0].get("estimated_duration", "45 seconds") if result.get("story_scripts") and len(result["story_scripts"]) > 0 else "45 seconds",
                     "variations_available": {
@@ -288,7 +385,7 @@ Generate 3 variations following the OUTPUT SCHEMA with story scripts, titles, de
         return {"error": f"API call failed: {str(e)}"}
 
 
-def humanize_story_script(raw_script, duration_seconds=45, custom_api_key=None):
+def humanize_story_script(raw_script, duration_seconds=45, custom_api_key=None, variations=DEFAULT_VARIATIONS):
     """
     Humanize an existing script to make it sound more natural and engaging for storytelling
     """
@@ -330,19 +427,17 @@ Please transform this content to:
 3. Maintain the core message while making it compelling
 4. Add proper pacing with emotional beats and story progression
 5. Use advanced storytelling techniques: hooks, curiosity gaps, clear progression
-6. Create 3 variations following the OUTPUT SCHEMA"""
+6. Create {_variations_phrase(variations)} following the OUTPUT SCHEMA"""
         
-        # Use custom API key if provided
-        if custom_api_key:
-            genai.configure(api_key=custom_api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(
+        response, model_name = _generate_content(
             prompt,
-            generation_config=types.GenerationConfig(
-                temperature=0.8,  # Slightly higher for more creative humanization
-                top_p=0.9,
-                response_mime_type="application/json"
-            )
+            {
+                "temperature": 0.8,  # Slightly higher for more creative humanization
+                "top_p": 0.9,
+                "response_mime_type": "application/json",
+                "response_schema": _response_schema(variations)
+            },
+            custom_api_key  # Use custom API key if provided
         )
         
         if not response.text:
@@ -375,6 +470,7 @@ Please transform this content to:
             
             # Add humanization-specific notes
             result["notes"]["humanized"] = True
+            result["notes"]["model"] = model_name
             result["notes"]["original_length"] = len(raw_script)
             result["notes"]["target_duration"] = f"{duration_seconds} seconds"
             result["notes"]["processing"] = "Content transformed using storytelling techniques"
@@ -1,7 +1,7 @@
 import os
 import logging
 from flask import Flask, request, jsonify
-from gemini_service import generate_story_script, humanize_story_script
+from gemini_service import generate_story_script, humanize_story_script, DEFAULT_VARIATIONS, MAX_VARIATIONS
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -9,6 +9,46 @@ logging.basicConfig(level=logging.DEBUG)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
+# "primary" (default) sends the first variation only, "variations" every variation, "full" also the raw model output
+RESPONSE_VIEWS = ('primary', 'variations', 'full')
+# Top-level keys a caller may narrow the response to with fields= (same as the app)
+RESPONSE_FIELDS = ('title', 'vo_script', 'on_screen_text', 'description', 'hashtags', 'notes', 'variations')
+
+
+def _response_shape(form_data):
+    """Requested response view and field list; fields may be a list or a comma-separated string"""
+    view = form_data.get('view') or 'primary'
+    fields = form_data.get('fields')
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    return view, fields or None
+
+
+def _shape_error(view, fields):
+    """Return an error message for an unknown view or field, or None"""
+    if view not in RESPONSE_VIEWS:
+        return f'view must be one of: {", ".join(RESPONSE_VIEWS)}'
+    unknown_fields = [field for field in fields or () if field not in RESPONSE_FIELDS]
+    if unknown_fields:
+        return f'Unknown fields: {", ".join(unknown_fields)} (choose from {", ".join(RESPONSE_FIELDS)})'
+    return None
+
+
+def _select_view(result, view, fields=None):
+    """Drop notes.full_response unless the caller asked for it, then keep only the requested fields"""
+    notes = result.get('notes')
+    if view == 'full' or not isinstance(notes, dict) or 'full_response' not in notes:
+        shaped = result
+    else:
+        lean_notes = {key: value for key, value in notes.items() if key != 'full_response'}
+        if view == 'variations':
+            shaped = {'variations': notes['full_response'], 'notes': lean_notes}
+        else:
+            shaped = dict(result, notes=lean_notes)
+    if fields:
+        shaped = {key: shaped[key] for key in fields if key in shaped}
+    return shaped
+
 @app.route('/api/generate', methods=['POST'])
 def generate_script():
     """Handle script generation requests"""
@@ -18,6 +58,22 @@ def generate_script():
         
         # Check mode
         mode = form_data.get('mode', 'generate')
+        view, fields = _response_shape(form_data)
+        shape_error = _shape_error(view, fields)
+        if shape_error:
+            return jsonify({'error': shape_error}), 400
+        # Only JSON integers and strings of digits; int() would truncate 2.7 instead of rejecting it
+        variations = form_data.get('variations')
+        if variations is None or variations == '':
+            variations = DEFAULT_VARIATIONS
+        elif isinstance(variations, str) and variations.strip().isdecimal():
+            variations = int(variations)
+        elif not isinstance(variations, int) or isinstance(variations, bool):
+            variations = 0
+        if not 1 <= variations <= MAX_VARIATIONS:
+            return jsonify({
+                'error': f'variations must be a whole number from 1 to {MAX_VARIATIONS}'
+            }), 400
         
         if mode == 'humanize':
             # Mode 1: Humanize - Validate required fields
@@ -42,7 +98,7 @@ def generate_script():
             duration_seconds = int(form_data.get('duration_seconds', 45))
             try:
                 custom_api_key = form_data.get('api_key')
-                result = humanize_story_script(form_data.get('raw_script'), duration_seconds, custom_api_key)
+                result = humanize_story_script(form_data.get('raw_script'), duration_seconds, custom_api_key, variations)
             except Exception as api_error:
                 logging.error(f"Gemini API error in humanize mode: {str(api_error)}")
                 
@@ -86,7 +142,7 @@ def generate_script():
             # Generate script using Gemini API
             try:
                 custom_api_key = form_data.get('api_key')
-                result = generate_story_script(input_payload, custom_api_key)
+                result = generate_story_script(input_payload, custom_api_key, variations)
             except Exception as api_error:
                 logging.error(f"Gemini API error in generate mode: {str(api_error)}")
                 
@@ -105,12 +161,23 @@ def generate_script():
         if result.get('error'):
             return jsonify({'error': result['error']}), 500
         
-        return jsonify(result)
+        return jsonify(_select_view(result, view, fields))
         
     except Exception as e:
         logging.error(f"Error processing script: {str(e)}")
         return jsonify({'error': f'Script processing failed: {str(e)}'}), 500
 
+@app.route('/api/jobs', methods=['POST'])
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def jobs_unavailable(job_id=None):
+    """
+    Async jobs need the Flask app (app.py): a serverless function cannot keep a worker
+    pool running after it responds, and its SQLite file is not shared between instances
+    """
+    return jsonify({
+        'error': 'Async jobs are not available on the serverless API; use POST /jobs on the Flask app (app.py) for long inputs'
+    }), 501
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -9,12 +9,25 @@ logging.basicConfig(level=logging.DEBUG)
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# Reverse proxies in front of the app whose X-Forwarded-For is trusted for request.remote_addr,
+# the address callers are rate limited by. 0 (no proxy) ignores the header, which clients could forge
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=1, x_host=1)
+
+# gzip/brotli compression, ETags and content-hashed static URLs
+import http_cache
+http_cache.init_app(app)
 
 
 # Import routes after app creation to avoid circular imports
 from routes import *
 
+# The usage ledger opens its SQLite file on first write, at app.config["USAGE_DB_PATH"] if set
+from usage_ledger import usage_ledger
+usage_ledger.init_app(app)
+
 if __name__ == "__main__":
+	# Serving: resume jobs queued before a restart without waiting for a new submission
+	job_workers.start()
 	port = int(os.environ.get("PORT", 5000))
 	app.run(host="0.0.0.0", port=port)
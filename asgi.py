@@ -0,0 +1,198 @@
+"""
+ASGI entry point with an asyncio-native path for script generation.
+
+POST /generate, /api/generate and /generate/batch are handled directly on
+asyncio, so an in-flight Gemini round trip holds a coroutine instead of a worker
+thread and one process can keep hundreds of upstream calls open. Every other
+route falls through to the Flask app.
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import json
+import logging
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app, TRUSTED_PROXY_HOPS
+from routes import (
+    _validate_form, _service_arguments, _api_error_message, _prepare_batch, _batch_response,
+    _error_class, _metric_labels, _record_request_metrics, _response_shape, _throttled_body, GUIDED_ERROR_CLASSES
+)
+from gemini_service import generate_story_script_async, humanize_story_script_async, run_batch_async, select_view
+from service_loop import await_on_service_loop
+from http_cache import compress, negotiate_encoding, should_compress
+import metrics
+
+ASYNC_GENERATE_PATHS = ('/generate', '/api/generate')
+
+flask_application = WsgiToAsgi(app)
+
+
+async def _read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+def _parse_form(scope, body):
+    """Decode a JSON or urlencoded body the same way routes.generate_script does"""
+    headers = dict(scope.get('headers', []))
+    content_type = headers.get(b'content-type', b'').decode('latin-1')
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    return dict(parse_qsl(body.decode('utf-8')))
+
+
+def _client_address(scope, trusted_hops=None):
+    """Client address for rate limiting, honouring TRUSTED_PROXY_HOPS the way ProxyFix does in app.py"""
+    trusted_hops = TRUSTED_PROXY_HOPS if trusted_hops is None else trusted_hops
+    if trusted_hops:
+        headers = dict(scope.get('headers', []))
+        forwarded_for = [value.strip() for value in headers.get(b'x-forwarded-for', b'').decode('latin-1').split(',') if value.strip()]
+        # Only the entries appended by our own proxies can be trusted, counting from the right
+        if len(forwarded_for) >= trusted_hops:
+            return forwarded_for[-trusted_hops]
+    client = scope.get('client')
+    return client[0] if client else None
+
+
+async def _send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _compressing(scope, send):
+    """Wrap send so natively served bodies are compressed the same way http_cache does for Flask"""
+    request_headers = dict(scope.get('headers', []))
+    encoding = negotiate_encoding(request_headers.get(b'accept-encoding', b'').decode('latin-1'))
+    held_start = {}
+
+    async def send_compressed(message):
+        if message['type'] == 'http.response.start':
+            # Headers depend on the body, so hold them until it arrives
+            held_start.update(message)
+            return
+        if message['type'] == 'http.response.body' and held_start:
+            body = message.get('body', b'')
+            headers = list(held_start.get('headers', []))
+            content_type = dict(headers).get(b'content-type', b'').decode('latin-1').split(';')[0].strip()
+            if not message.get('more_body') and should_compress(content_type, len(body)):
+                headers.append((b'vary', b'Accept-Encoding'))
+                if encoding:
+                    body = compress(body, encoding)
+                    headers = [(name, value) for name, value in headers if name != b'content-length']
+                    headers += [(b'content-length', str(len(body)).encode()), (b'content-encoding', encoding.encode())]
+            await send(dict(held_start, headers=headers))
+            held_start.clear()
+            message = dict(message, body=body)
+        await send(message)
+
+    return send_compressed
+
+
+async def _metered(handler, scope, receive, send):
+    """Count and time a natively served request the same way routes.py does for Flask views"""
+    started = time.perf_counter()
+    route = scope['path']
+    observed = {'status': 500}
+    send_compressed = _compressing(scope, send)
+
+    async def send_and_observe(message):
+        if message['type'] == 'http.response.start':
+            observed['status'] = message['status']
+        await send_compressed(message)
+
+    with metrics.REQUESTS_IN_FLIGHT.track(route=route):
+        try:
+            await handler(scope, receive, send_and_observe, observed)
+        finally:
+            labels = observed.get('labels') or {'mode': 'other', 'language': '', 'genre': ''}
+            _record_request_metrics(route, labels, observed['status'], observed.get('error_class'), started)
+
+
+async def generate_script(scope, receive, send, observed):
+    """Async equivalent of routes.generate_script"""
+    try:
+        form_data = _parse_form(scope, await _read_body(receive))
+        mode = form_data.get('mode', 'generate')
+        observed['labels'] = _metric_labels(mode, form_data)
+
+        validation_error = _validate_form(mode, form_data)
+        if validation_error:
+            return await _send_json(send, {'error': validation_error}, 400)
+
+        logging.info(f"Processing async {mode} request")
+
+        service_kwargs = _service_arguments(mode, form_data, _client_address(scope))
+        try:
+            if mode == 'humanize':
+                result = await await_on_service_loop(humanize_story_script_async(**service_kwargs))
+            else:
+                result = await await_on_service_loop(generate_story_script_async(**service_kwargs))
+        except Exception as api_error:
+            logging.error(f"Gemini API error in {mode} mode: {str(api_error)}")
+            observed['error_class'] = _error_class(api_error)
+            return await _send_json(send, {'error': _api_error_message(mode, observed['error_class'])}, 503)
+
+        if result.get('error'):
+            if result.get('error_class') == 'throttled':
+                observed['error_class'] = 'throttled'
+                body, retry_after = _throttled_body(result)
+                return await _send_json(send, body, 429, [(b'retry-after', str(retry_after).encode())])
+            if result.get('error_class') in GUIDED_ERROR_CLASSES:
+                observed['error_class'] = result['error_class']
+                return await _send_json(send, {'error': _api_error_message(mode, observed['error_class'])}, 503)
+            observed['error_class'] = 'generation_failed'
+            return await _send_json(send, {'error': result['error']}, 500)
+
+        await _send_json(send, select_view(result, *_response_shape(form_data)))
+
+    except Exception as e:
+        logging.error(f"Error processing script: {str(e)}")
+        await _send_json(send, {'error': f'Script processing failed: {str(e)}'}, 500)
+
+
+async def generate_batch(scope, receive, send, observed):
+    """Async equivalent of routes.generate_batch"""
+    started = time.perf_counter()
+    try:
+        batch_data = json.loads(await _read_body(receive) or b'{}')
+        prepared = _prepare_batch(batch_data if isinstance(batch_data, dict) else {}, _client_address(scope))
+        if prepared.get('error'):
+            return await _send_json(send, {'error': prepared['error']}, 400)
+
+        logging.info(f"Processing async batch of {len(prepared['results'])} items with concurrency {prepared['concurrency']}")
+        job_results = await await_on_service_loop(run_batch_async(prepared['jobs'], prepared['concurrency']))
+        await _send_json(send, _batch_response(prepared, job_results, started))
+
+    except Exception as e:
+        logging.error(f"Error processing batch: {str(e)}")
+        await _send_json(send, {'error': f'Batch processing failed: {str(e)}'}, 500)
+
+
+def _is_multipart(scope):
+    content_type = dict(scope.get('headers', [])).get(b'content-type', b'')
+    return content_type.startswith(b'multipart/form-data')
+
+
+async def application(scope, receive, send):
+    # Subtitle uploads are multipart and are parsed by Flask, which spools them to disk
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in ASYNC_GENERATE_PATHS and not _is_multipart(scope):
+        await _metered(generate_script, scope, receive, send)
+    elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/generate/batch':
+        await _metered(generate_batch, scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
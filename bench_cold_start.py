@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Vercel entry point (api/index.py)
+
+Every run starts a fresh interpreter, the way a serverless cold start does, and measures:
+- import_ms: importing api/index.py (Flask app plus api/gemini_service.py)
+- first_request_ms: the first /api/health request through the Flask test client
+- sdk_first_use_ms: the one-off Gemini SDK import and configure paid by the first generate request
+
+Usage:
+    python bench_cold_start.py [--runs 5] [--json] [--max-import-ms 500]
+
+Exits with status 1 when the median import time is above --max-import-ms, so the
+script can guard against cold-start regressions in CI.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api")
+
+# Runs inside each fresh interpreter and prints one JSON line of timings
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {api_dir!r})
+import index
+imported = time.perf_counter()
+response = index.app.test_client().get("/api/health")
+assert response.status_code == 200, response.status_code
+requested = time.perf_counter()
+sdk_loaded = "google.generativeai" in sys.modules
+import gemini_service
+gemini_service._sdk()
+sdk_ready = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (requested - imported) * 1000,
+    "sdk_first_use_ms": (sdk_ready - requested) * 1000,
+    "sdk_imported_at_startup": sdk_loaded
+}}))
+"""
+
+
+def run_once():
+    """Time one cold start in a fresh interpreter"""
+    env = dict(os.environ, GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY", "bench-key"))
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE.format(api_dir=API_DIR)],
+        capture_output=True, text=True, env=env, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples, field):
+    values = [sample[field] for sample in samples]
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time of api/index.py")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start (default 5)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Fail if the median import time exceeds this")
+    args = parser.parse_args()
+
+    samples = [run_once() for _ in range(args.runs)]
+    report = {
+        "runs": args.runs,
+        "python": sys.version.split()[0],
+        "import_ms": summarize(samples, "import_ms"),
+        "first_request_ms": summarize(samples, "first_request_ms"),
+        "sdk_first_use_ms": summarize(samples, "sdk_first_use_ms"),
+        "sdk_imported_at_startup": any(sample["sdk_imported_at_startup"] for sample in samples)
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Cold start of api/index.py over {args.runs} run(s), median (min-max):")
+        for field in ("import_ms", "first_request_ms", "sdk_first_use_ms"):
+            stats = report[field]
+            print(f"  {field:<18} {stats['median']:>8.1f} ms ({stats['min']:.1f}-{stats['max']:.1f})")
+        if report["sdk_imported_at_startup"]:
+            print("  ✗ google.generativeai was imported before the first generate request")
+
+    failed = report["sdk_imported_at_startup"]
+    if args.max_import_ms is not None and report["import_ms"]["median"] > args.max_import_ms:
+        print(f"✗ Median import time {report['import_ms']['median']:.1f} ms is above {args.max_import_ms:.1f} ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for app.py and api/index.py against the local Gemini stand-in
+
+Starts fake_gemini.py and each target app in their own processes, then sends generate
+requests at each concurrency level and reports per level:
+- rps: completed requests per second of wall time
+- latency_ms: p50, p95, p99, mean and max of the HTTP round trip
+- errors: responses other than 200
+- cpu_ms_per_request: CPU time the target process used, divided by the requests
+- rss_kb_per_request: growth of the target's resident memory, divided by the requests
+- rss_peak_kb: the target's peak resident memory so far
+
+The stand-in is reached through GEMINI_GRPC_ENDPOINT (app.py) and GEMINI_REST_ENDPOINT
+(api/index.py); both are set for every target.
+
+Every request uses a distinct topic, so the response cache and request coalescing never
+answer it. The report is written as JSON to --output, so runs can be diffed.
+
+Usage:
+    python bench_load.py [--targets app,api] [--concurrency 1,2,4,8,16] [--requests 40]
+                         [--latency lognormal:800,0.4] [--error-rate 0.02] [--error-code UNAVAILABLE]
+                         [--response-chars 4000] [--seed 1] [--output bench_load.json]
+
+CPU and memory are read from /proc, so they are null on systems without it.
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(ROOT_DIR, "api")
+
+# Route each target is driven through
+TARGETS = {
+    "app": {"path": "/generate"},
+    "api": {"path": "/api/generate"}
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def process_usage(pid):
+    """CPU seconds, resident and peak resident memory in KB of a process, or Nones without /proc"""
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as status_file:
+            status = dict(line.split(":", 1) for line in status_file if ":" in line)
+    except OSError:
+        return None, None, None
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return cpu_seconds, int(status["VmRSS"].split()[0]), int(status["VmHWM"].split()[0])
+
+
+def _start(command, env):
+    """Start a helper process and return it with the JSON line it prints once ready"""
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()
+    if not line:
+        process.wait()
+        raise RuntimeError(f"{' '.join(command)} exited with status {process.returncode} before it was ready")
+    return process, json.loads(line)
+
+
+def _stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def serve(target, port):
+    """Serve one target app with a threaded WSGI server (runs inside the target process)"""
+    from werkzeug.serving import make_server
+    if target == "api":
+        sys.path.insert(0, API_DIR)
+        from index import app
+    else:
+        from app import app
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    print(json.dumps({"port": server.port}), flush=True)
+    server.serve_forever()
+
+
+def send(port, path, payload):
+    """POST one JSON request; returns (status, latency in ms)"""
+    body = json.dumps(payload)
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    try:
+        connection.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = None
+    finally:
+        connection.close()
+    return status, (time.perf_counter() - started) * 1000
+
+
+def run_level(process, port, path, concurrency, requests, topic, genre, label):
+    """Send requests at one concurrency level and summarize them"""
+    payloads = [
+        {"mode": "generate", "topic": f"{topic} #{label}-{index}", "genre": genre, "duration_seconds": 45}
+        for index in range(requests)
+    ]
+    cpu_before, rss_before, _ = process_usage(process.pid)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(lambda payload: send(port, path, payload), payloads))
+    elapsed = time.perf_counter() - started
+    cpu_after, rss_after, rss_peak = process_usage(process.pid)
+
+    latencies = sorted(latency for _, latency in samples)
+    level = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": sum(1 for status, _ in samples if status != 200),
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 1),
+            "p95": round(percentile(latencies, 0.95), 1),
+            "p99": round(percentile(latencies, 0.99), 1),
+            "mean": round(sum(latencies) / len(latencies), 1),
+            "max": round(latencies[-1], 1)
+        },
+        "cpu_ms_per_request": None,
+        "rss_kb_per_request": None,
+        "rss_peak_kb": rss_peak
+    }
+    if cpu_before is not None:
+        level["cpu_ms_per_request"] = round((cpu_after - cpu_before) * 1000 / requests, 2)
+        level["rss_kb_per_request"] = round((rss_after - rss_before) / requests, 2)
+    return level
+
+
+def run_target(target, fake_ports, args, work_dir):
+    """Start one target against the stand-in and run every concurrency level"""
+    grpc_port, http_port = fake_ports
+    # app.py talks gRPC and api/index.py REST; each reads only its own variable
+    endpoints = {"app": f"127.0.0.1:{grpc_port}", "api": f"http://127.0.0.1:{http_port}"}
+    env = dict(
+        os.environ,
+        GEMINI_GRPC_ENDPOINT=endpoints["app"],
+        GEMINI_REST_ENDPOINT=endpoints["api"],
+        GEMINI_API_KEY="bench-key",
+        GEMINI_BACKEND="gemini",
+        RATE_LIMIT_CALLER_RPM="1000000",
+        USAGE_DB_PATH=os.path.join(work_dir, f"{target}-usage.db"),
+        JOB_DB_PATH=os.path.join(work_dir, f"{target}-jobs.db")
+    )
+    process, ready = _start([sys.executable, os.path.abspath(__file__), "--serve", target], env)
+    port, path = ready["port"], TARGETS[target]["path"]
+    try:
+        _, rss_before_warmup, _ = process_usage(process.pid)
+        status, warmup_ms = send(port, path, {"mode": "generate", "topic": f"{args.topic} warm-up", "genre": args.genre})
+        if status != 200:
+            raise RuntimeError(f"{target} warm-up request failed with status {status}")
+        _, rss_idle, _ = process_usage(process.pid)
+        levels = [
+            run_level(process, port, path, concurrency, max(args.requests, concurrency), args.topic, args.genre, f"{target}-{concurrency}")
+            for concurrency in args.concurrency
+        ]
+    finally:
+        _stop(process)
+    return {"endpoint": endpoints[target], "warmup_ms": round(warmup_ms, 1), "rss_idle_kb": rss_idle, "rss_startup_kb": rss_before_warmup, "levels": levels}
+
+
+def print_report(report):
+    fake = report["fake_gemini"]
+    print(f"Load benchmark against fake Gemini (latency {fake['latency']}, error rate {fake['error_rate']:.0%}, "
+          f"response chars {fake['response_chars'] or 'default'}):")
+    for target, result in report["targets"].items():
+        print(f"\n  {target} ({TARGETS[target]['path']}), warm-up {result['warmup_ms']:.0f} ms")
+        print(f"  {'conc':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'cpu ms/req':>11} {'rss kb/req':>11}")
+        for level in result["levels"]:
+            cpu = "n/a" if level["cpu_ms_per_request"] is None else f"{level['cpu_ms_per_request']:.1f}"
+            rss = "n/a" if level["rss_kb_per_request"] is None else f"{level['rss_kb_per_request']:.1f}"
+            print(f"  {level['concurrency']:>5} {level['rps']:>8.2f} {level['latency_ms']['p50']:>9.1f} {level['latency_ms']['p95']:>9.1f} "
+                  f"{level['latency_ms']['p99']:>9.1f} {level['errors']:>7} {cpu:>11} {rss:>11}")
+    print(f"\nReport written to {report['output']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput, latency, CPU and memory of the generate endpoints")
+    parser.add_argument("--targets", default="app,api", help="Comma-separated apps to drive: app, api (default both)")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Comma-separated concurrency levels (default 1,2,4,8,16)")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per level, at least the concurrency (default 40)")
+    parser.add_argument("--latency", default="lognormal:800,0.4", help="Fake Gemini latency distribution, see fake_gemini.py")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake Gemini calls that fail (default 0)")
+    parser.add_argument("--error-code", default="UNAVAILABLE", help="Status of injected failures (default UNAVAILABLE)")
+    parser.add_argument("--response-chars", type=int, default=None, help="Pad fake answers to about this many characters")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for fake latency and failure draws (default 1)")
+    parser.add_argument("--topic", default="The lighthouse keeper who vanished in 1900", help="Topic prefix of the requests")
+    parser.add_argument("--genre", default="mysterious", help="Genre of the requests")
+    parser.add_argument("--output", default="bench_load.json", help="Where to write the JSON report (default bench_load.json)")
+    parser.add_argument("--serve", choices=sorted(TARGETS), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return 0
+
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    unknown = [target for target in targets if target not in TARGETS]
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(unknown)}")
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+
+    fake_command = [sys.executable, os.path.join(ROOT_DIR, "fake_gemini.py"), "--latency", args.latency,
+                    "--error-rate", str(args.error_rate), "--error-code", args.error_code, "--seed", str(args.seed),
+                    "--workers", str(max(64, 4 * max(args.concurrency)))]
+    if args.response_chars:
+        fake_command += ["--response-chars", str(args.response_chars)]
+
+    report = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "fake_gemini": {
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "error_code": args.error_code,
+            "response_chars": args.response_chars,
+            "seed": args.seed
+        },
+        "requests_per_level": args.requests,
+        "targets": {},
+        "output": args.output
+    }
+    fake, fake_ready = _start(fake_command, dict(os.environ))
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for target in targets:
+                report["targets"][target] = run_target(target, (fake_ready["grpc_port"], fake_ready["http_port"]), args, work_dir)
+    finally:
+        _stop(fake)
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
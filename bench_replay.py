@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Deterministic offline benchmark and profile of the /generate route from recorded Gemini exchanges
+
+record sends each request body once through routes.generate_script with the cassette
+recording (see cassette.py), against the real API or any GEMINI_GRPC_ENDPOINT such as
+fake_gemini.py. replay sends the same bodies again with every Gemini call answered from
+the cassette at the recorded timing times --time-scale, and reports per request body:
+- latency_ms: wall time of the /generate round trip (median, p95)
+- errors: responses other than 200
+With --profile, the replay runs under cProfile, on the request thread and on the service
+loop thread where the upstream calls run, and the merged stats are written to a file and
+summarized. --time-scale 0 leaves only the prompt-build and response-conversion work.
+
+Usage:
+    python bench_replay.py record [--cassette gemini_cassette.jsonl] [--payloads bodies.json]
+    python bench_replay.py replay [--cassette gemini_cassette.jsonl] [--payloads bodies.json]
+                                  [--time-scale 1] [--runs 5] [--profile replay.prof] [--top 25] [--json]
+
+--payloads is a JSON list of /generate bodies; replay must use the bodies that were
+recorded. Record needs GEMINI_API_KEY (or GEMINI_GRPC_ENDPOINT); replay needs neither.
+"""
+
+import argparse
+import cProfile
+import contextlib
+import io
+import json
+import os
+import pstats
+import statistics
+import sys
+import tempfile
+import time
+
+# Bodies sent when no --payloads file is given; no_cache makes every replay reach the cassette
+DEFAULT_PAYLOADS = [
+    {"mode": "generate", "topic": "The lighthouse keeper who vanished in 1900", "genre": "mysterious", "duration_seconds": 45, "no_cache": "1"},
+    {"mode": "generate", "topic": "A courier racing a storm across the Himalayas", "genre": "thriller", "duration_seconds": 30, "no_cache": "1"},
+    {"mode": "generate", "topic": "The last letter from a forgotten war", "genre": "dramatic", "duration_seconds": 60, "language": "hindi", "no_cache": "1"}
+]
+
+
+def load_app(mode, cassette, time_scale, work_dir):
+    """Import the Flask app with the cassette configured; the environment is read at import time"""
+    os.environ.update(
+        GEMINI_CASSETTE=cassette,
+        GEMINI_CASSETTE_MODE=mode,
+        GEMINI_CASSETTE_TIME_SCALE=str(time_scale),
+        GEMINI_BACKEND="gemini",
+        RATE_LIMIT_CALLER_RPM="1000000",
+        USAGE_DB_PATH=os.path.join(work_dir, "usage.db"),
+        JOB_DB_PATH=os.path.join(work_dir, "jobs.db")
+    )
+    if mode == "replay":
+        # Replay never reaches the network, but the SDK still wants a key to build its clients
+        os.environ.setdefault("GEMINI_API_KEY", "replay-key")
+    from app import app
+    return app
+
+
+def post(client, payload):
+    """Send one /generate request; returns (status, latency in ms)"""
+    started = time.perf_counter()
+    response = client.post("/generate", json=payload)
+    return response.status_code, (time.perf_counter() - started) * 1000
+
+
+class ThreadProfiles:
+    """cProfile on the calling thread and on the service loop thread, merged into one report"""
+
+    def __init__(self):
+        self.request_thread = cProfile.Profile()
+        self.service_loop = cProfile.Profile()
+
+    async def _set_service_loop(self, enabled):
+        if enabled:
+            self.service_loop.enable()
+        else:
+            self.service_loop.disable()
+
+    def __enter__(self):
+        from service_loop import run_on_service_loop
+        run_on_service_loop(self._set_service_loop(True))
+        self.request_thread.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        from service_loop import run_on_service_loop
+        self.request_thread.disable()
+        run_on_service_loop(self._set_service_loop(False))
+
+    def stats(self, stream=None):
+        stats = pstats.Stats(self.request_thread, stream=stream)
+        stats.add(self.service_loop)
+        return stats
+
+
+def summarize(samples):
+    latencies = sorted(latency for _, latency in samples)
+    return {
+        "runs": len(samples),
+        "errors": sum(1 for status, _ in samples if status != 200),
+        "latency_ms": {
+            "median": round(statistics.median(latencies), 1),
+            "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record Gemini exchanges for /generate, or replay them to benchmark and profile it offline")
+    parser.add_argument("action", choices=("record", "replay"), help="record against the API, or replay from the cassette")
+    parser.add_argument("--cassette", default="gemini_cassette.jsonl", help="Cassette file (default gemini_cassette.jsonl)")
+    parser.add_argument("--payloads", help="JSON list of /generate bodies (default: three built-in bodies)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Replay latency as a multiple of the recorded one, 0 for none (default 1)")
+    parser.add_argument("--runs", type=int, default=5, help="Replays of each body (default 5)")
+    parser.add_argument("--profile", help="Profile the replay and write the cProfile stats to this file")
+    parser.add_argument("--top", type=int, default=25, help="Functions listed from the profile, by cumulative time (default 25)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    payloads = DEFAULT_PAYLOADS
+    if args.payloads:
+        with open(args.payloads) as payloads_file:
+            payloads = json.load(payloads_file)
+    if args.action == "replay" and not os.path.exists(args.cassette):
+        parser.error(f"{args.cassette} does not exist; record it first")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        app = load_app(args.action, os.path.abspath(args.cassette), args.time_scale, work_dir)
+        from cassette import gemini_cassette
+        client = app.test_client()
+
+        if args.action == "record":
+            results = [post(client, payload) for payload in payloads]
+            report = {"action": "record", "requests": summarize(results), "cassette": gemini_cassette.stats()}
+        else:
+            # One untimed pass builds clients and compiles prompt prefixes
+            for payload in payloads:
+                post(client, payload)
+            samples = {index: [] for index in range(len(payloads))}
+            with ThreadProfiles() if args.profile else contextlib.nullcontext() as profiles:
+                for _ in range(args.runs):
+                    for index, payload in enumerate(payloads):
+                        samples[index].append(post(client, payload))
+            report = {
+                "action": "replay",
+                "time_scale": args.time_scale,
+                "payloads": [dict(summarize(samples[index]), topic=payload.get("topic") or payload.get("raw_script", "")[:40])
+                             for index, payload in enumerate(payloads)],
+                "cassette": gemini_cassette.stats()
+            }
+            if profiles:
+                profiles.stats().dump_stats(args.profile)
+                report["profile"] = args.profile
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    cassette_stats = report["cassette"]
+    if args.action == "record":
+        requests = report["requests"]
+        print(f"Recorded {cassette_stats['recorded']} Gemini exchanges from {requests['runs']} requests "
+              f"({requests['errors']} failed) to {cassette_stats['path']}")
+        return 0
+
+    print(f"/generate replayed from {cassette_stats['path']} at {args.time_scale:g}x recorded timing, {args.runs} run(s) each:")
+    print(f"  {'median ms':>10} {'p95 ms':>10} {'errors':>7}  topic")
+    for stats in report["payloads"]:
+        print(f"  {stats['latency_ms']['median']:>10.1f} {stats['latency_ms']['p95']:>10.1f} {stats['errors']:>7}  {stats['topic']}")
+    if cassette_stats["misses"]:
+        print(f"  {cassette_stats['misses']} Gemini call(s) were not in the cassette; re-record it with the same bodies")
+    if args.profile:
+        summary = io.StringIO()
+        profiles.stats(summary).sort_stats("cumulative").print_stats(args.top)
+        print(f"\nProfile written to {args.profile}; top {args.top} by cumulative time:")
+        print(summary.getvalue())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Latency and output-token benchmark per variation count
+
+Runs the same generate request with variations=1..N, bypassing the response cache,
+and reports per count:
+- latency_ms: wall time of generate_story_script (median, p95)
+- output_tokens: model output tokens from notes.usage (mean)
+- total_tokens: prompt plus output tokens (mean)
+
+Usage:
+    python bench_variations.py [--runs 3] [--max-variations 3] [--topic "..."] [--genre thriller] [--parallel] [--json]
+
+--parallel generates each variation with its own upstream call, so the latency of
+several variations can be compared with that of one.
+
+Uses GEMINI_API_KEY against the real API; set GEMINI_BACKEND=local to exercise the
+request path offline with the in-process stand-in (token counts are then estimates).
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from gemini_service import generate_story_script, MAX_VARIATIONS
+
+
+def run_once(topic, genre, duration_seconds, variations, parallel=False):
+    """Time one uncached generate request; returns the sample or raises on an error result"""
+    input_payload = {
+        "generation": {"duration_seconds": duration_seconds},
+        "content": {"topic": topic, "genre": genre, "description": ""}
+    }
+    started = time.perf_counter()
+    result = generate_story_script(input_payload, use_cache=False, variations=variations, parallel_variations=parallel)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if result.get("error"):
+        raise RuntimeError(result["error"])
+    usage = result["notes"]["usage"]
+    return {"latency_ms": elapsed_ms, "output_tokens": usage["output_tokens"], "total_tokens": usage["total_tokens"]}
+
+
+def summarize(samples):
+    latencies = sorted(sample["latency_ms"] for sample in samples)
+    return {
+        "runs": len(samples),
+        "latency_ms": {
+            "median": round(statistics.median(latencies), 1),
+            "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1)
+        },
+        "output_tokens": round(statistics.mean(sample["output_tokens"] for sample in samples), 1),
+        "total_tokens": round(statistics.mean(sample["total_tokens"] for sample in samples), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure latency and output tokens per variation count")
+    parser.add_argument("--runs", type=int, default=3, help="Requests per variation count (default 3)")
+    parser.add_argument("--max-variations", type=int, default=3, help=f"Largest count to try, up to {MAX_VARIATIONS} (default 3)")
+    parser.add_argument("--topic", default="The lighthouse keeper who vanished in 1900", help="Topic to generate for")
+    parser.add_argument("--genre", default="mysterious", help="Genre to generate for")
+    parser.add_argument("--duration", type=int, default=45, help="Target duration in seconds (default 45)")
+    parser.add_argument("--parallel", action="store_true", help="One upstream call per variation, in parallel")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = {"topic": args.topic, "genre": args.genre, "duration_seconds": args.duration, "parallel": args.parallel, "variations": {}}
+    for variations in range(1, min(args.max_variations, MAX_VARIATIONS) + 1):
+        samples = [run_once(args.topic, args.genre, args.duration, variations, args.parallel) for _ in range(args.runs)]
+        report["variations"][variations] = summarize(samples)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    baseline = report["variations"].get(max(report["variations"]))
+    print(f"Generate latency and tokens per variation count{' (parallel)' if args.parallel else ''}, {args.runs} run(s) each:")
+    print(f"  {'variations':>10} {'median ms':>10} {'p95 ms':>10} {'output tok':>11} {'total tok':>10} {'vs max':>7}")
+    for variations, stats in report["variations"].items():
+        share = stats["output_tokens"] / baseline["output_tokens"] if baseline["output_tokens"] else 0
+        print(f"  {variations:>10} {stats['latency_ms']['median']:>10.1f} {stats['latency_ms']['p95']:>10.1f} "
+              f"{stats['output_tokens']:>11.1f} {stats['total_tokens']:>10.1f} {share:>6.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as core_exceptions
+
+# JSON Lines file Gemini exchanges are recorded to or replayed from
+GEMINI_CASSETTE = os.environ.get("GEMINI_CASSETTE", "gemini_cassette.jsonl")
+# "record" saves every exchange with the real API, "replay" serves them back without network; unset does neither
+GEMINI_CASSETTE_MODE = os.environ.get("GEMINI_CASSETTE_MODE", "").strip().lower() or None
+# Replayed latency as a multiple of the recorded one: 1 is the original timing, 0 answers at once
+GEMINI_CASSETTE_TIME_SCALE = float(os.environ.get("GEMINI_CASSETTE_TIME_SCALE", 1.0))
+
+CASSETTE_MODES = ("record", "replay")
+
+# Responses each service method returns, for turning recorded JSON back into messages
+RESPONSE_TYPES = {
+    "generate_content": glm.GenerateContentResponse,
+    "stream_generate_content": glm.GenerateContentResponse,
+    "create_cached_content": glm.CachedContent
+}
+
+
+class CassetteMiss(LookupError):
+    """Replay was asked for an exchange the cassette does not contain"""
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _prompt_text(message):
+    """Text parts of a GenerateContentRequest or CachedContent, in order"""
+    return "\n".join(part.text for content in message.contents for part in content.parts)
+
+
+def request_hash(message):
+    """
+    Stable hash of a request message: prompt, model, cached content and generation config
+
+    The message is hashed as sorted JSON, because the binary encoding of map fields such
+    as response_schema properties is not guaranteed to be stable.
+    """
+    return _digest(json.dumps(type(message).to_dict(message), sort_keys=True, ensure_ascii=False))
+
+
+def _error_entry(error):
+    return {"code": error.code, "message": error.message}
+
+
+class Cassette:
+    """
+    Record/replay store for Gemini transport exchanges
+
+    Each exchange is one JSON line with the request hash, a hash of the prompt text, the
+    response message as JSON (a list of chunks for streams), or the API error, and its
+    timing. Replay matches on the request hash; repeated requests get their recordings in
+    turn, starting over once all were served, so a recorded run can be replayed many times.
+    """
+
+    def __init__(self, path=GEMINI_CASSETTE, mode=GEMINI_CASSETTE_MODE, time_scale=GEMINI_CASSETTE_TIME_SCALE):
+        if mode not in CASSETTE_MODES + (None,):
+            raise ValueError(f"Cassette mode must be one of: {', '.join(CASSETTE_MODES)}")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._next = {}
+        self._recorded = 0
+        self._replayed = 0
+        self._misses = 0
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as cassette_file:
+            for line in cassette_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault((entry["method"], entry["request_hash"]), []).append(entry)
+        logging.info(f"Loaded {sum(map(len, self._entries.values()))} Gemini exchanges from {self.path}")
+
+    def record(self, method, message, started, response=None, error=None, chunk_ms=None):
+        """
+        Append one exchange to the cassette file
+
+        Args:
+            method: Service method, e.g. "generate_content"
+            message: The request (or CachedContent) message that was sent
+            started: time.perf_counter() when the call was made
+            response: The response message, or a list of chunk messages for streams
+            error: The GoogleAPICallError the call failed with, if it did
+            chunk_ms: Arrival time of each stream chunk, in ms since the call was made
+        """
+        response_type = RESPONSE_TYPES[method]
+        if isinstance(response, list):
+            response = [json.loads(response_type.to_json(chunk)) for chunk in response]
+        elif response is not None:
+            response = json.loads(response_type.to_json(response))
+        entry = {
+            "method": method,
+            "request_hash": request_hash(message),
+            "prompt_hash": _digest(_prompt_text(message)),
+            "model": message.model,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "chunk_ms": chunk_ms,
+            "response": response,
+            "error": _error_entry(error) if error is not None else None,
+            "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as cassette_file:
+                cassette_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._recorded += 1
+
+    def lookup(self, method, message):
+        """Next recorded exchange for a request; raises CassetteMiss if there is none"""
+        key = (method, request_hash(message))
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self._misses += 1
+                raise CassetteMiss(f"No recorded {method} exchange for request {key[1][:12]} in {self.path}")
+            index = self._next.get(key, 0)
+            self._next[key] = (index + 1) % len(entries)
+            self._replayed += 1
+            return entries[index]
+
+    def delay(self, milliseconds):
+        """Seconds to wait for a recorded duration at the configured time scale"""
+        return max(0.0, milliseconds * self.time_scale / 1000)
+
+    def wrap(self, client, is_async):
+        """Route a service client's calls through the cassette, according to the mode"""
+        if self.mode == "record":
+            return RecordingClient(client, self, is_async)
+        if self.mode == "replay":
+            return ReplayClient(self, is_async)
+        return client
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": self.path,
+                "time_scale": self.time_scale,
+                "exchanges": sum(map(len, self._entries.values())),
+                "recorded": self._recorded,
+                "replayed": self._replayed,
+                "misses": self._misses
+            }
+
+
+def _cached_content_message(request, cached_content):
+    return cached_content if cached_content is not None else request.cached_content
+
+
+class RecordingClient:
+    """Service client wrapper that records every generate and cache call it passes through"""
+
+    def __init__(self, client, cassette, is_async):
+        self._client = client
+        self._cassette = cassette
+        self._is_async = is_async
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _call(self, method, message, call):
+        """Make a unary call, synchronously or as a coroutine, and record its outcome"""
+        if self._is_async:
+            return self._call_async(method, message, call)
+        started = time.perf_counter()
+        try:
+            response = call()
+        except core_exceptions.GoogleAPICallError as e:
+            self._cassette.record(method, message, started, error=e)
+            raise
+        self._cassette.record(method, message, started, response)
+        return response
+
+    async def _call_async(self, method, message, call):
+        started = time.perf_counter()
+        try:
+            response = await call()
+        except core_exceptions.GoogleAPICallError as e:
+            self._cassette.record(method, message, started, error=e)
+            raise
+        self._cassette.record(method, message, started, response)
+        return response
+
+    def generate_content(self, request, **kwargs):
+        return self._call("generate_content", request, lambda: self._client.generate_content(request, **kwargs))
+
+    def create_cached_content(self, request=None, *, cached_content=None, **kwargs):
+        message = _cached_content_message(request, cached_content)
+        return self._call("create_cached_content", message, lambda: self._client.create_cached_content(request, cached_content=cached_content, **kwargs))
+
+    def stream_generate_content(self, request, **kwargs):
+        """Record the chunks and their arrival times as the caller reads the stream"""
+        started = time.perf_counter()
+        chunks, chunk_ms = [], []
+        try:
+            for chunk in self._client.stream_generate_content(request, **kwargs):
+                chunks.append(chunk)
+                chunk_ms.append(round((time.perf_counter() - started) * 1000, 1))
+                yield chunk
+        except core_exceptions.GoogleAPICallError as e:
+            self._cassette.record("stream_generate_content", request, started, chunks, error=e, chunk_ms=chunk_ms)
+            raise
+        self._cassette.record("stream_generate_content", request, started, chunks, chunk_ms=chunk_ms)
+
+
+class ReplayClient:
+    """
+    Stand-in service client that answers from the cassette with recorded (scaled) timing
+
+    Responses are real protocol messages, so the SDK and the service layer above it run
+    exactly as they do against the API.
+    """
+
+    def __init__(self, cassette, is_async):
+        self._cassette = cassette
+        self._is_async = is_async
+
+    @staticmethod
+    def _message(method, response):
+        return RESPONSE_TYPES[method].from_json(json.dumps(response), ignore_unknown_fields=True)
+
+    @staticmethod
+    def _raise_recorded_error(entry):
+        if entry["error"] is not None:
+            raise core_exceptions.from_http_status(entry["error"]["code"], entry["error"]["message"])
+
+    def _call(self, method, message):
+        entry = self._cassette.lookup(method, message)
+        if self._is_async:
+            return self._call_async(method, entry)
+        time.sleep(self._cassette.delay(entry["elapsed_ms"]))
+        self._raise_recorded_error(entry)
+        return self._message(method, entry["response"])
+
+    async def _call_async(self, method, entry):
+        await asyncio.sleep(self._cassette.delay(entry["elapsed_ms"]))
+        self._raise_recorded_error(entry)
+        return self._message(method, entry["response"])
+
+    def generate_content(self, request, **kwargs):
+        return self._call("generate_content", request)
+
+    def create_cached_content(self, request=None, *, cached_content=None, **kwargs):
+        return self._call("create_cached_content", _cached_content_message(request, cached_content))
+
+    def stream_generate_content(self, request, **kwargs):
+        """Yield the recorded chunks, each at its recorded (scaled) arrival time"""
+        entry = self._cassette.lookup("stream_generate_content", request)
+        started = time.perf_counter()
+        for chunk, arrived_ms in zip(entry["response"], entry["chunk_ms"]):
+            time.sleep(max(0.0, self._cassette.delay(arrived_ms) - (time.perf_counter() - started)))
+            yield self._message("stream_generate_content", chunk)
+        time.sleep(max(0.0, self._cassette.delay(entry["elapsed_ms"]) - (time.perf_counter() - started)))
+        self._raise_recorded_error(entry)
+
+
+# Shared cassette, configured from the environment; inactive unless GEMINI_CASSETTE_MODE is set
+gemini_cassette = Cassette()
@@ -0,0 +1,44 @@
+import re
+
+# Boundaries tried in order when a piece of text is too long: paragraphs, lines,
+# sentences (including the Devanagari danda) and finally words
+SPLIT_PATTERNS = (r"\n\s*\n", r"\n", r"(?<=[.!?।])\s+", r"\s+")
+
+
+def _split_units(text, max_chars, patterns=SPLIT_PATTERNS):
+    """Break text into pieces of at most max_chars, using the coarsest boundary that works"""
+    if len(text) <= max_chars:
+        return [text]
+    if not patterns:
+        return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+
+    units = []
+    for piece in re.split(patterns[0], text):
+        piece = piece.strip()
+        if piece:
+            units.extend(_split_units(piece, max_chars, patterns[1:]))
+    return units
+
+
+def split_into_chunks(text, max_chars):
+    """
+    Split text into chunks of at most max_chars that end on natural boundaries
+
+    Paragraphs are kept whole where possible and packed together until the next one
+    would overflow the chunk, so every chunk reads as a coherent stretch of the source.
+
+    Args:
+        text: Raw script or transcript
+        max_chars: Largest chunk size in characters
+    """
+    chunks = []
+    current = ""
+    for unit in _split_units(text.strip(), max_chars):
+        if current and len(current) + 1 + len(unit) > max_chars:
+            chunks.append(current)
+            current = unit
+        else:
+            current = f"{current}\n{unit}" if current else unit
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini API endpoint, for load tests and benchmarks
+
+Unlike GEMINI_BACKEND=local, which replaces the SDK in-process, this is a real server:
+requests go through the SDK, its transport and the network stack, so client overhead
+and concurrency limits show up in measurements. It serves
+- gRPC GenerateContent, StreamGenerateContent and CreateCachedContent, used by app.py
+  (point GEMINI_GRPC_ENDPOINT at host:grpc_port, see gemini_clients.py)
+- REST generateContent, used by api/index.py (point GEMINI_REST_ENDPOINT at
+  http://host:http_port, see api/gemini_service.py)
+
+Answers are the schema-valid stories from local_backend.py, optionally padded to a
+response size, after a latency drawn from a configurable distribution. A share of
+requests fails with a configurable status instead.
+
+Usage:
+    python fake_gemini.py [--grpc-port 0] [--http-port 0] [--latency lognormal:800,0.4]
+                          [--error-rate 0.02] [--error-code UNAVAILABLE] [--response-chars 4000]
+
+Prints one JSON line with the bound ports once both servers accept requests.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+from google.ai import generativelanguage as glm
+
+from local_backend import LocalBackend, estimate_tokens
+
+GENERATIVE_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+CACHE_SERVICE = "google.ai.generativelanguage.v1beta.CacheService"
+REST_PATH_PATTERN = re.compile(r"^/v1beta/models/(?P<model>[^:/]+):generateContent$")
+
+# Injectable failures and the HTTP status the REST API answers them with
+ERROR_HTTP_STATUS = {
+    "UNAVAILABLE": 503,
+    "RESOURCE_EXHAUSTED": 429,
+    "INTERNAL": 500,
+    "DEADLINE_EXCEEDED": 504
+}
+# Size of each chunk of a streamed answer
+STREAM_CHUNK_CHARS = 256
+# Sentence appended to story scripts to reach --response-chars
+FILLER_SENTENCE = "The silence that followed said more than any words could."
+
+
+def latency_sampler(spec, rng=random):
+    """
+    Parse a latency distribution and return a function drawing delays in seconds
+
+    Args:
+        spec: "fixed:MS", "uniform:LOW_MS,HIGH_MS", "normal:MEAN_MS,STDEV_MS" or
+            "lognormal:MEDIAN_MS,SIGMA"
+        rng: random.Random to draw from, for reproducible runs
+    """
+    kind, _, params = spec.partition(":")
+    try:
+        values = [float(value) for value in params.split(",")] if params else []
+    except ValueError:
+        raise ValueError(f"Invalid latency parameters: {spec}") from None
+    samplers = {
+        ("fixed", 1): lambda: values[0],
+        ("uniform", 2): lambda: rng.uniform(values[0], values[1]),
+        ("normal", 2): lambda: rng.gauss(values[0], values[1]),
+        ("lognormal", 2): lambda: values[0] * rng.lognormvariate(0, values[1])
+    }
+    sampler = samplers.get((kind, len(values)))
+    if sampler is None:
+        raise ValueError(f"Unknown latency distribution: {spec}")
+    return lambda: max(0.0, sampler()) / 1000
+
+
+def _pad_output(text, response_chars):
+    """Lengthen every story script evenly so the JSON answer is about response_chars long"""
+    missing = response_chars - len(text)
+    if missing <= 0:
+        return text
+    output = json.loads(text)
+    scripts = output["story_scripts"]
+    repeats = max(1, missing // (len(FILLER_SENTENCE) + 1) // len(scripts))
+    for item in scripts:
+        item["script"] = " ".join([item["script"]] + [FILLER_SENTENCE] * repeats)
+        item["word_count"] = len(item["script"].split())
+    return json.dumps(output, ensure_ascii=False)
+
+
+class FakeGeminiServer:
+    """
+    gRPC and REST Gemini stand-in with configurable latency, errors and response size
+
+    Thread-safe; every request is answered on its own worker thread, so concurrent
+    requests overlap the way they do against the real API.
+    """
+
+    def __init__(self, latency="fixed:0", error_rate=0.0, error_code="UNAVAILABLE", response_chars=None,
+                 seed=None, max_workers=64):
+        if error_code not in ERROR_HTTP_STATUS:
+            raise ValueError(f"error_code must be one of: {', '.join(ERROR_HTTP_STATUS)}")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.response_chars = response_chars
+        self.max_workers = max_workers
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._sample_latency = latency_sampler(latency, self._rng)
+        self._stories = LocalBackend()
+        self._lock = threading.Lock()
+        self._caches = {}
+        self._cache_ids = itertools.count(1)
+        self._requests = 0
+        self._errors = 0
+        self._grpc_server = None
+        self._http_server = None
+
+    def _draw(self):
+        """Latency in seconds and whether this request fails"""
+        with self._rng_lock:
+            return self._sample_latency(), self._rng.random() < self.error_rate
+
+    def _answer(self, request):
+        """Build the GenerateContentResponse for a request, or return None if it should fail"""
+        prompt = "\n".join(part.text for content in request.contents for part in content.parts)
+        cached_tokens = 0
+        if request.cached_content:
+            with self._lock:
+                prefix = self._caches.get(request.cached_content)
+            if prefix is None:
+                raise KeyError(request.cached_content)
+            cached_tokens = estimate_tokens(prefix)
+            prompt = f"{prefix}\n{prompt}"
+
+        text = self._stories.render_output(prompt)
+        if self.response_chars:
+            text = _pad_output(text, self.response_chars)
+        prompt_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(text)
+        return text, glm.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt_tokens,
+            cached_content_token_count=cached_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens
+        )
+
+    def _count(self, failed):
+        with self._lock:
+            self._requests += 1
+            self._errors += failed
+
+    @staticmethod
+    def _response(text, usage_metadata=None):
+        return glm.GenerateContentResponse(
+            candidates=[glm.Candidate(
+                content=glm.Content(role="model", parts=[glm.Part(text=text)]),
+                finish_reason=glm.Candidate.FinishReason.STOP
+            )],
+            usage_metadata=usage_metadata
+        )
+
+    # gRPC handlers
+
+    def _grpc_generate(self, request, context):
+        delay, failed = self._draw()
+        self._count(failed)
+        time.sleep(delay)
+        if failed:
+            context.abort(getattr(grpc.StatusCode, self.error_code), "Injected failure")
+        try:
+            text, usage_metadata = self._answer(request)
+        except KeyError as e:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Unknown cached content {e}")
+        return self._response(text, usage_metadata)
+
+    def _grpc_stream_generate(self, request, context):
+        delay, failed = self._draw()
+        self._count(failed)
+        if failed:
+            time.sleep(delay)
+            context.abort(getattr(grpc.StatusCode, self.error_code), "Injected failure")
+        try:
+            text, usage_metadata = self._answer(request)
+        except KeyError as e:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Unknown cached content {e}")
+        chunks = [text[start:start + STREAM_CHUNK_CHARS] for start in range(0, len(text), STREAM_CHUNK_CHARS)]
+        # The latency is spread over the chunks, so the first one arrives early like a real stream
+        for index, chunk in enumerate(chunks):
+            time.sleep(delay / len(chunks))
+            yield self._response(chunk, usage_metadata if index == len(chunks) - 1 else None)
+
+    def _grpc_create_cached_content(self, request, context):
+        cached_content = request.cached_content
+        prefix = "\n".join(part.text for content in cached_content.contents for part in content.parts)
+        with self._lock:
+            name = f"cachedContents/fake-{next(self._cache_ids)}"
+            self._caches[name] = prefix
+        return glm.CachedContent(
+            name=name,
+            model=cached_content.model,
+            usage_metadata=glm.CachedContent.UsageMetadata(total_token_count=estimate_tokens(prefix))
+        )
+
+    def _grpc_handlers(self):
+        generate = grpc.method_handlers_generic_handler(GENERATIVE_SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                self._grpc_generate,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize
+            ),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                self._grpc_stream_generate,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize
+            )
+        })
+        cache = grpc.method_handlers_generic_handler(CACHE_SERVICE, {
+            "CreateCachedContent": grpc.unary_unary_rpc_method_handler(
+                self._grpc_create_cached_content,
+                request_deserializer=glm.CreateCachedContentRequest.deserialize,
+                response_serializer=glm.CachedContent.serialize
+            )
+        })
+        return (generate, cache)
+
+    # REST handler
+
+    def _rest_generate(self, body):
+        """Return (HTTP status, JSON body) for a REST generateContent request"""
+        delay, failed = self._draw()
+        self._count(failed)
+        time.sleep(delay)
+        if failed:
+            status = ERROR_HTTP_STATUS[self.error_code]
+            return status, json.dumps({"error": {"code": status, "message": "Injected failure", "status": self.error_code}})
+        try:
+            request = glm.GenerateContentRequest.from_json(body, ignore_unknown_fields=True)
+            text, usage_metadata = self._answer(request)
+        except KeyError as e:
+            return 404, json.dumps({"error": {"code": 404, "message": f"Unknown cached content {e}", "status": "NOT_FOUND"}})
+        except Exception as e:
+            return 400, json.dumps({"error": {"code": 400, "message": str(e), "status": "INVALID_ARGUMENT"}})
+        return 200, glm.GenerateContentResponse.to_json(self._response(text, usage_metadata))
+
+    def _rest_handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if REST_PATH_PATTERN.match(self.path.split("?", 1)[0]):
+                    status, payload = server._rest_generate(body)
+                else:
+                    status, payload = 404, json.dumps({"error": {"code": 404, "message": f"No route for {self.path}", "status": "NOT_FOUND"}})
+                payload = payload.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, grpc_port=0, http_port=0, host="127.0.0.1"):
+        """
+        Start both servers in the background and return (grpc_port, http_port)
+
+        Args:
+            grpc_port: Port for gRPC, 0 for any free port
+            http_port: Port for REST, 0 for any free port
+            host: Interface to listen on
+        """
+        self._grpc_server = grpc.server(ThreadPoolExecutor(max_workers=self.max_workers), handlers=self._grpc_handlers())
+        grpc_port = self._grpc_server.add_insecure_port(f"{host}:{grpc_port}")
+        self._grpc_server.start()
+
+        self._http_server = ThreadingHTTPServer((host, http_port), self._rest_handler_class())
+        self._http_server.daemon_threads = True
+        threading.Thread(target=self._http_server.serve_forever, name="fake-gemini-rest", daemon=True).start()
+        return grpc_port, self._http_server.server_address[1]
+
+    def stop(self):
+        """Stop both servers"""
+        if self._grpc_server is not None:
+            self._grpc_server.stop(grace=None)
+            self._grpc_server = None
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "latency": self.latency,
+                "error_rate": self.error_rate,
+                "error_code": self.error_code,
+                "response_chars": self.response_chars,
+                "requests": self._requests,
+                "errors": self._errors,
+                "cached_contents": len(self._caches)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Gemini API")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default 127.0.0.1)")
+    parser.add_argument("--grpc-port", type=int, default=0, help="gRPC port, 0 for any free port (default 0)")
+    parser.add_argument("--http-port", type=int, default=0, help="REST port, 0 for any free port (default 0)")
+    parser.add_argument("--latency", default="fixed:0",
+                        help="fixed:MS, uniform:LOW,HIGH, normal:MEAN,STDEV or lognormal:MEDIAN,SIGMA (default fixed:0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail, 0-1 (default 0)")
+    parser.add_argument("--error-code", default="UNAVAILABLE", choices=sorted(ERROR_HTTP_STATUS), help="Status of injected failures")
+    parser.add_argument("--response-chars", type=int, default=None, help="Pad answers to about this many characters")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency and failure draws")
+    parser.add_argument("--workers", type=int, default=64, help="Requests served concurrently (default 64)")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(args.latency, args.error_rate, args.error_code, args.response_chars, args.seed, args.workers)
+    grpc_port, http_port = server.start(args.grpc_port, args.http_port, args.host)
+    print(json.dumps({"grpc_port": grpc_port, "http_port": http_port}), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
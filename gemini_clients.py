@@ -0,0 +1,206 @@
+import datetime
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import grpc
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+
+from cassette import gemini_cassette
+from local_backend import local_backend
+
+# Primary model; lighter fallbacks and routing rules are configured in model_router.py
+DEFAULT_MODEL_NAME = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+
+# "gemini" talks to the real API; "local" uses the in-process stand-in from local_backend.py
+GEMINI_BACKEND = os.environ.get("GEMINI_BACKEND", "gemini").strip().lower()
+
+# host:port of a plaintext gRPC stand-in for the Gemini API, e.g. fake_gemini.py; unset uses the real API.
+# The Vercel function (api/) reads GEMINI_REST_ENDPOINT instead, so both can point at one stand-in.
+GEMINI_GRPC_ENDPOINT = os.environ.get("GEMINI_GRPC_ENDPOINT") or None
+
+# Upper bound on cached user-supplied keys; the environment key is never evicted
+MAX_CLIENTS = int(os.environ.get("GEMINI_CLIENT_CACHE_SIZE", 32))
+
+
+def key_fingerprint(api_key):
+    """Short, non-reversible identifier for an API key, safe for logs and metrics"""
+    if not api_key:
+        return "none"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class ClientRegistry:
+    """
+    Thread-safe LRU registry of Gemini model clients keyed by API key
+
+    Each API key gets its own GenerativeServiceClient, so requests never touch the
+    process-global genai.configure() state and concurrent users cannot race on it.
+    Model objects are built once per (key, model name) and reused across requests.
+    """
+
+    def __init__(self, max_size=MAX_CLIENTS, env_api_key=None, backend=GEMINI_BACKEND, endpoint=GEMINI_GRPC_ENDPOINT,
+                 cassette=gemini_cassette):
+        self.max_size = max_size
+        self.backend = backend
+        self.endpoint = endpoint
+        self.cassette = cassette
+        self.env_api_key = env_api_key if env_api_key is not None else os.environ.get("GEMINI_API_KEY")
+        self._lock = threading.Lock()
+        self._env_models = {}
+        self._user_models = OrderedDict()
+        self._cache_clients = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_model(self, api_key=None, model_name=DEFAULT_MODEL_NAME, is_async=False, cached_content=None):
+        """
+        Return a ready-to-use GenerativeModel for the given API key
+
+        Args:
+            api_key: User-supplied key from the api_key form field, or None for the env key
+            model_name: Gemini model to bind the client to
+            is_async: Return a model for generate_content_async. Async clients are bound to
+                the event loop they are created on, so only request these from the
+                service loop (see service_loop.py).
+            cached_content: Name of an upstream cached content to use as the prompt prefix
+        """
+        api_key = api_key or self.env_api_key
+        is_env_key = api_key == self.env_api_key
+        cache_key = (key_fingerprint(api_key), model_name, is_async)
+
+        with self._lock:
+            models = self._env_models if is_env_key else self._user_models
+            model = models.get(cache_key)
+            if model is not None:
+                self._hits += 1
+                if not is_env_key:
+                    self._user_models.move_to_end(cache_key)
+                return self._with_cached_content(model, model_name, cached_content)
+
+            self._misses += 1
+            model = self._build_model(api_key, model_name, is_async)
+            models[cache_key] = model
+
+            if not is_env_key and len(self._user_models) > self.max_size:
+                evicted_key, _ = self._user_models.popitem(last=False)
+                self._evictions += 1
+                logging.debug(f"Evicted Gemini client for key {evicted_key[0]}")
+
+            return self._with_cached_content(model, model_name, cached_content)
+
+    def _build_model(self, api_key, model_name, is_async):
+        """Create a model bound to its own per-key service client"""
+        logging.debug(f"Creating {'async ' if is_async else ''}Gemini client for key {key_fingerprint(api_key)} ({model_name})")
+        if self.backend == "local":
+            return local_backend.model(model_name)
+        model = genai.GenerativeModel(model_name)
+        if is_async:
+            model._async_client = self._service_client(glm.GenerativeServiceAsyncClient, api_key, is_async)
+        else:
+            model._client = self._service_client(glm.GenerativeServiceClient, api_key, is_async)
+        return model
+
+    def _service_client(self, client_class, api_key, is_async):
+        """
+        Build a service client for api_key, on a plaintext channel to self.endpoint when one is set
+
+        The stand-in endpoint does not check keys, so none is sent to it. Calls go through
+        the cassette when it records or replays (see cassette.py); a replaying cassette
+        answers everything itself, so no connection is made at all.
+        """
+        if self.cassette.mode == "replay":
+            return self.cassette.wrap(None, is_async)
+        if not self.endpoint:
+            return self.cassette.wrap(client_class(client_options={"api_key": api_key}), is_async)
+        transport_class = client_class.get_transport_class("grpc_asyncio" if is_async else "grpc")
+        channel = grpc.aio.insecure_channel(self.endpoint) if is_async else grpc.insecure_channel(self.endpoint)
+        return self.cassette.wrap(client_class(transport=transport_class(channel=channel)), is_async)
+
+    def _with_cached_content(self, model, model_name, cached_content):
+        """
+        Derive a model that uses an upstream cached content as its prompt prefix
+
+        The derived model shares the pooled service client, so it is cheap to build per
+        request and cached content rotation never grows the registry.
+        """
+        if not cached_content:
+            return model
+        if self.backend == "local":
+            return local_backend.model(model_name, cached_content)
+        derived = genai.GenerativeModel(model_name)
+        # Equivalent of GenerativeModel.from_cached_content without its extra lookup round trip
+        derived._cached_content = cached_content
+        derived._client = model._client
+        derived._async_client = model._async_client
+        return derived
+
+    async def create_cached_content(self, api_key, model_name, text, ttl_seconds):
+        """
+        Upload a prompt prefix as an upstream cached content
+
+        Must run on the service loop. Returns (cached content name, token count).
+        """
+        api_key = api_key or self.env_api_key
+        if self.backend == "local":
+            return local_backend.create_cached_content(model_name, text, ttl_seconds)
+
+        cache_client = self._cache_client(api_key)
+        cached_content = await cache_client.create_cached_content(
+            cached_content=glm.CachedContent(
+                model=f"models/{model_name}",
+                contents=[glm.Content(role="user", parts=[glm.Part(text=text)])],
+                ttl=datetime.timedelta(seconds=ttl_seconds)
+            )
+        )
+        return cached_content.name, cached_content.usage_metadata.total_token_count
+
+    def _cache_client(self, api_key):
+        """Return the pooled CacheServiceAsyncClient for api_key, building it on first use"""
+        cache_key = key_fingerprint(api_key)
+        with self._lock:
+            cache_client = self._cache_clients.get(cache_key)
+            if cache_client is not None:
+                self._cache_clients.move_to_end(cache_key)
+                return cache_client
+
+            cache_client = self._service_client(glm.CacheServiceAsyncClient, api_key, is_async=True)
+            self._cache_clients[cache_key] = cache_client
+            # The environment key's client is never evicted, as for the model clients
+            env_key = key_fingerprint(self.env_api_key)
+            while len(self._cache_clients) > self.max_size + (env_key in self._cache_clients):
+                evicted_key = next(key for key in self._cache_clients if key != env_key)
+                del self._cache_clients[evicted_key]
+                self._evictions += 1
+            return cache_client
+
+    def stats(self):
+        """Snapshot of registry size and hit/miss/eviction counters"""
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "endpoint": self.endpoint,
+                "cassette": self.cassette.mode,
+                "env_clients": len(self._env_models),
+                "user_clients": len(self._user_models),
+                "cache_clients": len(self._cache_clients),
+                "max_user_clients": self.max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }
+
+    def clear(self):
+        """Drop every cached client (e.g. after rotating the environment key)"""
+        with self._lock:
+            self._env_models.clear()
+            self._user_models.clear()
+            self._cache_clients.clear()
+
+
+# Shared registry used by the service layer
+client_registry = ClientRegistry()
@@ -1,15 +1,67 @@
-import json
+import asyncio
 import logging
+import math
 import os
-import google.generativeai as genai
-import json
-import logging
-import os
-import google.generativeai as genai
+import queue
+import time
 from google.generativeai import types
+from gemini_clients import client_registry, key_fingerprint
+from response_cache import response_cache, make_cache_key
+from stream_parser import StoryScriptStreamParser
+from service_loop import get_service_loop, run_on_service_loop
+from rate_limiter import rate_limiter, EXPECTED_OUTPUT_TOKENS
+from hedging import hedger
+from single_flight import SingleFlight
+from prompt_cache import context_cache, CACHED_TOKEN_DISCOUNT
+from local_backend import estimate_tokens
+from usage_ledger import usage_ledger, usage_counts
+from metrics import time_stage, STAGE_LATENCY, UPSTREAM_IN_FLIGHT
+from resilience import retry_policy, classify_error, UPSTREAM_TIMEOUT_SECONDS
+from model_router import model_router, FALLBACK_ERRORS
+from chunking import split_into_chunks
+from output_schema import OUTPUT_FIELDS, OUTPUT_REPAIRS, response_schema, parse_model_output, salvage_output, reask_instructions
+
+# Coalesces identical in-flight requests; only used from the service loop
+single_flight = SingleFlight()
+
+# Sampling settings per mode; they are part of the response cache key
+GENERATE_TEMPERATURE = 0.7
+HUMANIZE_TEMPERATURE = 0.8  # Slightly higher for more creative humanization
+TOP_P = 0.9
+
+# Retries are handled by resilience.retry_policy, so the SDK's own retry loop is turned off
+UPSTREAM_REQUEST_OPTIONS = {"retry": None, "timeout": UPSTREAM_TIMEOUT_SECONDS}
+
+# Upstream failures that mean a cached prompt prefix is unusable rather than upstream being unhealthy
+CACHED_PREFIX_ERRORS = ("not_found", "invalid_request", "permission_denied")
 
-# Initialize Gemini client
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# Raw scripts longer than this are condensed chunk by chunk, in parallel, before the humanize pass
+HUMANIZE_LONG_INPUT_CHARS = int(os.environ.get("HUMANIZE_LONG_INPUT_CHARS", 12000))
+HUMANIZE_CHUNK_CHARS = int(os.environ.get("HUMANIZE_CHUNK_CHARS", 6000))
+HUMANIZE_CHUNK_PARALLELISM = int(os.environ.get("HUMANIZE_CHUNK_PARALLELISM", 4))
+CONDENSE_TEMPERATURE = 0.3  # Condensing should stay faithful to the source
+# Condensed notes keep about this share of each chunk's words
+CONDENSE_RATIO = 0.25
+
+# Variations per request (story scripts, titles, descriptions and tag sets each get this many);
+# fewer variations mean fewer output tokens and a faster response
+DEFAULT_VARIATIONS = int(os.environ.get("DEFAULT_VARIATIONS", 3))
+MAX_VARIATIONS = int(os.environ.get("MAX_VARIATIONS", 5))
+
+# Generate each variation with its own smaller upstream call, all in parallel, unless a request says otherwise
+PARALLEL_VARIATIONS = os.environ.get("PARALLEL_VARIATIONS", "0").strip().lower() in ("1", "true", "yes", "on")
+# Angle given to each separately generated variation so the variations still differ from each other
+VARIATION_ANGLES = (
+    "Lead with the most gripping moment and tell it straight",
+    "Tell it from an unexpected angle or perspective",
+    "Focus on the human, emotional side of the story",
+    "Build it around a surprising fact or open question",
+    "Keep it fast-paced and end on a twist"
+)
+
+# Response shapes accepted by select_view() and the top-level fields a caller may pick
+RESPONSE_VIEWS = ("primary", "variations", "full")
+RESPONSE_FIELDS = ("title", "vo_script", "on_screen_text", "description", "hashtags", "notes", "variations")
 
 # System instructions optimized for storytelling and content creation
 SYSTEM_INSTRUCTIONS = """You are an advanced storytelling and content creation agent specialized in transforming raw subtitles or draft text into highly engaging YouTube Shorts scripts.
@@ -98,7 +150,7 @@ CORE_PROMPT = """Follow the SYSTEM INSTRUCTIONS for storytelling and content cre
 
 For each input, you must generate the following:
 
-STORY SCRIPT (3 variations):
+STORY SCRIPT (one per requested variation):
 - Written in compelling, conversational style
 - Structured to retain attention until the very end
 - Optimized for short-form pacing (30–60 seconds)
@@ -109,13 +161,13 @@ STORY SCRIPT (3 variations):
 - Concise but powerful delivery (every word adds value)
 - Call-to-thought (thought-provoking ending)
 
-VIDEO TITLE (3 variations):
+VIDEO TITLE (one per requested variation):
 - Click-worthy and curiosity-driven
 - Includes relevant keywords for better ranking
 - Short (max 70 characters)
 - Emotional triggers and hooks
 
-DESCRIPTION (3 variations):
+DESCRIPTION (one per requested variation):
 - Engaging and SEO-friendly
 - Includes relevant hashtags and keywords
 - Highlights core message/value of video
@@ -141,7 +193,7 @@ OUTPUT REQUIREMENTS:
 - Use natural, emotionally engaging language
 - Ensure the final script feels original and not copied from input
 
-OUTPUT SCHEMA:
+OUTPUT SCHEMA (every array has exactly one entry per requested variation, in the same order):
 {
   "story_scripts": [
     {
@@ -149,74 +201,129 @@ OUTPUT SCHEMA:
       "script": "Compelling story script text",
       "word_count": 120,
       "estimated_duration": "45 seconds"
-    },
-    {
-      "version": 2, 
-      "script": "Alternative story script text",
-      "word_count": 125,
-      "estimated_duration": "47 seconds"
-    },
-    {
-      "version": 3,
-      "script": "Third story script variation",
-      "word_count": 115,
-      "estimated_duration": "43 seconds"
     }
   ],
   "video_titles": [
-    "First title variation (max 70 chars)",
-    "Second title variation (max 70 chars)", 
-    "Third title variation (max 70 chars)"
+    "Title variation (max 70 chars)"
   ],
   "descriptions": [
-    "First description variation with SEO optimization",
-    "Second description with different angle",
-    "Third description focusing on engagement"
+    "Description variation with SEO optimization"
   ],
   "tags": [
-    ["tag1", "tag2", "tag3", "etc - at least 10 tags"],
-    ["different", "tag", "set", "for variation 2"],
-    ["third", "tag", "variation", "set"]
+    ["tag1", "tag2", "tag3", "etc - at least 10 tags"]
   ]
 }"""
 
-def generate_story_script(input_payload, custom_api_key=None, language="english"):
+
+def _generate_content(model, model_name, prompt, generation_config, call_stats, mode, stream=False):
     """
-    Generate YouTube Shorts script using Gemini API with storytelling techniques
+    Send a generate_content round trip, with retries, and count it against the current request
     
-    Args:
-        input_payload: Dictionary containing content details
-        custom_api_key: Optional custom API key
-        language: Language preference ("english" or "hindi")
+    Every upstream call made on behalf of a user request must go through here so that
+    notes["upstream_calls"] reflects the real Gemini cost of that request, retries included.
+    A streamed call's success is recorded with the model router once the stream is consumed.
     """
-    try:
-        # Validate language parameter
-        if language not in LANGUAGE_CONFIG:
-            return {"error": f"Unsupported language: {language}. Supported languages: {list(LANGUAGE_CONFIG.keys())}"}
-        
-        # Extract content details
-        content = input_payload.get('content', {})
-        generation = input_payload.get('generation', {})
-        
-        topic = content.get('topic', '')
-        genre = content.get('genre', 'informative')
-        description = content.get('description', '')
-        duration_seconds = generation.get('duration_seconds', 45)
-        
-        # Get language configuration
-        lang_config = LANGUAGE_CONFIG[language]
-        words_per_minute = lang_config["words_per_minute"]
-        
-        # Get genre-specific guidelines for the selected language
-        genre_guidance = GENRE_GUIDELINES.get(genre, GENRE_GUIDELINES['informative'])
-        if isinstance(genre_guidance, dict):
-            genre_guidance = genre_guidance.get(language, genre_guidance.get('english', ''))
-        
-        # Calculate target word count based on language
-        target_words = int((duration_seconds / 60) * words_per_minute)
-        
-        # Construct storytelling prompt with language-specific instructions
-        prompt = f"""{SYSTEM_INSTRUCTIONS}
+    def attempt():
+        call_stats["upstream_calls"] += 1
+        started = time.perf_counter()
+        try:
+            if stream:
+                return model.generate_content(prompt, generation_config=generation_config, stream=True, request_options=UPSTREAM_REQUEST_OPTIONS)
+            response = model.generate_content(prompt, generation_config=generation_config, request_options=UPSTREAM_REQUEST_OPTIONS)
+        except Exception as e:
+            model_router.record(model_name, time.perf_counter() - started, classify_error(e))
+            raise
+        model_router.record(model_name, time.perf_counter() - started)
+        return response
+    
+    return retry_policy.call_sync(attempt, mode, call_stats, model_name)
+
+
+async def _generate_content_async(model, model_name, prompt, generation_config, call_stats, mode, api_key, estimated_tokens):
+    """
+    Async counterpart of _generate_content; must run on the service loop
+
+    api_key and estimated_tokens are what a hedge of the call is charged to the rate limiter
+    with; the first attempt was charged by the caller.
+    """
+    async def attempt():
+        call_stats["upstream_calls"] += 1
+        started = time.perf_counter()
+        with UPSTREAM_IN_FLIGHT.track(mode=mode), time_stage("upstream_call", mode):
+            try:
+                response = await model.generate_content_async(prompt, generation_config=generation_config, request_options=UPSTREAM_REQUEST_OPTIONS)
+            except Exception as e:
+                model_router.record(model_name, time.perf_counter() - started, classify_error(e))
+                raise
+        model_router.record(model_name, time.perf_counter() - started)
+        return response
+    
+    # Each attempt may be hedged with a duplicate call when it runs unusually long, if the key has capacity for it
+    reserve_hedge = lambda: rate_limiter.try_acquire(api_key, estimated_tokens)
+    return await retry_policy.call(lambda: hedger.call(attempt, mode, call_stats, reserve_hedge), mode, call_stats, model_name)
+
+
+def _log_upstream_calls(mode, call_stats):
+    """Log how many upstream calls a request cost"""
+    logging.info(f"{mode} request used {call_stats['upstream_calls']} upstream call(s)")
+
+
+def _service_error(message, error):
+    """Error result carrying the typed error class (and retry hint) for the HTTP layer"""
+    result = {"error": message, "error_class": classify_error(error)}
+    if getattr(error, "retry_after", None) is not None:
+        result["retry_after"] = round(error.retry_after, 1)
+    return result
+
+
+def _unsupported_language_error(language):
+    return {"error": f"Unsupported language: {language}. Supported languages: {list(LANGUAGE_CONFIG.keys())}"}
+
+
+def _unsupported_variations_error(variations):
+    return {"error": f"variations must be between 1 and {MAX_VARIATIONS}, got {variations}"}
+
+
+def _humanize_prefix(language):
+    """Static humanization instructions for one language"""
+    lang_config = LANGUAGE_CONFIG[language]
+    
+    # System instructions for humanization with language support
+    humanization_instructions = f"""You are a storytelling script humanization expert. Your task is to take raw subtitle text or draft content and transform it into a compelling, natural-sounding story script optimized for YouTube Shorts in {lang_config["name"]}.
+
+Key principles:
+- Transform the content using advanced storytelling techniques
+- Make it sound conversational and engaging in {lang_config["name"]}
+- Use simple, everyday language that people actually connect with
+- Add natural speech patterns, pauses, and emotional inflections
+- Keep the core message and facts intact but make them compelling
+- Add storytelling elements: hooks, curiosity gaps, emotional beats
+- Remove any robotic or AI-sounding language
+- Add natural transitions and conversational connectors
+- Ensure it flows smoothly when spoken aloud and keeps viewers engaged
+- Create clear progression: beginning → conflict/problem → resolution/insight
+- End with thought-provoking conclusion that encourages engagement
+- Use {lang_config["name"]} natural phrases and expressions
+
+{lang_config["system_prompt_addition"]}
+
+Output the same JSON format with humanized content:"""
+
+    return f"""{humanization_instructions}
+
+{CORE_PROMPT}"""
+
+
+def _generate_prefix(genre, language):
+    """Static storytelling instructions for one genre and language"""
+    lang_config = LANGUAGE_CONFIG[language]
+    
+    # Get genre-specific guidelines for the selected language
+    genre_guidance = GENRE_GUIDELINES[genre]
+    if isinstance(genre_guidance, dict):
+        genre_guidance = genre_guidance.get(language, genre_guidance.get('english', ''))
+    
+    return f"""{SYSTEM_INSTRUCTIONS}
 
 LANGUAGE REQUIREMENTS:
 {lang_config["system_prompt_addition"]}
@@ -228,10 +335,65 @@ GENRE-SPECIFIC GUIDELINES ({lang_config["name"]}):
 
 LANGUAGE SETTINGS:
 - Target Language: {lang_config["name"]}
-- Speaking Rate: {words_per_minute} words per minute
-- Natural Phrases: {', '.join(lang_config["natural_phrases"])}
+- Speaking Rate: {lang_config["words_per_minute"]} words per minute
+- Natural Phrases: {', '.join(lang_config["natural_phrases"])}"""
+
+
+def _prefix_id(mode, genre, language):
+    if mode == "humanize":
+        return f"humanize:{language}"
+    return f"generate:{genre}:{language}"
+
+
+def _build_prompt_prefixes():
+    """Compile every static prompt prefix once so requests only format their variable suffix"""
+    prefixes = {}
+    for language in LANGUAGE_CONFIG:
+        prefixes[_prefix_id("humanize", None, language)] = _humanize_prefix(language)
+        for genre in GENRE_GUIDELINES:
+            prefixes[_prefix_id("generate", genre, language)] = _generate_prefix(genre, language)
+    return prefixes
+
+
+# Prefix id -> static prompt prefix, for every (mode, genre, language) combination
+PROMPT_PREFIXES = _build_prompt_prefixes()
+
 
-INPUT CONTENT TO TRANSFORM:
+def _variations_phrase(variations):
+    return "1 variation" if variations == 1 else f"{variations} variations"
+
+
+def _prepare_generate_request(input_payload, language, variations=DEFAULT_VARIATIONS):
+    """
+    Build the prompt, cache key and mode-specific notes for a generate request
+    
+    Args:
+        input_payload: Dictionary containing content details
+        language: Language preference ("english" or "hindi"), already validated
+        variations: Number of variations to generate, already validated
+    """
+    # Extract content details
+    content = input_payload.get('content', {})
+    generation = input_payload.get('generation', {})
+    
+    topic = content.get('topic', '')
+    genre = content.get('genre', 'informative')
+    description = content.get('description', '')
+    duration_seconds = generation.get('duration_seconds', 45)
+    
+    # Get language configuration
+    lang_config = LANGUAGE_CONFIG[language]
+    words_per_minute = lang_config["words_per_minute"]
+    
+    # Static instructions for this genre and language, compiled at import
+    prefix_id = _prefix_id("generate", genre if genre in GENRE_GUIDELINES else "informative", language)
+    
+    # Calculate target word count based on language
+    target_words = int((duration_seconds / 60) * words_per_minute)
+    model_name = model_router.route("generate", duration_seconds)
+    
+    # Request-specific part of the storytelling prompt
+    suffix = f"""INPUT CONTENT TO TRANSFORM:
 - Topic/Raw Content: {topic}
 - Genre: {genre.title()}
 - Target Duration: {duration_seconds} seconds (approximately {target_words} words)
@@ -247,276 +409,946 @@ TRANSFORM THIS CONTENT INTO COMPELLING STORYTELLING:
 5. End with thought-provoking conclusion
 6. Target timing: {duration_seconds} seconds = ~{target_words} words
 
-Generate 3 variations following the OUTPUT SCHEMA with story scripts, titles, descriptions, and tags."""
+Generate {_variations_phrase(variations)} following the OUTPUT SCHEMA with story scripts, titles, descriptions, and tags."""
+    
+    return {
+        "mode": "generate",
+        "model": model_name,
+        "variations": variations,
+        "prefix_id": prefix_id,
+        "suffix": suffix,
+        "prompt": f"{PROMPT_PREFIXES[prefix_id]}\n\n{suffix}",
+        "temperature": GENERATE_TEMPERATURE,
+        "cache_key": make_cache_key(
+            "generate",
+            {"topic": topic, "genre": genre, "description": description, "duration_seconds": duration_seconds, "language": language,
+             "variations": variations},
+            model=model_name, temperature=GENERATE_TEMPERATURE, top_p=TOP_P
+        ),
+        "labels": {"mode": "generate", "language": language, "genre": genre, "duration_seconds": duration_seconds},
+        "notes": {}
+    }
+
+
+def _prepare_humanize_request(raw_script, duration_seconds, language, variations=DEFAULT_VARIATIONS):
+    """
+    Build the prompt, cache key and mode-specific notes for a humanize request
+    
+    Args:
+        raw_script: The raw script text to humanize
+        duration_seconds: Target duration in seconds
+        language: Language preference ("english" or "hindi"), already validated
+        variations: Number of variations to generate, already validated
+    """
+    words_per_minute = LANGUAGE_CONFIG[language]["words_per_minute"]
+    prefix_id = _prefix_id("humanize", None, language)
+    
+    # Calculate target word count based on duration
+    target_words = int((duration_seconds / 60) * words_per_minute)
+    model_name = model_router.route("humanize", duration_seconds)
+    
+    # Request-specific part of the humanization prompt, with timing
+    suffix = f"""Target Duration: {duration_seconds} seconds (approximately {target_words} words)
+
+Original Raw Content to Transform:
+{raw_script}
+
+Please transform this content to:
+1. Sound completely natural and engaging with storytelling techniques
+2. Fit exactly {duration_seconds} seconds when spoken (around {target_words} words)
+3. Maintain the core message while making it compelling
+4. Add proper pacing with emotional beats and story progression
+5. Use advanced storytelling techniques: hooks, curiosity gaps, clear progression
+6. Create {_variations_phrase(variations)} following the OUTPUT SCHEMA"""
+
+    return {
+        "mode": "humanize",
+        "model": model_name,
+        "variations": variations,
+        "prefix_id": prefix_id,
+        "suffix": suffix,
+        "prompt": f"{PROMPT_PREFIXES[prefix_id]}\n\n{suffix}",
+        "temperature": HUMANIZE_TEMPERATURE,
+        "cache_key": make_cache_key(
+            "humanize",
+            {"raw_script": raw_script, "duration_seconds": duration_seconds, "language": language, "variations": variations},
+            model=model_name, temperature=HUMANIZE_TEMPERATURE, top_p=TOP_P
+        ),
+        "labels": {"mode": "humanize", "language": language, "genre": None, "duration_seconds": duration_seconds},
+        "notes": {
+            "humanized": True,
+            "original_length": len(raw_script),
+            "target_duration": f"{duration_seconds} seconds",
+            "processing": "Content transformed using storytelling techniques"
+        }
+    }
+
+
+def _generation_config(request, fields=None):
+    """Sampling settings plus the OUTPUT SCHEMA as a response schema, optionally restricted to some fields"""
+    return types.GenerationConfig(
+        temperature=request["temperature"],
+        top_p=TOP_P,
+        response_mime_type="application/json",
+        response_schema=response_schema(fields or OUTPUT_FIELDS, request["variations"])
+    )
+
+
+def _estimated_tokens(prompt, variations):
+    """Rate limit reservation for one call; EXPECTED_OUTPUT_TOKENS is sized for three variations"""
+    return estimate_tokens(prompt) + math.ceil(EXPECTED_OUTPUT_TOKENS * variations / 3)
+
+
+async def _convert_response(request, response_text, call_stats, reask=None):
+    """
+    Parse the model's JSON output and convert it to the single-result format the UI expects
+    
+    Truncated or partly invalid output is trimmed back to its complete variations. When some
+    fields are still missing, `reask(partial, missing)` is awaited for the text of a follow-up
+    answer containing only those fields, instead of failing the whole request.
+    
+    Returns the converted result, or an {"error": ...} dictionary when the output is unusable.
+    """
+    if not response_text:
+        return {"error": "Empty response from Gemini API"}
+    
+    with time_stage("json_parse", request["mode"]):
+        parsed, repaired = parse_model_output(response_text)
+        result, missing = salvage_output(parsed)
+    if parsed is None:
+        logging.error(f"Failed to parse JSON response: {response_text}")
+        OUTPUT_REPAIRS.inc(mode=request["mode"], outcome="failed")
+        return {"error": "Invalid JSON response from API"}
+    
+    output_repair = {"salvaged": repaired, "reasked": []}
+    if missing and result and reask is not None:
+        logging.warning(f"Response missing fields {missing}, asking for them again")
+        reasked_text = await reask(result, missing)
+        with time_stage("json_parse", request["mode"]):
+            reasked, _ = salvage_output(parse_model_output(reasked_text)[0], missing)
+        result.update(reasked)
+        output_repair["reasked"] = missing
+    
+    with time_stage("result_conversion", request["mode"]):
+        converted_result = _convert_result(request, result, call_stats)
+    if converted_result.get("error"):
+        OUTPUT_REPAIRS.inc(mode=request["mode"], outcome="failed")
+    elif output_repair["reasked"]:
+        OUTPUT_REPAIRS.inc(mode=request["mode"], outcome="reasked")
+        converted_result["notes"]["output_repair"] = output_repair
+    elif repaired:
+        OUTPUT_REPAIRS.inc(mode=request["mode"], outcome="salvaged")
+        converted_result["notes"]["output_repair"] = output_repair
+    return converted_result
+
+
+def _convert_result(request, result, call_stats):
+    """Validate parsed model output and build the converted result with its notes"""
+    # Validate required fields in response for new storytelling format
+    required_fields = ["story_scripts", "video_titles", "descriptions", "tags"]
+    missing_fields = [field for field in required_fields if field not in result]
+    
+    if missing_fields:
+        logging.warning(f"Response missing fields: {missing_fields}")
+        return {"error": f"Invalid response format: missing {missing_fields}"}
+    
+    # Validate that we have variations
+    if not isinstance(result.get("story_scripts"), list) or len(result["story_scripts"]) == 0:
+        return {"error": "No story script variations generated"}
+    
+    if request["mode"] == "generate" and (not isinstance(result.get("video_titles"), list) or len(result["video_titles"]) == 0):
+        return {"error": "No video title variations generated"}
+    
+    # Validate title lengths (max 70 characters)
+    for i, title in enumerate(result.get("video_titles", [])):
+        if len(title) > 70:
+            result["video_titles"][i] = title[:67] + "..."
+    
+    primary_script = result["story_scripts"][0]
+    notes = dict(request["notes"])
+    notes["upstream_calls"] = call_stats["upstream_calls"]
+    notes["retries"] = call_stats.get("retries", 0)
+    notes["hedged"] = call_stats.get("hedges", 0) > 0
+    notes["model"] = call_stats.get("model", request["model"])
+    notes["model_fallback"] = notes["model"] != request["model"]
+    notes["word_count"] = primary_script.get("word_count", 0)
+    if request["mode"] == "generate":
+        notes["duration_seconds"] = primary_script.get("estimated_duration", "45 seconds")
+    notes["variations_available"] = {
+        "story_scripts": len(result.get("story_scripts", [])),
+        "video_titles": len(result.get("video_titles", [])),
+        "descriptions": len(result.get("descriptions", [])),
+        "tag_sets": len(result.get("tags", []))
+    }
+    notes["full_response"] = result  # Raw model output, only sent to clients asking for view=full
+    
+    # Convert new format to old format for backward compatibility
+    # Take the first variation as the primary result
+    converted_result = {
+        "title": result["video_titles"][0] if result.get("video_titles") else "",
+        "vo_script": primary_script["script"],
+        "on_screen_text": [],  # Will be derived from script content
+        "description": result["descriptions"][0] if result.get("descriptions") else "",
+        "hashtags": result["tags"][0] if result.get("tags") else [],
+        "notes": notes
+    }
+    
+    # Generate on-screen text from script content (extract key phrases)
+    if converted_result["vo_script"]:
+        script_sentences = converted_result["vo_script"].split('. ')[:5]  # Take first 5 sentences
+        converted_result["on_screen_text"] = [sentence.split()[:3] for sentence in script_sentences if sentence.strip()]
+        converted_result["on_screen_text"] = [' '.join(words) + '...' for words in converted_result["on_screen_text"] if words]
+    
+    return converted_result
+
+
+def select_view(result, view="primary", fields=None):
+    """
+    Shape a converted result for a response, leaving out what the caller did not ask for
+    
+    Args:
+        result: Converted result from one of the service functions; errors pass through
+        view: "primary" (default) for the first variation only, "variations" for every
+            variation instead of the flattened primary one, or "full" for the result
+            as stored, including the raw model output in notes.full_response
+        fields: Optional top-level keys to keep, e.g. ["title", "vo_script"]
+    
+    The result is not copied deeply, so shaping is cheap even for long scripts.
+    """
+    if result.get("error") or view == "full":
+        shaped = result
+    else:
+        notes = {key: value for key, value in result["notes"].items() if key != "full_response"}
+        if view == "variations":
+            shaped = {"variations": result["notes"].get("full_response", {}), "notes": notes}
+        else:
+            shaped = dict(result, notes=notes)
+    if fields and not result.get("error"):
+        shaped = {key: shaped[key] for key in fields if key in shaped}
+    return shaped
+
+
+def _response_cache_key(request, custom_api_key):
+    """
+    Response cache key of a prepared request for the API key it is answered with
+
+    Results are never shared across keys: a user key must not be served output that was
+    paid for with, or produced under the quota and policies of, another key.
+    """
+    return f"{request['cache_key']}-{key_fingerprint(custom_api_key or client_registry.env_api_key)}"
+
+
+def _cached_result(request, custom_api_key):
+    """Look up a prepared request in the response cache and mark the hit in notes"""
+    cached_result = response_cache.get(_response_cache_key(request, custom_api_key))
+    if cached_result is not None:
+        cached_result["notes"]["cache"] = "hit"
+        cached_result["notes"]["upstream_calls"] = 0
+        cached_result["notes"]["retries"] = 0
+        cached_result["notes"]["queue_wait_ms"] = 0
+    return cached_result
+
+
+def _store_result(request, converted_result, use_cache, custom_api_key):
+    """Record the cache outcome in notes and keep successful results for later requests"""
+    if converted_result.get("error"):
+        return
+    if use_cache:
+        converted_result["notes"]["cache"] = "miss"
+        # A fallback model's output is not kept under the routed model's cache key
+        if not converted_result["notes"].get("model_fallback"):
+            response_cache.set(_response_cache_key(request, custom_api_key), converted_result)
+    else:
+        converted_result["notes"]["cache"] = "bypass"
+
+
+def _prefix_notes(request, api_key, model_name, cached_content, response=None):
+    """Describe the static prompt prefix and what caching it upstream saved on this request"""
+    prefix_tokens = context_cache.token_count(api_key, model_name, request["prefix_id"], PROMPT_PREFIXES[request["prefix_id"]])
+    cached_tokens = 0
+    if cached_content:
+        usage = getattr(response, "usage_metadata", None)
+        cached_tokens = getattr(usage, "cached_content_token_count", 0) or prefix_tokens
+    prefix_notes = {
+        "id": request["prefix_id"],
+        "tokens": prefix_tokens,
+        "suffix_tokens": estimate_tokens(request["suffix"]),
+        "cached_upstream": bool(cached_content),
+        "estimated_tokens_saved": round(cached_tokens * CACHED_TOKEN_DISCOUNT)
+    }
+    if not cached_content:
+        # Say why the prefix went inline: too small for Gemini to cache, caching off, or the create failed
+        prefix_notes["not_cached_reason"] = context_cache.skip_reason(PROMPT_PREFIXES[request["prefix_id"]]) or "cache_unavailable"
+        if prefix_notes["not_cached_reason"] == "below_min_tokens":
+            prefix_notes["min_tokens"] = context_cache.min_tokens
+    return prefix_notes
+
+
+def _record_usage(request, api_key, model_name, response, started):
+    """Write the token usage of one upstream call to the ledger and return its counts"""
+    counts = usage_counts(response)
+    latency_ms = (time.perf_counter() - started) * 1000
+    usage_ledger.record(key_fingerprint(api_key), request["labels"], model_name, counts, latency_ms)
+    return counts
+
+
+async def _settle_rate_limit(api_key, estimated_tokens, actual_tokens):
+    """Run rate_limiter.settle on the service loop, which owns the limiter state"""
+    rate_limiter.settle(api_key, estimated_tokens, actual_tokens)
+
+
+async def _send_to_model(request, custom_api_key, api_key, model_name, generation_config, call_stats):
+    """
+    Send a prepared request to one model, with only its suffix when the static prefix is cached upstream
+    
+    Returns (response, cached_content, started).
+    """
+    estimated_tokens = _estimated_tokens(request["prompt"], request["variations"])
+    cached_content = await context_cache.lookup(api_key, model_name, request["prefix_id"], PROMPT_PREFIXES[request["prefix_id"]])
+    if cached_content:
+        model = client_registry.get_model(custom_api_key, model_name=model_name, is_async=True, cached_content=cached_content)
+        try:
+            started = time.perf_counter()
+            response = await _generate_content_async(model, model_name, request["suffix"], generation_config, call_stats, request["mode"],
+                                                     api_key, estimated_tokens)
+            return response, cached_content, started
+        except Exception as e:
+            if classify_error(e) not in CACHED_PREFIX_ERRORS:
+                raise
+            # The cached content may have been deleted or expired early; fall back to the full prompt
+            logging.warning(f"Cached prefix {request['prefix_id']} rejected, sending full prompt: {str(e)}")
+            context_cache.invalidate(api_key, model_name, request["prefix_id"])
+    
+    # Per-key client from the registry; custom keys never touch global SDK state
+    model = client_registry.get_model(custom_api_key, model_name=model_name, is_async=True)
+    started = time.perf_counter()
+    response = await _generate_content_async(model, model_name, request["prompt"], generation_config, call_stats, request["mode"],
+                                             api_key, estimated_tokens)
+    return response, None, started
+
+
+async def _reask_missing(request, custom_api_key, api_key, model_name, partial, missing, call_stats, usage):
+    """
+    Ask the model that answered for only the fields its answer lacked and return the new text
+    
+    The follow-up reuses the request's prompt (and its upstream-cached prefix) with a response
+    schema restricted to the missing fields; its tokens are added to `usage`.
+    """
+    instructions = reask_instructions(partial, missing)
+    reask_request = dict(request, suffix=f"{request['suffix']}\n\n{instructions}", prompt=f"{request['prompt']}\n\n{instructions}")
+    estimated_tokens = _estimated_tokens(reask_request["prompt"], request["variations"])
+    # Part of the same user request, so the caller's bucket is not charged again
+    await rate_limiter.acquire(request["caller"], api_key, estimated_tokens, charge_caller=False)
+    response, _, started = await _send_to_model(
+        reask_request, custom_api_key, api_key, model_name, _generation_config(request, missing), call_stats
+    )
+    reask_usage = _record_usage(request, api_key, model_name, response, started)
+    rate_limiter.settle(api_key, estimated_tokens, reask_usage["total_tokens"])
+    for name, count in reask_usage.items():
+        usage[name] += count
+    return response.text
+
+
+async def _call_upstream(request, custom_api_key, use_cache, call_stats, store=True):
+    """
+    Make the upstream call for a prepared request, falling back to other models if needed, and convert its output
+    
+    With store=False the caller records the cache outcome itself via _store_result.
+    """
+    api_key = custom_api_key or client_registry.env_api_key
+    generation_config = _generation_config(request)
+    
+    # Wait for this caller's and the upstream key's rate limit capacity; fan-out requests were admitted already
+    estimated_tokens = _estimated_tokens(request["prompt"], request["variations"])
+    queue_wait = await rate_limiter.acquire(request["caller"], api_key, estimated_tokens, charge_caller=not request.get("caller_admitted"))
+    
+    # Try the routed model first (unless it is unhealthy), then lighter or alternate models
+    candidates = model_router.candidates(request["model"])
+    for index, model_name in enumerate(candidates):
+        try:
+            response, cached_content, started = await _send_to_model(request, custom_api_key, api_key, model_name, generation_config, call_stats)
+            break
+        except Exception as e:
+            error_class = classify_error(e)
+            if index + 1 == len(candidates) or error_class not in FALLBACK_ERRORS:
+                raise
+            model_router.record_fallback(request["mode"], model_name, candidates[index + 1], error_class)
+    call_stats["model"] = model_name
+    model_router.record_served(request["mode"], model_name)
+    usage = _record_usage(request, api_key, model_name, response, started)
+    rate_limiter.settle(api_key, estimated_tokens, usage["total_tokens"])
+    
+    converted_result = await _convert_response(
+        request, response.text, call_stats,
+        lambda partial, missing: _reask_missing(request, custom_api_key, api_key, model_name, partial, missing, call_stats, usage)
+    )
+    if not converted_result.get("error"):
+        converted_result["notes"]["prompt_prefix"] = _prefix_notes(request, api_key, model_name, cached_content, response)
+        converted_result["notes"]["usage"] = usage
+        converted_result["notes"]["queue_wait_ms"] = round(queue_wait * 1000, 1)
+    if store:
+        _store_result(request, converted_result, use_cache, custom_api_key)
+    return converted_result
+
+
+async def _run_request(request, custom_api_key, use_cache, call_stats, upstream=None):
+    """
+    Answer a prepared request from the cache, an identical in-flight call, or one upstream call
+    
+    upstream(), if given, replaces the single upstream call, e.g. with one call per variation.
+    """
+    upstream = upstream or (lambda: _call_upstream(request, custom_api_key, use_cache, call_stats))
+    if not use_cache:
+        return await upstream()
+    
+    # Serve repeated submissions of the same form from the response cache
+    cached_result = _cached_result(request, custom_api_key)
+    if cached_result is not None:
+        return cached_result
+    
+    # Identical concurrent requests on the same key share one upstream call
+    flight_key = (request["cache_key"], key_fingerprint(custom_api_key or client_registry.env_api_key))
+    converted_result, shared = await single_flight.run(flight_key, upstream)
+    if shared and not converted_result.get("error"):
+        converted_result["notes"]["cache"] = "coalesced"
+        converted_result["notes"]["upstream_calls"] = 0
+        converted_result["notes"]["retries"] = 0
+    return converted_result
+
+
+def _parallel_variation_requests(input_payload, language, variations, parallel_variations, caller):
+    """
+    One single-variation generate request per variation, each with its own angle
+    
+    Returns None when parallel generation does not apply (turned off, or only one variation).
+    """
+    if parallel_variations is None:
+        parallel_variations = PARALLEL_VARIATIONS
+    if not parallel_variations or variations < 2:
+        return None
+    variation_requests = []
+    for index in range(variations):
+        variation_request = _prepare_generate_request(input_payload, language, 1)
+        angle = f"This is variation {index + 1} of {variations}, generated separately. Angle: {VARIATION_ANGLES[index % len(VARIATION_ANGLES)]}."
+        variation_request["suffix"] = f"{variation_request['suffix']}\n{angle}"
+        variation_request["prompt"] = f"{variation_request['prompt']}\n{angle}"
+        variation_request["caller"] = caller
+        # The user request is charged to the caller once, in _call_upstream_parallel
+        variation_request["caller_admitted"] = True
+        variation_requests.append(variation_request)
+    return variation_requests
+
+
+async def _call_upstream_parallel(request, variation_requests, custom_api_key, use_cache, call_stats, on_variation=None, store=True):
+    """
+    Generate every variation with its own upstream call, all at once, and merge them into one result
+    
+    Variations are ordered by completion, so variation 1 is the first to finish; on_variation
+    (called on the service loop) receives each story script as soon as its call returns.
+    Failed variations are left out; the request only fails if all of them do.
+    """
+    admit_wait = await rate_limiter.admit(request["caller"])
+    started = time.perf_counter()
+    finished = []
+    
+    async def generate(variation_request):
+        variation_result = await _call_upstream(variation_request, custom_api_key, use_cache, call_stats, store=False)
+        if not variation_result.get("error"):
+            story_script = dict(variation_result["notes"]["full_response"]["story_scripts"][0], version=len(finished) + 1)
+            finished.append((round((time.perf_counter() - started) * 1000, 1), story_script, variation_result))
+            if on_variation is not None:
+                on_variation(story_script)
+        return variation_result
+    
+    outcomes = await asyncio.gather(*(generate(variation_request) for variation_request in variation_requests), return_exceptions=True)
+    if not finished:
+        first_failure = outcomes[0]
+        if isinstance(first_failure, BaseException):
+            raise first_failure
+        return first_failure
+    
+    merged = {"story_scripts": [], "video_titles": [], "descriptions": [], "tags": []}
+    for _, story_script, variation_result in finished:
+        full_response = variation_result["notes"]["full_response"]
+        merged["story_scripts"].append(story_script)
+        for field in ("video_titles", "descriptions", "tags"):
+            merged[field].extend(full_response.get(field, [])[:1])
+    
+    with time_stage("result_conversion", request["mode"]):
+        converted_result = _convert_result(request, merged, call_stats)
+    if not converted_result.get("error"):
+        first_notes = finished[0][2]["notes"]
+        usage = {name: sum(result["notes"]["usage"][name] for _, _, result in finished) for name in first_notes["usage"]}
+        converted_result["notes"]["prompt_prefix"] = first_notes["prompt_prefix"]
+        converted_result["notes"]["usage"] = usage
+        converted_result["notes"]["queue_wait_ms"] = round(admit_wait * 1000 + max(result["notes"]["queue_wait_ms"] for _, _, result in finished), 1)
+        converted_result["notes"]["parallel_variations"] = {
+            "calls": len(variation_requests),
+            "succeeded": len(finished),
+            "variation_ms": [elapsed_ms for elapsed_ms, _, _ in finished]
+        }
+    if store:
+        _store_result(request, converted_result, use_cache, custom_api_key)
+    return converted_result
+
+
+def _stream_parallel(request, variation_requests, custom_api_key, use_cache, call_stats):
+    """Stream a parallel-variations request: each story script as its call finishes, then the merged result"""
+    if use_cache:
+        cached_result = _cached_result(request, custom_api_key)
+        if cached_result is not None:
+            for story_script in cached_result["notes"]["full_response"]["story_scripts"]:
+                yield "variation", story_script
+            yield "result", cached_result
+            return
+    
+    # The calls run on the service loop; finished story scripts cross back to this thread through a queue
+    events = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        _call_upstream_parallel(request, variation_requests, custom_api_key, use_cache, call_stats, on_variation=events.put),
+        get_service_loop()
+    )
+    future.add_done_callback(lambda _: events.put(None))
+    while (story_script := events.get()) is not None:
+        yield "variation", story_script
+    
+    converted_result = future.result()
+    if converted_result.get("error"):
+        yield "error", converted_result["error"]
+        return
+    yield "result", converted_result
+
+
+def _condense_prompt(chunk, index, total, language):
+    max_words = max(100, int(len(chunk.split()) * CONDENSE_RATIO))
+    return f"""You are condensing part {index} of {total} of a long raw transcript so that a storyteller can later turn the whole transcript into one short script.
+
+Rewrite this part as dense notes in {LANGUAGE_CONFIG[language]["name"]}. Keep every fact, name, number and event in the order it happens, plus any striking quotes. Drop filler, repetition, greetings, timestamps and sponsor messages. Use at most {max_words} words and output plain text only.
+
+PART {index} OF {total}:
+{chunk}"""
+
+
+async def _condense_chunk(chunk, index, total, language, duration_seconds, custom_api_key, caller, call_stats):
+    """Condense one chunk of a long raw script into dense plain-text notes"""
+    api_key = custom_api_key or client_registry.env_api_key
+    prompt = _condense_prompt(chunk, index, total, language)
+    estimated_tokens = estimate_tokens(prompt) + int(estimate_tokens(chunk) * CONDENSE_RATIO)
+    # The long-input request was admitted once; its chunks only take the key's capacity
+    await rate_limiter.acquire(caller, api_key, estimated_tokens, charge_caller=False)
+    
+    # Condensing has its own routing mode, so GEMINI_MODEL_ROUTES can send it to a lighter model
+    model_name = model_router.candidates(model_router.route("condense", duration_seconds))[0]
+    model = client_registry.get_model(custom_api_key, model_name=model_name, is_async=True)
+    generation_config = types.GenerationConfig(temperature=CONDENSE_TEMPERATURE, top_p=TOP_P)
+    started = time.perf_counter()
+    response = await _generate_content_async(model, model_name, prompt, generation_config, call_stats, "condense", api_key, estimated_tokens)
+    
+    labels = {"mode": "condense", "language": language, "genre": None, "duration_seconds": duration_seconds}
+    usage = _record_usage({"labels": labels}, api_key, model_name, response, started)
+    rate_limiter.settle(api_key, estimated_tokens, usage["total_tokens"])
+    return response.text.strip()
+
+
+async def _condense_chunks(chunks, language, duration_seconds, custom_api_key, caller, call_stats, parallelism):
+    """Condense all chunks with at most `parallelism` calls in flight; the first failure cancels the rest"""
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+    
+    async def condense(index, chunk):
+        async with semaphore:
+            return await _condense_chunk(chunk, index, len(chunks), language, duration_seconds, custom_api_key, caller, call_stats)
+    
+    tasks = [asyncio.ensure_future(condense(index, chunk)) for index, chunk in enumerate(chunks, 1)]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _is_long_input(raw_script, long_input):
+    """long_input is True/False to force a mode, or None to decide by length"""
+    if long_input is None:
+        return len(raw_script) > HUMANIZE_LONG_INPUT_CHARS
+    return bool(long_input)
+
+
+async def _humanize_long_input(raw_script, duration_seconds, custom_api_key, language, use_cache, caller, call_stats,
+                               variations=DEFAULT_VARIATIONS, chunk_chars=None, parallelism=None):
+    """
+    Humanize a long raw script: split it into coherent chunks, condense them in parallel, then humanize the notes
+    
+    The result carries notes.long_input with the chunk counts and per-stage timings.
+    """
+    chunk_chars = chunk_chars or HUMANIZE_CHUNK_CHARS
+    parallelism = parallelism or HUMANIZE_CHUNK_PARALLELISM
+    stage_ms = {}
+    
+    started = time.perf_counter()
+    with time_stage("chunking", "humanize"):
+        chunks = split_into_chunks(raw_script, chunk_chars)
+    stage_ms["chunking"] = round((time.perf_counter() - started) * 1000, 1)
+    
+    model_name = model_router.route("humanize", duration_seconds)
+    cache_key = make_cache_key(
+        "humanize",
+        {"raw_script": raw_script, "duration_seconds": duration_seconds, "language": language, "chunk_chars": chunk_chars,
+         "variations": variations},
+        model=model_name, temperature=HUMANIZE_TEMPERATURE, top_p=TOP_P
+    )
+    if use_cache:
+        cached_result = _cached_result({"cache_key": cache_key}, custom_api_key)
+        if cached_result is not None:
+            return cached_result
+    
+    async def condense_and_humanize():
+        # One charge to the caller for the whole request, however many chunks it fans out into
+        admit_wait = await rate_limiter.admit(caller)
+        started = time.perf_counter()
+        with time_stage("condense", "humanize"):
+            condensed = await _condense_chunks(chunks, language, duration_seconds, custom_api_key, caller, call_stats, parallelism)
+        stage_ms["condense"] = round((time.perf_counter() - started) * 1000, 1)
         
-        # Use custom API key if provided
-        if custom_api_key:
-            genai.configure(api_key=custom_api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(
-            prompt,
-            generation_config=types.GenerationConfig(
-                temperature=0.7,
-                top_p=0.9,
-                response_mime_type="application/json"
-            )
-        )
+        with time_stage("prompt_build", "humanize"):
+            request = _prepare_humanize_request("\n\n".join(condensed), duration_seconds, language, variations)
+        request["caller"] = caller
+        request["caller_admitted"] = True
+        request["cache_key"] = cache_key
+        request["notes"]["original_length"] = len(raw_script)
         
-        if not response.text:
-            return {"error": "Empty response from Gemini API"}
+        started = time.perf_counter()
+        converted_result = await _call_upstream(request, custom_api_key, use_cache, call_stats, store=False)
+        stage_ms["humanize"] = round((time.perf_counter() - started) * 1000, 1)
+        if not converted_result.get("error"):
+            converted_result["notes"]["queue_wait_ms"] = round(admit_wait * 1000 + converted_result["notes"]["queue_wait_ms"], 1)
+            converted_result["notes"]["long_input"] = {
+                "chunks": len(chunks),
+                "chunk_chars": chunk_chars,
+                "parallelism": parallelism,
+                "original_chars": len(raw_script),
+                "condensed_chars": sum(len(notes) for notes in condensed),
+                "stage_ms": stage_ms
+            }
+        _store_result(request, converted_result, use_cache, custom_api_key)
+        return converted_result
+    
+    if not use_cache:
+        return await condense_and_humanize()
+    
+    # Identical long inputs submitted together share one condense-and-humanize run
+    flight_key = (cache_key, key_fingerprint(custom_api_key or client_registry.env_api_key))
+    converted_result, shared = await single_flight.run(flight_key, condense_and_humanize)
+    if shared and not converted_result.get("error"):
+        converted_result["notes"]["cache"] = "coalesced"
+        converted_result["notes"]["upstream_calls"] = 0
+        converted_result["notes"]["retries"] = 0
+    return converted_result
+
+
+async def _invalidate_prefix(api_key, model_name, prefix_id):
+    """Run context_cache.invalidate on the service loop, which owns the context cache"""
+    context_cache.invalidate(api_key, model_name, prefix_id)
+
+
+def _open_stream(request, custom_api_key, api_key, model_name, generation_config, call_stats):
+    """
+    Streamed, blocking counterpart of _send_to_model: only the suffix is sent when the prefix is cached upstream
+    
+    Returns (response, cached_content, started); the caller iterates the response.
+    """
+    cached_content = run_on_service_loop(context_cache.lookup(api_key, model_name, request["prefix_id"], PROMPT_PREFIXES[request["prefix_id"]]))
+    if cached_content:
+        model = client_registry.get_model(custom_api_key, model_name=model_name, cached_content=cached_content)
+        try:
+            started = time.perf_counter()
+            response = _generate_content(model, model_name, request["suffix"], generation_config, call_stats, request["mode"], stream=True)
+            return response, cached_content, started
+        except Exception as e:
+            if classify_error(e) not in CACHED_PREFIX_ERRORS:
+                raise
+            logging.warning(f"Cached prefix {request['prefix_id']} rejected, sending full prompt: {str(e)}")
+            run_on_service_loop(_invalidate_prefix(api_key, model_name, request["prefix_id"]))
+    
+    model = client_registry.get_model(custom_api_key, model_name=model_name)
+    started = time.perf_counter()
+    response = _generate_content(model, model_name, request["prompt"], generation_config, call_stats, request["mode"], stream=True)
+    return response, None, started
+
+
+def _stream_request(request, custom_api_key, use_cache, call_stats):
+    """
+    Answer a prepared request as a stream of events
+    
+    Yields ("variation", story_script) as soon as each story script is complete in the
+    model output, then a final ("result", converted_result) or ("error", message).
+    
+    Like _call_upstream, the stream uses the upstream-cached prefix and falls back to the
+    next model when it fails to start; once chunks have been sent it cannot switch models,
+    and a failure midway is recorded with the model router and ends the stream. Streams
+    are never hedged: a duplicate stream would resend variations the client already has.
+    """
+    if use_cache:
+        cached_result = _cached_result(request, custom_api_key)
+        if cached_result is not None:
+            for story_script in cached_result["notes"]["full_response"]["story_scripts"]:
+                yield "variation", story_script
+            yield "result", cached_result
+            return
+    
+    api_key = custom_api_key or client_registry.env_api_key
+    estimated_tokens = _estimated_tokens(request["prompt"], request["variations"])
+    queue_wait = run_on_service_loop(rate_limiter.acquire(request["caller"], api_key, estimated_tokens))
+    
+    generation_config = _generation_config(request)
+    parser = StoryScriptStreamParser()
+    chunks = []
+    last_chunk = None
+    with UPSTREAM_IN_FLIGHT.track(mode=request["mode"]):
+        # Fall back to lighter or alternate models while the stream has not started
+        candidates = model_router.candidates(request["model"])
+        for index, model_name in enumerate(candidates):
+            try:
+                response, cached_content, started = _open_stream(request, custom_api_key, api_key, model_name, generation_config, call_stats)
+                break
+            except Exception as e:
+                error_class = classify_error(e)
+                if index + 1 == len(candidates) or error_class not in FALLBACK_ERRORS:
+                    raise
+                model_router.record_fallback(request["mode"], model_name, candidates[index + 1], error_class)
+        call_stats["model"] = model_name
         
-        # Parse the JSON response
         try:
-            result = json.loads(response.text)
-            
-            # Validate required fields in response for new storytelling format
-            required_fields = ["story_scripts", "video_titles", "descriptions", "tags"]
-            missing_fields = [field for field in required_fields if field not in result]
-            
-            if missing_fields:
-                logging.warning(f"Response missing fields: {missing_fields}")
-                return {"error": f"Invalid response format: missing {missing_fields}"}
-            
-            # Validate that we have variations
-            if not isinstance(result.get("story_scripts"), list) or len(result["story_scripts"]) == 0:
-                return {"error": "No story script variations generated"}
-            
-            if not isinstance(result.get("video_titles"), list) or len(result["video_titles"]) == 0:
-                return {"error": "No video title variations generated"}
-            
-            # Validate title lengths (max 70 characters)
-            for i, title in enumerate(result.get("video_titles", [])):
-                if len(title) > 70:
-                    result["video_titles"][i] = title[:67] + "..."
-            
-            # Convert new format to old format for backward compatibility
-            # Take the first variation as the primary result
-            converted_result = {
-                "title": result["video_titles"][0] if result.get("video_titles") else "",
-                "vo_script": result["story_scripts"][0]["script"] if result.get("story_scripts") and len(result["story_scripts"]) > 0 else "",
-                "on_screen_text": [],  # Will be derived from script content
-                "description": result["descriptions"][0] if result.get("descriptions") else "",
-                "hashtags": result["tags"][0] if result.get("tags") else [],
-                "notes": {
-                    "word_count": result["story_scripts"][0].get("word_count", 0) if result.get("story_scripts") and len(result["story_scripts"]) > 0 else 0,
-                    "duration_seconds": result["story_scripts"][0].get("estimated_duration", "45 seconds") if result.get("story_scripts") and len(result["story_scripts"]) > 0 else "45 seconds",
-                    "variations_available": {
-                        "story_scripts": len(result.get("story_scripts", [])),
-                        "video_titles": len(result.get("video_titles", [])),
-                        "descriptions": len(result.get("descriptions", [])),
-                        "tag_sets": len(result.get("tags", []))
-                    },
-                    "full_response": result  # Include full response for advanced users
-                }
-            }
-            
-            # Generate on-screen text from script content (extract key phrases)
-            if converted_result["vo_script"]:
-                script_sentences = converted_result["vo_script"].split('. ')[:5]  # Take first 5 sentences
-                converted_result["on_screen_text"] = [sentence.split()[:3] for sentence in script_sentences if sentence.strip()]
-                converted_result["on_screen_text"] = [' '.join(words) + '...' for words in converted_result["on_screen_text"] if words]
-            
-            return converted_result
-            
-        except json.JSONDecodeError as e:
-            logging.error(f"Failed to parse JSON response: {e}")
-            logging.error(f"Raw response: {response.text}")
-            return {"error": "Invalid JSON response from API"}
+            for chunk in response:
+                last_chunk = chunk
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks that only carry finish/safety metadata have no text parts
+                    continue
+                chunks.append(text)
+                for story_script in parser.feed(text):
+                    yield "variation", story_script
+        except Exception as e:
+            model_router.record(model_name, time.perf_counter() - started, classify_error(e))
+            raise
+    
+    STAGE_LATENCY.observe(time.perf_counter() - started, stage="upstream_call", mode=request["mode"])
+    model_router.record(model_name, time.perf_counter() - started)
+    model_router.record_served(request["mode"], model_name)
+    
+    # The final chunk carries the usage metadata for the whole stream
+    usage = _record_usage(request, api_key, model_name, last_chunk, started)
+    run_on_service_loop(_settle_rate_limit(api_key, estimated_tokens, usage["total_tokens"]))
+    
+    converted_result = run_on_service_loop(_convert_response(
+        request, "".join(chunks), call_stats,
+        lambda partial, missing: _reask_missing(request, custom_api_key, api_key, model_name, partial, missing, call_stats, usage)
+    ))
+    if converted_result.get("error"):
+        yield "error", converted_result["error"]
+        return
+    converted_result["notes"]["prompt_prefix"] = _prefix_notes(request, api_key, model_name, cached_content, last_chunk)
+    converted_result["notes"]["usage"] = usage
+    converted_result["notes"]["queue_wait_ms"] = round(queue_wait * 1000, 1)
+    _store_result(request, converted_result, use_cache, custom_api_key)
+    yield "result", converted_result
+
+
+async def generate_story_script_async(input_payload, custom_api_key=None, language="english", use_cache=True, caller=None,
+                                      variations=DEFAULT_VARIATIONS, parallel_variations=None):
+    """
+    Generate YouTube Shorts script using Gemini API with storytelling techniques
+    
+    Runs on the service event loop without blocking a thread for the upstream round trip.
+    
+    Args:
+        input_payload: Dictionary containing content details
+        custom_api_key: Optional custom API key
+        language: Language preference ("english" or "hindi")
+        use_cache: Serve identical earlier requests from the response cache
+        caller: Identity the per-caller rate limit is charged to (client address or key)
+        variations: Number of variations to generate, 1 to MAX_VARIATIONS
+        parallel_variations: Generate each variation with its own upstream call, in parallel
+            (default PARALLEL_VARIATIONS); wall time is then close to that of one variation
+    """
+    call_stats = {"upstream_calls": 0}
+    try:
+        # Validate language parameter
+        if language not in LANGUAGE_CONFIG:
+            return _unsupported_language_error(language)
+        if not 1 <= variations <= MAX_VARIATIONS:
+            return _unsupported_variations_error(variations)
+        
+        with time_stage("prompt_build", "generate"):
+            request = _prepare_generate_request(input_payload, language, variations)
+            variation_requests = _parallel_variation_requests(input_payload, language, variations, parallel_variations, caller)
+        request["caller"] = caller
+        if variation_requests:
+            return await _run_request(request, custom_api_key, use_cache, call_stats, lambda: _call_upstream_parallel(
+                request, variation_requests, custom_api_key, use_cache, call_stats
+            ))
+        return await _run_request(request, custom_api_key, use_cache, call_stats)
         
     except Exception as e:
         logging.error(f"Gemini API error: {str(e)}")
-        return {"error": f"API call failed: {str(e)}"}
+        return _service_error(f"API call failed: {str(e)}", e)
+    finally:
+        _log_upstream_calls("generate", call_stats)
 
 
-def humanize_story_script(raw_script, duration_seconds=45, custom_api_key=None, language="english"):
+async def humanize_story_script_async(raw_script, duration_seconds=45, custom_api_key=None, language="english", use_cache=True, caller=None,
+                                      variations=DEFAULT_VARIATIONS, long_input=None, chunk_chars=None, chunk_parallelism=None):
     """
     Humanize an existing script to make it sound more natural and engaging for storytelling
     
+    Runs on the service event loop without blocking a thread for the upstream round trip.
+    Scripts longer than HUMANIZE_LONG_INPUT_CHARS are chunked, condensed in parallel and
+    then humanized in one final pass.
+    
     Args:
         raw_script: The raw script text to humanize
         duration_seconds: Target duration in seconds
         custom_api_key: Optional custom API key
         language: Language preference ("english" or "hindi")
+        use_cache: Serve identical earlier requests from the response cache
+        caller: Identity the per-caller rate limit is charged to (client address or key)
+        variations: Number of variations to generate, 1 to MAX_VARIATIONS
+        long_input: True or False to force the long-input mode, None to decide by length
+        chunk_chars: Chunk size for long inputs (default HUMANIZE_CHUNK_CHARS)
+        chunk_parallelism: Chunks condensed at once (default HUMANIZE_CHUNK_PARALLELISM)
     """
+    call_stats = {"upstream_calls": 0}
     try:
         # Validate language parameter
         if language not in LANGUAGE_CONFIG:
-            return {"error": f"Unsupported language: {language}. Supported languages: {list(LANGUAGE_CONFIG.keys())}"}
+            return _unsupported_language_error(language)
+        if not 1 <= variations <= MAX_VARIATIONS:
+            return _unsupported_variations_error(variations)
         
-        # Get language configuration
-        lang_config = LANGUAGE_CONFIG[language]
-        words_per_minute = lang_config["words_per_minute"]
+        if _is_long_input(raw_script, long_input):
+            return await _humanize_long_input(raw_script, duration_seconds, custom_api_key, language, use_cache, caller, call_stats,
+                                              variations, chunk_chars, chunk_parallelism)
         
-        # System instructions for humanization with language support
-        humanization_instructions = f"""You are a storytelling script humanization expert. Your task is to take raw subtitle text or draft content and transform it into a compelling, natural-sounding story script optimized for YouTube Shorts in {lang_config["name"]}.
-
-Key principles:
-- Transform the content using advanced storytelling techniques
-- Make it sound conversational and engaging in {lang_config["name"]}
-- Use simple, everyday language that people actually connect with
-- Add natural speech patterns, pauses, and emotional inflections
-- Keep the core message and facts intact but make them compelling
-- Add storytelling elements: hooks, curiosity gaps, emotional beats
-- Remove any robotic or AI-sounding language
-- Add natural transitions and conversational connectors
-- Ensure it flows smoothly when spoken aloud and keeps viewers engaged
-- Create clear progression: beginning → conflict/problem → resolution/insight
-- End with thought-provoking conclusion that encourages engagement
-- Use {lang_config["name"]} natural phrases and expressions
-
-{lang_config["system_prompt_addition"]}
-
-Output the same JSON format with humanized content:"""
-
-        # Calculate target word count based on duration
-        target_words = int((duration_seconds / 60) * words_per_minute)
+        with time_stage("prompt_build", "humanize"):
+            request = _prepare_humanize_request(raw_script, duration_seconds, language, variations)
+        request["caller"] = caller
+        return await _run_request(request, custom_api_key, use_cache, call_stats)
         
-        # Construct the humanization prompt with timing
-        prompt = f"""{humanization_instructions}
-
-{CORE_PROMPT}
+    except Exception as e:
+        logging.error(f"Gemini API error during humanization: {str(e)}")
+        return _service_error(f"Humanization failed: {str(e)}", e)
+    finally:
+        _log_upstream_calls("humanize", call_stats)
 
-Target Duration: {duration_seconds} seconds (approximately {target_words} words)
 
-Original Raw Content to Transform:
-{raw_script}
-
-Please transform this content to:
-1. Sound completely natural and engaging with storytelling techniques
-2. Fit exactly {duration_seconds} seconds when spoken (around {target_words} words)
-3. Maintain the core message while making it compelling
-4. Add proper pacing with emotional beats and story progression
-5. Use advanced storytelling techniques: hooks, curiosity gaps, clear progression
-6. Create 3 variations following the OUTPUT SCHEMA"""
+def generate_story_script(input_payload, custom_api_key=None, language="english", use_cache=True, caller=None,
+                          variations=DEFAULT_VARIATIONS, parallel_variations=None):
+    """Blocking wrapper around generate_story_script_async for WSGI views and scripts"""
+    return run_on_service_loop(generate_story_script_async(input_payload, custom_api_key, language, use_cache, caller, variations,
+                                                           parallel_variations))
 
-        # Use custom API key if provided
-        if custom_api_key:
-            genai.configure(api_key=custom_api_key)
-        
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(
-            prompt,
-            generation_config=types.GenerationConfig(
-                temperature=0.7,
-                top_p=0.9,
-                response_mime_type="application/json"
-            )
-        )
-        humanization_instructions = f"""You are a storytelling script humanization expert. Your task is to take raw subtitle text or draft content and transform it into a compelling, natural-sounding story script optimized for YouTube Shorts in {lang_config["name"]}.
 
-Key principles:
-- Transform the content using advanced storytelling techniques
-- Make it sound conversational and engaging in {lang_config["name"]}
-- Use simple, everyday language that people actually connect with
-- Add natural speech patterns, pauses, and emotional inflections
-- Keep the core message and facts intact but make them compelling
-- Add storytelling elements: hooks, curiosity gaps, emotional beats
-- Remove any robotic or AI-sounding language
-- Add natural transitions and conversational connectors
-- Ensure it flows smoothly when spoken aloud and keeps viewers engaged
-- Create clear progression: beginning → conflict/problem → resolution/insight
-- End with thought-provoking conclusion that encourages engagement
-- Use {lang_config["name"]} natural phrases and expressions
+def humanize_story_script(raw_script, duration_seconds=45, custom_api_key=None, language="english", use_cache=True, caller=None,
+                          variations=DEFAULT_VARIATIONS, long_input=None, chunk_chars=None, chunk_parallelism=None):
+    """Blocking wrapper around humanize_story_script_async for WSGI views and scripts"""
+    return run_on_service_loop(humanize_story_script_async(raw_script, duration_seconds, custom_api_key, language, use_cache, caller,
+                                                           variations, long_input, chunk_chars, chunk_parallelism))
 
-{lang_config["system_prompt_addition"]}
 
-Output the same JSON format with humanized content:"""
+def stream_story_script(mode, form_fields, custom_api_key=None, language="english", use_cache=True, caller=None,
+                        variations=DEFAULT_VARIATIONS, parallel_variations=None):
+    """
+    Streaming variant of generate_story_script / humanize_story_script
+    
+    Args:
+        mode: "generate" or "humanize"
+        form_fields: input_payload for generate, or {"raw_script", "duration_seconds"} for humanize
+        custom_api_key: Optional custom API key
+        language: Language preference ("english" or "hindi")
+        use_cache: Serve identical earlier requests from the response cache
+        caller: Identity the per-caller rate limit is charged to (client address or key)
+        variations: Number of variations to generate, 1 to MAX_VARIATIONS
+        parallel_variations: For generate, one upstream call per variation (default PARALLEL_VARIATIONS)
+    
+    Yields (event, data) tuples: "variation" for each completed story script,
+    then "result" with the converted result, or "error" with a message.
+    With parallel variations, the first variation event is the first call to finish.
+    Long humanize input is condensed first, so its variations arrive together at the end.
+    """
+    call_stats = {"upstream_calls": 0}
+    try:
+        if language not in LANGUAGE_CONFIG:
+            yield "error", _unsupported_language_error(language)["error"]
+            return
+        if not 1 <= variations <= MAX_VARIATIONS:
+            yield "error", _unsupported_variations_error(variations)["error"]
+            return
         
-        # Calculate target word count based on duration
-        target_words = int((duration_seconds / 60) * words_per_minute)
+        if mode == "humanize" and _is_long_input(form_fields["raw_script"], None):
+            converted_result = run_on_service_loop(_humanize_long_input(
+                form_fields["raw_script"], form_fields.get("duration_seconds", 45), custom_api_key, language, use_cache, caller, call_stats,
+                variations
+            ))
+            if converted_result.get("error"):
+                yield "error", converted_result["error"]
+                return
+            for story_script in converted_result["notes"]["full_response"]["story_scripts"]:
+                yield "variation", story_script
+            yield "result", converted_result
+            return
         
-        # Construct the humanization prompt with timing
-        prompt = f"""{humanization_instructions}
+        with time_stage("prompt_build", mode):
+            variation_requests = None
+            if mode == "humanize":
+                request = _prepare_humanize_request(form_fields["raw_script"], form_fields.get("duration_seconds", 45), language, variations)
+            else:
+                request = _prepare_generate_request(form_fields, language, variations)
+                variation_requests = _parallel_variation_requests(form_fields, language, variations, parallel_variations, caller)
+        request["caller"] = caller
+        if variation_requests:
+            yield from _stream_parallel(request, variation_requests, custom_api_key, use_cache, call_stats)
+            return
+        yield from _stream_request(request, custom_api_key, use_cache, call_stats)
+        
+    except Exception as e:
+        logging.error(f"Gemini API error while streaming {mode}: {str(e)}")
+        if classify_error(e) == "throttled":
+            yield "error", f"Rate limit exceeded, please retry in {e.retry_after:.0f} seconds"
+            return
+        yield "error", f"Streaming failed: {str(e)}"
+    finally:
+        _log_upstream_calls(mode, call_stats)
 
-{CORE_PROMPT}
 
-Target Duration: {duration_seconds} seconds (approximately {target_words} words)
+async def run_batch_async(jobs, concurrency):
+    """
+    Run many generate/humanize jobs with at most `concurrency` in flight at once
+    
+    Args:
+        jobs: List of (mode, service_kwargs) tuples; service_kwargs are the keyword
+            arguments of generate_story_script_async or humanize_story_script_async
+        concurrency: Maximum number of jobs awaiting Gemini at the same time
+    
+    Returns one entry per job, in order, with the result or error and its wall time.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    
+    async def run_job(index, mode, service_kwargs):
+        async with semaphore:
+            started = time.perf_counter()
+            if mode == "humanize":
+                result = await humanize_story_script_async(**service_kwargs)
+            else:
+                result = await generate_story_script_async(**service_kwargs)
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        
+        if result.get("error"):
+            return {"index": index, "status": "error", "error": result["error"], "elapsed_ms": elapsed_ms}
+        return {"index": index, "status": "ok", "result": result, "elapsed_ms": elapsed_ms}
+    
+    return await asyncio.gather(*(run_job(index, mode, kwargs) for index, (mode, kwargs) in enumerate(jobs)))
 
-Original Raw Content to Transform:
-{raw_script}
 
-Please transform this content to:
-1. Sound completely natural and engaging with storytelling techniques
-2. Fit exactly {duration_seconds} seconds when spoken (around {target_words} words)
-3. Maintain the core message while making it compelling
-4. Add proper pacing with emotional beats and story progression
-5. Use advanced storytelling techniques: hooks, curiosity gaps, clear progression
-6. Create 3 variations following the OUTPUT SCHEMA"""
-        
-        # Use custom API key if provided
-        if custom_api_key:
-            genai.configure(api_key=custom_api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(
-            prompt,
-            generation_config=types.GenerationConfig(
-                temperature=0.8,  # Slightly higher for more creative humanization
-                top_p=0.9,
-                response_mime_type="application/json"
-            )
-        )
-        
-        if not response.text:
-            return {"error": "Empty response from Gemini API"}
-        
-        # Parse the JSON response
-        try:
-            result = json.loads(response.text)
-            
-            # Validate required fields in response for new storytelling format
-            required_fields = ["story_scripts", "video_titles", "descriptions", "tags"]
-            missing_fields = [field for field in required_fields if field not in result]
-            
-            if missing_fields:
-                logging.warning(f"Response missing fields: {missing_fields}")
-                return {"error": f"Invalid response format: missing {missing_fields}"}
-            
-            # Validate that we have variations
-            if not isinstance(result.get("story_scripts"), list) or len(result["story_scripts"]) == 0:
-                return {"error": "No story script variations generated"}
-            
-            # Validate title lengths (max 70 characters)
-            for i, title in enumerate(result.get("video_titles", [])):
-                if len(title) > 70:
-                    result["video_titles"][i] = title[:67] + "..."
-            
-            # Convert new format to old format for backward compatibility
-            # Take the first variation as the primary result
-            converted_result = {
-                "title": result["video_titles"][0] if result.get("video_titles") else "",
-                "vo_script": result["story_scripts"][0]["script"] if result.get("story_scripts") and len(result["story_scripts"]) > 0 else "",
-                "on_screen_text": [],  # Will be derived from script content
-                "description": result["descriptions"][0] if result.get("descriptions") else "",
-                "hashtags": result["tags"][0] if result.get("tags") else [],
-                "notes": {
-                    "humanized": True,
-                    "original_length": len(raw_script),
-                    "target_duration": f"{duration_seconds} seconds",
-                    "processing": "Content transformed using storytelling techniques",
-                    "word_count": result["story_scripts"][0].get("word_count", 0) if result.get("story_scripts") and len(result["story_scripts"]) > 0 else 0,
-                    "variations_available": {
-                        "story_scripts": len(result.get("story_scripts", [])),
-                        "video_titles": len(result.get("video_titles", [])),
-                        "descriptions": len(result.get("descriptions", [])),
-                        "tag_sets": len(result.get("tags", []))
-                    },
-                    "full_response": result  # Include full response for advanced users
-                }
-            }
-            
-            # Generate on-screen text from script content (extract key phrases)
-            if converted_result["vo_script"]:
-                script_sentences = converted_result["vo_script"].split('. ')[:5]  # Take first 5 sentences
-                converted_result["on_screen_text"] = [sentence.split()[:3] for sentence in script_sentences if sentence.strip()]
-                converted_result["on_screen_text"] = [' '.join(words) + '...' for words in converted_result["on_screen_text"] if words]
-            
-            return converted_result
-            
-        except json.JSONDecodeError as e:
-            logging.error(f"Failed to parse JSON response: {e}")
-            logging.error(f"Raw response: {response.text}")
-            return {"error": "Invalid JSON response from API"}
-        
-    except Exception as e:
-        logging.error(f"Gemini API error during humanization: {str(e)}")
-        return {"error": f"Humanization failed: {str(e)}"}
+def run_batch(jobs, concurrency):
+    """Blocking wrapper around run_batch_async for WSGI views and scripts"""
+    return run_on_service_loop(run_batch_async(jobs, concurrency))
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import metrics
+
+# Hedging is opt-in: it trades extra upstream calls for a shorter latency tail
+HEDGE_ENABLED = os.environ.get("GEMINI_HEDGE", "0").strip().lower() in ("1", "true", "yes", "on")
+# Fire the hedge once the primary call is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", 95))
+# At most this share of calls may be hedged, so hedging can never double the cost
+HEDGE_MAX_RATE = float(os.environ.get("GEMINI_HEDGE_MAX_RATE", 0.1))
+# Recent latencies needed per mode before any hedge fires
+HEDGE_MIN_SAMPLES = int(os.environ.get("GEMINI_HEDGE_MIN_SAMPLES", 20))
+# Never hedge sooner than this, whatever the percentile says
+HEDGE_MIN_DELAY_SECONDS = 0.5
+LATENCY_WINDOW = 200
+
+HEDGES = metrics.registry.counter(
+    "story_hedged_calls_total", "Hedge calls fired and which call won", ("mode", "winner")
+)
+
+
+class LatencyTracker:
+    """Rolling window of recent successful upstream latencies per mode"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+
+    def record(self, mode, seconds):
+        self._samples.setdefault(mode, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, mode, percentile):
+        """Latency at the given percentile, or None without enough samples"""
+        samples = sorted(self._samples.get(mode, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def count(self, mode):
+        return len(self._samples.get(mode, ()))
+
+
+class Hedger:
+    """
+    Hedged requests: fire a second identical call when the first one is unusually slow
+
+    The first call to succeed wins and the other one is cancelled. The share of hedged
+    calls over the recent window is capped at max_rate. Only use from the service loop.
+    """
+
+    def __init__(self, enabled=HEDGE_ENABLED, percentile=HEDGE_PERCENTILE, max_rate=HEDGE_MAX_RATE,
+                 min_samples=HEDGE_MIN_SAMPLES, min_delay=HEDGE_MIN_DELAY_SECONDS):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = LatencyTracker()
+        self._recent = deque(maxlen=LATENCY_WINDOW)
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    def hedge_delay(self, mode):
+        """Seconds to wait before hedging a call in this mode, or None to not hedge"""
+        if not self.enabled or self.latencies.count(mode) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latencies.percentile(mode, self.percentile))
+
+    def _hedge_allowed(self):
+        recent_hedges = sum(self._recent)
+        return recent_hedges + 1 <= self.max_rate * max(len(self._recent), self.min_samples)
+
+    async def _timed(self, attempt, mode):
+        started = time.perf_counter()
+        result = await attempt()
+        self.latencies.record(mode, time.perf_counter() - started)
+        return result
+
+    async def call(self, attempt, mode, call_stats, reserve=None):
+        """
+        Await attempt(), hedging it with a second attempt() if it runs too long
+
+        Args:
+            attempt: Coroutine factory making one upstream call
+            mode: Request mode; latency percentiles are tracked per mode
+            call_stats: Per-request counters; "hedges" is incremented when a hedge fires
+            reserve: Called just before a hedge fires to charge it to the rate limiter;
+                returning False skips the hedge
+        """
+        delay = self.hedge_delay(mode)
+        primary = asyncio.ensure_future(self._timed(attempt, mode))
+        if delay is None:
+            self._recent.append(False)
+            return await primary
+
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._hedge_allowed() or (reserve is not None and not reserve()):
+                self._recent.append(False)
+                return await primary
+
+            self._recent.append(True)
+            self._hedges += 1
+            call_stats["hedges"] = call_stats.get("hedges", 0) + 1
+            logging.info(f"Hedging slow {mode} call after {delay * 1000:.0f}ms")
+            hedge = asyncio.ensure_future(self._timed(attempt, mode))
+            pending = {primary, hedge}
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is None:
+                        winner = "hedge" if finished is hedge else "primary"
+                        if winner == "hedge":
+                            self._hedge_wins += 1
+                        HEDGES.inc(mode=mode, winner=winner)
+                        return finished.result()
+                    first_error = first_error or finished.exception()
+            HEDGES.inc(mode=mode, winner="none")
+            raise first_error
+        finally:
+            # Cancel whichever call lost (or both, if our caller was cancelled)
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "max_rate": self.max_rate,
+            "hedges": self._hedges,
+            "hedge_wins": self._hedge_wins,
+            "recent_hedge_rate": round(sum(self._recent) / len(self._recent), 3) if self._recent else 0.0
+        }
+
+
+# Shared hedger used by the service layer
+hedger = Hedger()
@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent as-is; compressing them costs more than it saves
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))
+# Hashed static URLs never change content, so browsers may keep them for a year
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Compressed static files kept in memory, keyed by (etag, encoding)
+MAX_COMPRESSED_STATIC = 64
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json", "text/html", "text/css", "text/plain",
+    "text/javascript", "application/javascript"
+}
+
+_static_versions = {}
+_compressed_static = OrderedDict()
+_lock = threading.Lock()
+
+
+def supported_encodings():
+    """Content codings we can produce, best first"""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Pick the response encoding from an Accept-Encoding header value
+
+    Returns "br", "gzip" or None. Codings with q=0 are refused; among the rest the
+    highest q-value wins and ties go to brotli.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+
+    best, best_quality = None, 0.0
+    for coding in supported_encodings():
+        quality = accepted.get(coding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(body, encoding):
+    """Compress a body; gzip output is deterministic so ETags stay stable across requests"""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def should_compress(mimetype, size, content_encoding=None):
+    return content_encoding is None and mimetype in COMPRESSIBLE_MIMETYPES and size >= COMPRESSION_MIN_BYTES
+
+
+def static_version(static_folder, filename):
+    """Short content hash of a static file, or None if it does not exist"""
+    path = os.path.join(static_folder, filename)
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        cached = _static_versions.get(path)
+    if cached and cached[0] == modified:
+        return cached[1]
+    with open(path, "rb") as static_file:
+        version = hashlib.sha256(static_file.read()).hexdigest()[:12]
+    with _lock:
+        _static_versions[path] = (modified, version)
+    return version
+
+
+def _compressed_static_body(etag, body, encoding):
+    key = (etag, encoding)
+    with _lock:
+        if key in _compressed_static:
+            _compressed_static.move_to_end(key)
+            return _compressed_static[key]
+    compressed = compress(body, encoding)
+    with _lock:
+        _compressed_static[key] = compressed
+        while len(_compressed_static) > MAX_COMPRESSED_STATIC:
+            _compressed_static.popitem(last=False)
+    return compressed
+
+
+def _static_cache_control(app, response):
+    """Long-lived caching for content-hashed URLs, revalidation for everything else"""
+    filename = request.view_args.get("filename") if request.view_args else None
+    requested_version = request.args.get("v")
+    if filename and requested_version and requested_version == static_version(app.static_folder, filename):
+        response.headers["Cache-Control"] = f"public, max-age={STATIC_IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+
+
+def _finish_response(app, response):
+    """Add validators, answer If-None-Match with 304 and compress eligible bodies"""
+    is_static = request.endpoint == "static"
+    if is_static:
+        _static_cache_control(app, response)
+    if response.status_code != 200 or response.is_streamed and not is_static:
+        return response
+
+    conditional = request.method in ("GET", "HEAD")
+    if is_static:
+        # send_file streams from disk; static assets are small enough to read and keep compressed
+        response.direct_passthrough = False
+    if not conditional and response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    body = response.get_data()
+    encoding = etag = None
+    if should_compress(response.mimetype, len(body), response.headers.get("Content-Encoding")):
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        response.vary.add("Accept-Encoding")
+
+    if conditional:
+        # Each encoding is a different representation, so it gets its own ETag
+        etag = (response.get_etag()[0] if is_static else None) or hashlib.sha256(body).hexdigest()[:32]
+        variant_etag = f"{etag}-{encoding}" if encoding else etag
+        response.set_etag(variant_etag)
+        if request.if_none_match.contains(variant_etag):
+            response.status_code = 304
+            response.set_data(b"")
+            response.headers.pop("Content-Length", None)
+            return response
+
+    if encoding:
+        compressed = _compressed_static_body(etag, body, encoding) if is_static else compress(body, encoding)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    """
+    Register compression, conditional GET and hashed static URLs on a Flask app
+
+    url_for('static', filename=...) gains a ?v=<content hash> query, and requests for
+    the current hash are cached by browsers for a year. JSON, HTML, CSS and JS bodies
+    of at least COMPRESSION_MIN_BYTES are compressed with brotli or gzip, and GET
+    responses carry an ETag so repeat requests can be answered with 304.
+    """
+    @app.url_defaults
+    def _hashed_static_url(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            version = static_version(app.static_folder, values["filename"])
+            if version:
+                values["v"] = version
+
+    @app.after_request
+    def _compress_and_validate(response):
+        try:
+            return _finish_response(app, response)
+        except Exception as e:
+            # Never fail a request because of an optional transfer optimization
+            logging.warning(f"Skipping compression for {request.path}: {str(e)}")
+            return response
+
+    logging.info(f"HTTP compression enabled ({', '.join(supported_encodings())}, min {COMPRESSION_MIN_BYTES} bytes)")
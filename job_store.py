@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+# Default job database; app.config["JOB_DB_PATH"] overrides it (see JobStore.init_app)
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Finished jobs are deleted this long after completion
+JOB_TTL_SECONDS = float(os.environ.get("JOB_TTL_SECONDS", 24 * 3600))
+# Jobs another process started longer ago than this are assumed orphaned by a crash and requeued;
+# with several processes on one file it must exceed the longest job
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", 600))
+
+KEY_LOST_ERROR = "The API key for this job was lost when the server restarted; please submit it again"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    runner TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at);
+"""
+
+
+class JobStore:
+    """
+    SQLite-backed store for submitted generate/humanize jobs
+
+    Job status moves queued -> running -> done | failed. Every method opens its own
+    short-lived connection, so the store can be shared by request threads, worker
+    threads and several processes pointed at the same file. The file is created on
+    first use, not when the store is built.
+
+    User API keys never reach the database: they are held in this process's memory
+    until the job is claimed, and the row only names the process holding the key. Only
+    that process claims such a job; if it restarts the key is lost, and the job fails
+    once it has been queued for JOB_STALE_SECONDS.
+
+    A claimed job's row also names the process running it, so requeue_stale never takes
+    back a job this process is still running, however long it takes.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, ttl_seconds=JOB_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._held_keys = {}
+        # Identifies this process in job rows, as the holder of in-memory keys and as runner
+        self._process_id = uuid.uuid4().hex
+
+    def init_app(self, app):
+        """Take the database path from app.config["JOB_DB_PATH"] when the app sets one"""
+        with self._lock:
+            if self._schema_ready:
+                raise RuntimeError(f"Job store already opened {self.db_path}")
+            self.db_path = app.config.get("JOB_DB_PATH", self.db_path)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        with self._lock:
+            if not self._schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+                # Databases created before jobs recorded their runner
+                if "runner" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN runner TEXT")
+                self._schema_ready = True
+        return conn
+
+    def _exists(self):
+        """False until anything was stored, so reads do not create the file"""
+        return self._schema_ready or os.path.exists(self.db_path)
+
+    def submit(self, mode, service_kwargs):
+        """Queue a job and return its id; a custom_api_key is kept in memory, not in the row"""
+        job_id = uuid.uuid4().hex
+        payload = dict(service_kwargs)
+        api_key = payload.pop("custom_api_key", None)
+        if api_key:
+            payload["custom_api_key_holder"] = self._process_id
+            with self._lock:
+                self._held_keys[job_id] = api_key
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, mode, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                    (job_id, mode, json.dumps(payload, ensure_ascii=False), time.time())
+                )
+        except Exception:
+            with self._lock:
+                self._held_keys.pop(job_id, None)
+            raise
+        return job_id
+
+    def claim_next(self):
+        """Atomically move the oldest queued job this process can run to running and return it, or None"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """SELECT id, mode, payload FROM jobs
+                   WHERE status = 'queued' AND coalesce(json_extract(payload, '$.custom_api_key_holder'), ?) = ?
+                   ORDER BY created_at LIMIT 1""",
+                (self._process_id, self._process_id)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ?, runner = ? WHERE id = ?",
+                         (time.time(), self._process_id, row["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        service_kwargs = json.loads(row["payload"])
+        if service_kwargs.pop("custom_api_key_holder", None):
+            with self._lock:
+                service_kwargs["custom_api_key"] = self._held_keys.pop(row["id"], None)
+            if service_kwargs["custom_api_key"] is None:
+                # Requeued after its first run had already taken the key; never fall back to the env key
+                self.finish(row["id"], error=KEY_LOST_ERROR)
+                return self.claim_next()
+        return {"id": row["id"], "mode": row["mode"], "service_kwargs": service_kwargs}
+
+    def finish(self, job_id, result=None, error=None):
+        """
+        Record a job's outcome
+
+        The stored payload is blanked at the same time so user API keys are not kept
+        on disk once they are no longer needed.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, payload = '{}' WHERE id = ?",
+                ("failed" if error else "done", json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        """Return a job's status, timings and outcome, or None if unknown or expired"""
+        if not self._exists():
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT id, mode, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        job = {
+            "job_id": row["id"],
+            "mode": row["mode"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"]
+        }
+        if row["started_at"] is not None:
+            job["queue_ms"] = round((row["started_at"] - row["created_at"]) * 1000, 1)
+        if row["finished_at"] is not None and row["started_at"] is not None:
+            job["run_ms"] = round((row["finished_at"] - row["started_at"]) * 1000, 1)
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+    def requeue_stale(self, stale_seconds=JOB_STALE_SECONDS):
+        """
+        Put running jobs orphaned by a restart back in the queue
+
+        Only jobs run by another process are requeued; this process's own running jobs
+        are live however long they take. Jobs whose API key was held by another process that has not claimed them within
+        stale_seconds are failed instead, since their key is gone with that process.
+        """
+        if not self._exists():
+            return 0
+        cutoff = time.time() - stale_seconds
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """UPDATE jobs SET status = 'failed', finished_at = ?, payload = '{}',
+                       error = ?
+                   WHERE status IN ('queued', 'running') AND json_extract(payload, '$.custom_api_key_holder') != ?
+                         AND coalesce(started_at, created_at) < ?""",
+                (time.time(), KEY_LOST_ERROR, self._process_id, cutoff)
+            )
+            cursor = conn.execute(
+                """UPDATE jobs SET status = 'queued', started_at = NULL, runner = NULL
+                   WHERE status = 'running' AND coalesce(runner, '') != ? AND started_at < ?""",
+                (self._process_id, cutoff)
+            )
+        return cursor.rowcount
+
+    def purge_expired(self):
+        """Delete finished jobs older than the TTL"""
+        if not self._exists():
+            return 0
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - self.ttl_seconds,)
+            )
+        return cursor.rowcount
+
+    def counts(self):
+        """Number of jobs per status"""
+        if not self._exists():
+            return {}
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+class JobWorkerPool:
+    """
+    Background threads that drain the job store
+
+    Workers wake immediately when a job is submitted in this process and otherwise
+    poll, which also picks up jobs queued before a restart or by other processes.
+    """
+
+    POLL_SECONDS = 2.0
+    PURGE_EVERY_SECONDS = 60.0
+
+    def __init__(self, store, handlers, workers=JOB_WORKERS):
+        """
+        Args:
+            store: JobStore to drain
+            handlers: Dictionary of mode -> callable(**service_kwargs) returning a result dict
+            workers: Number of worker threads
+        """
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads once; resumes jobs interrupted by a previous shutdown"""
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return
+            requeued = self.store.requeue_stale()
+            if requeued:
+                logging.info(f"Requeued {requeued} interrupted job(s)")
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def notify(self):
+        """Wake an idle worker after a submit"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim_next()
+            except sqlite3.Error as e:
+                logging.error(f"Job store error: {e}")
+                job = None
+
+            if job is None:
+                self._maybe_purge()
+                self._wakeup.wait(self.POLL_SECONDS)
+                self._wakeup.clear()
+                continue
+
+            self._execute(job)
+
+    def _execute(self, job):
+        handler = self.handlers.get(job["mode"])
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job mode: {job['mode']}")
+            result = handler(**job["service_kwargs"])
+            if result.get("error"):
+                self.store.finish(job["id"], error=result["error"])
+            else:
+                self.store.finish(job["id"], result=result)
+        except Exception as e:
+            logging.error(f"Job {job['id']} failed: {str(e)}")
+            self.store.finish(job["id"], error=f"Job failed: {str(e)}")
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < self.PURGE_EVERY_SECONDS:
+            return
+        self._last_purge = now
+        try:
+            purged = self.store.purge_expired()
+            if purged:
+                logging.info(f"Purged {purged} expired job(s)")
+            requeued = self.store.requeue_stale()
+            if requeued:
+                logging.info(f"Requeued {requeued} stale job(s)")
+        except sqlite3.Error as e:
+            logging.error(f"Job housekeeping failed: {e}")
@@ -0,0 +1,133 @@
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used when no tokenizer is available"""
+    return max(1, len(text) // 4)
+
+
+def _prompt_text(contents):
+    """Flatten the prompt forms generate_content accepts (str, list of str/dicts) into text"""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return "\n".join(_prompt_text(part) for part in contents.get("parts", []))
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_prompt_text(part) for part in contents)
+    return str(getattr(contents, "text", contents))
+
+
+class LocalResponse:
+    """Mimics the parts of GenerateContentResponse the service layer reads"""
+
+    def __init__(self, text, prompt_tokens, cached_tokens=0):
+        self.text = text
+        output_tokens = estimate_tokens(text)
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens + cached_tokens,
+            cached_content_token_count=cached_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + cached_tokens + output_tokens
+        )
+
+
+class LocalModel:
+    """
+    Offline stand-in for genai.GenerativeModel
+
+    Returns well-formed story JSON derived deterministically from the prompt, so the
+    whole request path can run and be measured without network access or an API key.
+    """
+
+    def __init__(self, backend, model_name, cached_content=None):
+        self.backend = backend
+        self.model_name = model_name
+        self.cached_content = cached_content
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        prompt = _prompt_text(contents)
+        cached_tokens = 0
+        if self.cached_content:
+            cached_tokens = self.backend.cached_token_count(self.cached_content)
+        self.backend.record_request(self.model_name, prompt, self.cached_content)
+
+        text = self.backend.render_output(prompt)
+        response = LocalResponse(text, estimate_tokens(prompt), cached_tokens)
+        if stream:
+            return [SimpleNamespace(text=text[i:i + 64]) for i in range(0, len(text), 64)]
+        return response
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False, **kwargs):
+        return self.generate_content(contents, generation_config=generation_config, stream=stream, **kwargs)
+
+
+class LocalBackend:
+    """
+    In-process Gemini stand-in with its own context-cache registry
+
+    Selected with GEMINI_BACKEND=local. Keeps the last prompts it received so tests
+    can check what was actually sent upstream.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caches = {}
+        self._ids = itertools.count(1)
+        self.requests = []
+
+    def model(self, model_name, cached_content=None):
+        return LocalModel(self, model_name, cached_content)
+
+    def create_cached_content(self, model_name, text, ttl_seconds):
+        """Register a prompt prefix; returns (cache name, token count)"""
+        with self._lock:
+            name = f"cachedContents/local-{next(self._ids)}"
+            tokens = estimate_tokens(text)
+            self._caches[name] = {"model": model_name, "text": text, "tokens": tokens, "expires_at": time.time() + ttl_seconds}
+        return name, tokens
+
+    def cached_token_count(self, name):
+        with self._lock:
+            entry = self._caches.get(name)
+            if entry is None or entry["expires_at"] < time.time():
+                raise ValueError(f"Cached content {name} not found or expired")
+            return entry["tokens"]
+
+    def record_request(self, model_name, prompt, cached_content):
+        with self._lock:
+            self.requests.append({"model": model_name, "prompt": prompt, "cached_content": cached_content})
+            del self.requests[:-100]
+
+    @staticmethod
+    def render_output(prompt):
+        """Build a schema-valid story response that varies with the prompt, with as many variations as it asks for"""
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        topic_match = re.search(r"Topic/Raw Content: (.+)", prompt)
+        topic = topic_match.group(1).strip() if topic_match else f"story {seed}"
+        count_match = re.search(r"(?:Generate|Create) (\d+) variations? following", prompt)
+        versions = range(1, int(count_match.group(1)) + 1) if count_match else (1, 2, 3)
+        scripts = [
+            {
+                "version": version,
+                "script": f"Variation {version} about {topic}. Nobody expected what came next. And that changed everything.",
+                "word_count": 14,
+                "estimated_duration": "6 seconds"
+            }
+            for version in versions
+        ]
+        return json.dumps({
+            "story_scripts": scripts,
+            "video_titles": [f"{topic} - take {version}"[:70] for version in versions],
+            "descriptions": [f"Local test description {version} ({seed})" for version in versions],
+            "tags": [[f"tag{version}", "local", seed] for version in versions]
+        }, ensure_ascii=False)
+
+
+# Shared stand-in used when GEMINI_BACKEND=local
+local_backend = LocalBackend()
@@ -1,4 +1,5 @@
-from app import app
+from app import app, job_workers
 
 if __name__ == '__main__':
+    job_workers.start()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,190 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds; the long tail covers slow Gemini generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = registry.lock
+        self._values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) if labels[name] is not None else "" for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key in sorted(self._values):
+                lines.extend(self._render_sample(key, self._values[key]))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    """Value that goes up and down, e.g. requests currently in flight"""
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Increment for the duration of a with block"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values with cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                sample["counts"][index] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of a with block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            sample = self._values.get(self._key(labels))
+            return sample["count"] if sample else 0
+
+    def _render_sample(self, key, sample):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, sample["counts"]):
+            cumulative += count
+            bucket_labels = _format_labels(self.labelnames, key, ['le="%s"' % _format_value(bound)])
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        inf_labels = _format_labels(self.labelnames, key, ['le="+Inf"'])
+        lines.append(f"{self.name}_bucket{inf_labels} {sample['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(sample['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {sample['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide set of metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return Counter(self, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return Gauge(self, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return Histogram(self, name, documentation, labelnames, buckets)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    "story_requests_total", "Script requests by route, mode and HTTP status", ("route", "mode", "status")
+)
+ERRORS = registry.counter(
+    "story_errors_total", "Failed script requests by mode and error class", ("mode", "error_class")
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "story_requests_in_flight", "Script requests currently being handled", ("route",)
+)
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    "story_upstream_calls_in_flight", "Gemini calls currently awaiting a response", ("mode",)
+)
+REQUEST_LATENCY = registry.histogram(
+    "story_request_duration_seconds", "End-to-end script request latency", ("mode", "language", "genre")
+)
+STAGE_LATENCY = registry.histogram(
+    "story_stage_duration_seconds",
+    "Time spent per request stage: validation, prompt_build, upstream_call, json_parse, result_conversion, and chunking and condense for long humanize input",
+    ("stage", "mode")
+)
+
+
+def time_stage(stage, mode):
+    """Context manager recording how long one stage of a request took"""
+    return STAGE_LATENCY.time(stage=stage, mode=mode)
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+from gemini_clients import DEFAULT_MODEL_NAME
+from resilience import BREAKER_ERRORS, retry_policy
+
+# Lighter or alternate models tried, in order, when the routed model is overloaded
+FALLBACK_MODELS = [name.strip() for name in os.environ.get("GEMINI_FALLBACK_MODELS", "gemini-2.5-flash-lite").split(",") if name.strip()]
+# JSON list of routing rules, first match wins; every key but "model" is optional, e.g.
+# [{"mode": "humanize", "max_duration": 30, "model": "gemini-2.5-flash-lite"}]
+MODEL_ROUTES = json.loads(os.environ.get("GEMINI_MODEL_ROUTES") or "[]")
+# A model is skipped while this share of its recent calls failed with overload-type errors
+# (BREAKER_ERRORS; 429s are per-key quota errors and never mark a model unhealthy for everyone)
+ROUTER_MAX_ERROR_RATE = float(os.environ.get("GEMINI_ROUTER_MAX_ERROR_RATE", 0.5))
+# ... or while its median latency over recent calls is above this many seconds; 0 disables
+ROUTER_MAX_LATENCY_SECONDS = float(os.environ.get("GEMINI_ROUTER_MAX_LATENCY", 0))
+# Recent calls needed before a model's health is judged, and how long calls count as recent
+ROUTER_MIN_SAMPLES = 5
+ROUTER_WINDOW_SECONDS = 60
+ROUTER_WINDOW_CALLS = 50
+
+# Error classes after which another model may still succeed; Gemini quotas are per key and
+# model, so a rate-limited key may still be served by a fallback, but only for its own request
+FALLBACK_ERRORS = {"overloaded", "rate_limited", "server_error", "timeout", "not_found"}
+
+MODEL_REQUESTS = metrics.registry.counter(
+    "story_model_requests_total", "Script requests by the model that served them", ("mode", "model")
+)
+MODEL_CALLS = metrics.registry.counter(
+    "story_model_calls_total", "Gemini call attempts per model by outcome (ok or error class)", ("model", "outcome")
+)
+MODEL_FALLBACKS = metrics.registry.counter(
+    "story_model_fallbacks_total", "Requests moved from one model to a fallback model", ("mode", "from_model", "to_model")
+)
+
+
+def _rule_matches(rule, mode, duration_seconds):
+    if rule.get("mode") not in (None, mode):
+        return False
+    if "min_duration" in rule and duration_seconds < rule["min_duration"]:
+        return False
+    if "max_duration" in rule and duration_seconds > rule["max_duration"]:
+        return False
+    return True
+
+
+class ModelHealth:
+    """Outcomes of one model's recent calls: (finished_at, latency_seconds, error_class or None)"""
+
+    def __init__(self, window_calls=ROUTER_WINDOW_CALLS, window_seconds=ROUTER_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._calls = deque(maxlen=window_calls)
+
+    def record(self, latency, error_class=None):
+        self._calls.append((time.time(), latency, error_class))
+
+    def snapshot(self):
+        cutoff = time.time() - self.window_seconds
+        recent = [call for call in list(self._calls) if call[0] >= cutoff]
+        failures = sum(1 for _, _, error_class in recent if error_class in BREAKER_ERRORS)
+        latencies = sorted(latency for _, latency, error_class in recent if error_class is None)
+        return {
+            "calls": len(recent),
+            "error_rate": round(failures / len(recent), 3) if recent else 0.0,
+            "p50_latency_seconds": round(latencies[len(latencies) // 2], 3) if latencies else None
+        }
+
+
+class ModelRouter:
+    """
+    Pick the Gemini model for each request and the fallbacks to try if it is overloaded
+
+    Requests are first routed by mode and duration_seconds using the configured rules
+    (the primary model when none match). At call time the routed model is moved behind
+    the fallback models while it is unhealthy: its circuit breaker is open, too many of
+    its recent calls failed, or it has become too slow. Thread-safe.
+    """
+
+    def __init__(self, primary=DEFAULT_MODEL_NAME, fallbacks=FALLBACK_MODELS, routes=MODEL_ROUTES,
+                 max_error_rate=ROUTER_MAX_ERROR_RATE, max_latency=ROUTER_MAX_LATENCY_SECONDS,
+                 min_samples=ROUTER_MIN_SAMPLES, breaker_for=retry_policy.breaker):
+        for rule in routes:
+            if not rule.get("model"):
+                raise ValueError(f"Model route {rule} has no model")
+        self.primary = primary
+        self.fallbacks = list(fallbacks)
+        self.routes = list(routes)
+        self.max_error_rate = max_error_rate
+        self.max_latency = max_latency
+        self.min_samples = min_samples
+        self.breaker_for = breaker_for
+        self._lock = threading.Lock()
+        self._health = {}
+        self._fallbacks_taken = 0
+
+    def route(self, mode, duration_seconds):
+        """Model tier for a request before upstream health is taken into account"""
+        for rule in self.routes:
+            if _rule_matches(rule, mode, duration_seconds):
+                return rule["model"]
+        return self.primary
+
+    def _health_of(self, model_name):
+        with self._lock:
+            health = self._health.get(model_name)
+            if health is None:
+                health = self._health[model_name] = ModelHealth()
+            return health
+
+    def healthy(self, model_name):
+        if self.breaker_for(model_name).is_open:
+            return False
+        snapshot = self._health_of(model_name).snapshot()
+        if snapshot["calls"] < self.min_samples:
+            return True
+        if snapshot["error_rate"] >= self.max_error_rate:
+            return False
+        latency = snapshot["p50_latency_seconds"]
+        return not (self.max_latency and latency is not None and latency > self.max_latency)
+
+    def candidates(self, model_name):
+        """
+        Models to try for a request routed to model_name, best first
+
+        Healthy models keep their configured order (routed model, primary, fallbacks);
+        unhealthy ones are still tried last rather than failing the request outright.
+        """
+        chain = []
+        for name in [model_name, self.primary] + self.fallbacks:
+            if name not in chain:
+                chain.append(name)
+        healthy = [name for name in chain if self.healthy(name)]
+        return healthy + [name for name in chain if name not in healthy]
+
+    def record(self, model_name, latency, error_class=None):
+        """Record the outcome of one call attempt to model_name"""
+        self._health_of(model_name).record(latency, error_class)
+        MODEL_CALLS.inc(model=model_name, outcome=error_class or "ok")
+
+    def record_fallback(self, mode, from_model, to_model, error_class):
+        with self._lock:
+            self._fallbacks_taken += 1
+        MODEL_FALLBACKS.inc(mode=mode, from_model=from_model, to_model=to_model)
+        logging.warning(f"{mode} call to {from_model} failed with {error_class}, falling back to {to_model}")
+
+    def record_served(self, mode, model_name):
+        MODEL_REQUESTS.inc(mode=mode, model=model_name)
+
+    def stats(self):
+        with self._lock:
+            tracked = list(self._health)
+            fallbacks_taken = self._fallbacks_taken
+        return {
+            "primary": self.primary,
+            "fallbacks": self.fallbacks,
+            "routes": self.routes,
+            "fallbacks_taken": fallbacks_taken,
+            "models": {
+                name: dict(self._health_of(name).snapshot(), healthy=self.healthy(name))
+                for name in tracked
+            }
+        }
+
+
+# Shared router used by the service layer
+model_router = ModelRouter()
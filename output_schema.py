@@ -0,0 +1,162 @@
+import json
+import re
+
+import metrics
+
+# Top-level fields of a story response, in the order the model writes them
+OUTPUT_FIELDS = ("story_scripts", "video_titles", "descriptions", "tags")
+# Cut points tried, from the end, when closing off truncated JSON
+MAX_REPAIR_CANDIDATES = 200
+
+OUTPUT_REPAIRS = metrics.registry.counter(
+    "story_output_repairs_total",
+    "Model outputs that needed repair: salvaged (truncated or partly invalid), reasked (missing fields requested again) or failed",
+    ("mode", "outcome")
+)
+
+_FIELD_SCHEMAS = {
+    "story_scripts": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "version": {"type": "integer"},
+                "script": {"type": "string"},
+                "word_count": {"type": "integer"},
+                "estimated_duration": {"type": "string"}
+            },
+            "required": ["version", "script", "word_count", "estimated_duration"]
+        }
+    },
+    "video_titles": {"type": "array", "items": {"type": "string"}},
+    "descriptions": {"type": "array", "items": {"type": "string"}},
+    "tags": {"type": "array", "items": {"type": "array", "items": {"type": "string"}}}
+}
+
+_CLOSERS = {"{": "}", "[": "]"}
+_FENCE_PATTERN = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def response_schema(fields=OUTPUT_FIELDS, variations=3):
+    """
+    Machine-readable OUTPUT SCHEMA for GenerationConfig.response_schema
+
+    Args:
+        fields: Top-level fields the response must contain
+        variations: Number of entries each field's array must have
+    """
+    properties = {}
+    for field in fields:
+        properties[field] = dict(_FIELD_SCHEMAS[field], min_items=variations, max_items=variations)
+    return {"type": "object", "properties": properties, "required": list(fields)}
+
+
+def _close_truncated(text):
+    """
+    Parse JSON that was cut off or broken part-way, keeping every value completed before the damage
+
+    Cut points are the ends of complete values inside open containers; the latest cut that
+    parses once its open brackets are closed wins. Returns None if nothing parses.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    stack = []
+    cut_points = []
+    in_string = escaped = False
+    for pos in range(start, len(text)):
+        char = text[pos]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                # A complete object followed by trailing text
+                cut_points.append((pos + 1, ()))
+                break
+            cut_points.append((pos + 1, tuple(stack)))
+        elif char == "," and stack:
+            cut_points.append((pos, tuple(stack)))
+
+    for cut, open_brackets in reversed(cut_points[-MAX_REPAIR_CANDIDATES:]):
+        candidate = text[start:cut].rstrip().rstrip(",") + "".join(_CLOSERS[bracket] for bracket in reversed(open_brackets))
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def parse_model_output(text):
+    """
+    Parse model JSON leniently
+
+    Returns (parsed, repaired): repaired is True when the text was not valid JSON as sent
+    and had to be trimmed back to its last complete values. parsed is None if nothing was usable.
+    """
+    text = _FENCE_PATTERN.sub("", text or "")
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        return _close_truncated(text), True
+
+
+def _is_story_script(item):
+    return isinstance(item, dict) and isinstance(item.get("script"), str) and bool(item["script"].strip())
+
+
+def _is_text(item):
+    return isinstance(item, str) and bool(item.strip())
+
+
+def _is_tag_set(item):
+    return isinstance(item, list) and any(_is_text(tag) for tag in item)
+
+
+_VALIDATORS = {
+    "story_scripts": _is_story_script,
+    "video_titles": _is_text,
+    "descriptions": _is_text,
+    "tags": _is_tag_set
+}
+
+
+def salvage_output(parsed, fields=OUTPUT_FIELDS):
+    """
+    Keep the well-formed entries of each field and report which fields have none
+
+    Returns (result, missing). Fields with no usable entries are left out of result, so
+    callers can request just those again.
+    """
+    if not isinstance(parsed, dict):
+        return {}, list(fields)
+    result = {}
+    for field in fields:
+        entries = parsed.get(field)
+        if not isinstance(entries, list):
+            continue
+        valid = [entry for entry in entries if _VALIDATORS[field](entry)]
+        if field == "tags":
+            valid = [[tag for tag in tag_set if _is_text(tag)] for tag_set in valid]
+        if valid:
+            result[field] = valid
+    return result, [field for field in fields if field not in result]
+
+
+def reask_instructions(partial, missing):
+    """Follow-up instructions asking only for the fields a previous answer lacked"""
+    return f"""Your previous answer was cut off or malformed. These parts of it were usable and are kept as they are:
+{json.dumps(partial, ensure_ascii=False)}
+
+Return ONLY a JSON object with these keys: {", ".join(missing)}. Match them to the story scripts above and follow the OUTPUT SCHEMA."""
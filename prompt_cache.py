@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from gemini_clients import client_registry, key_fingerprint
+from local_backend import estimate_tokens
+
+# Upstream context caching of the static prompt prefixes; set to 0 to always send full prompts
+CONTEXT_CACHE_ENABLED = os.environ.get("GEMINI_CONTEXT_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", 3600))
+# Gemini rejects cached contents below a model-specific minimum size; the humanize prefixes
+# (about 860 tokens) fall below the default, so they are always sent inline
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", 1024))
+# Upper bound on remembered (key, model, prefix) entries; each user key adds one per prefix it uses
+CONTEXT_CACHE_MAX_ENTRIES = int(os.environ.get("CONTEXT_CACHE_MAX_ENTRIES", 256))
+# Share of the normal input price saved on tokens served from a cached content
+CACHED_TOKEN_DISCOUNT = 0.75
+# Recreate a cached content this long before it expires upstream
+REFRESH_MARGIN_SECONDS = 60
+# After a failed create, send full prompts for this long before trying again
+FAILURE_BACKOFF_SECONDS = 300
+
+
+class ContextCache:
+    """
+    Registers static prompt prefixes as upstream cached contents, per API key
+
+    Cached contents belong to the project of the key that created them, so entries are
+    keyed by (key fingerprint, model, prefix id). Each entry is created on first use and
+    recreated shortly before its TTL runs out; the least recently used entries are
+    forgotten beyond max_entries (their cached contents simply expire upstream). Only use
+    from the service loop.
+    """
+
+    def __init__(self, enabled=CONTEXT_CACHE_ENABLED, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS, min_tokens=CONTEXT_CACHE_MIN_TOKENS,
+                 max_entries=CONTEXT_CACHE_MAX_ENTRIES):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._locks = OrderedDict()
+        self._failed_until = OrderedDict()
+        self._created = 0
+        self._reused = 0
+        self._failures = 0
+        self._too_small = 0
+        self._evictions = 0
+
+    async def lookup(self, api_key, model_name, prefix_id, prefix_text):
+        """
+        Return the cached content name to use for a prefix, or None to send the full prompt
+
+        Args:
+            api_key: Key the request will be sent with (user key or environment key)
+            model_name: Model the cached content must be created for
+            prefix_id: Stable identifier of the prefix, e.g. "generate:thriller:english"
+            prefix_text: The prefix itself
+        """
+        skip_reason = self.skip_reason(prefix_text)
+        if skip_reason is not None:
+            if skip_reason == "below_min_tokens":
+                self._too_small += 1
+            return None
+
+        entry_key = (key_fingerprint(api_key), model_name, prefix_id)
+        if self._failed_until.get(entry_key, 0) > time.time():
+            return None
+
+        lock = self._locks.setdefault(entry_key, asyncio.Lock())
+        self._locks.move_to_end(entry_key)
+        async with lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry["expires_at"] - REFRESH_MARGIN_SECONDS > time.time():
+                self._reused += 1
+                self._entries.move_to_end(entry_key)
+                return entry["name"]
+
+            try:
+                name, tokens = await client_registry.create_cached_content(api_key, model_name, prefix_text, self.ttl_seconds)
+            except Exception as e:
+                self._failures += 1
+                self._failed_until[entry_key] = time.time() + FAILURE_BACKOFF_SECONDS
+                self._failed_until.move_to_end(entry_key)
+                self._trim()
+                logging.warning(f"Could not cache prompt prefix {prefix_id}: {str(e)}")
+                return None
+
+            self._created += 1
+            self._entries[entry_key] = {"name": name, "tokens": tokens, "expires_at": time.time() + self.ttl_seconds}
+            self._entries.move_to_end(entry_key)
+            self._trim()
+            logging.info(f"Cached prompt prefix {prefix_id} upstream as {name} ({tokens} tokens)")
+            return name
+
+    def _trim(self):
+        """Forget the least recently used entries, locks and backoffs beyond max_entries"""
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+        while len(self._failed_until) > self.max_entries:
+            self._failed_until.popitem(last=False)
+        # A held lock still guards a create in progress, so it is kept until released
+        for entry_key in list(self._locks):
+            if len(self._locks) <= self.max_entries:
+                break
+            if not self._locks[entry_key].locked():
+                del self._locks[entry_key]
+
+    def skip_reason(self, prefix_text):
+        """Why a prefix is always sent inline ("disabled" or "below_min_tokens"), or None if it is cacheable"""
+        if not self.enabled:
+            return "disabled"
+        if estimate_tokens(prefix_text) < self.min_tokens:
+            return "below_min_tokens"
+        return None
+
+    def token_count(self, api_key, model_name, prefix_id, prefix_text):
+        """Upstream token count of a cached prefix, or an estimate if it was never cached"""
+        entry = self._entries.get((key_fingerprint(api_key), model_name, prefix_id))
+        if entry is not None:
+            return entry["tokens"]
+        return estimate_tokens(prefix_text)
+
+    def invalidate(self, api_key, model_name, prefix_id):
+        """Forget a cached content the backend no longer recognises"""
+        self._entries.pop((key_fingerprint(api_key), model_name, prefix_id), None)
+
+    def stats(self):
+        """Counters for prefix cache creation, reuse and failures"""
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "evictions": self._evictions,
+            "created": self._created,
+            "reused": self._reused,
+            "failures": self._failures,
+            "below_min_tokens": self._too_small,
+            "ttl_seconds": self.ttl_seconds,
+            "min_tokens": self.min_tokens
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self._locks.clear()
+        self._failed_until.clear()
+
+
+# Shared context cache used by the service layer
+context_cache = ContextCache()
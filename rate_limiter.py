@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from gemini_clients import key_fingerprint
+
+# Upstream calls per minute one caller (client IP or own API key) may start; 0 disables
+CALLER_RPM = float(os.environ.get("RATE_LIMIT_CALLER_RPM", 30))
+# Quota of each upstream API key; size these to the key's Gemini RPM/TPM limits, 0 disables
+UPSTREAM_RPM = float(os.environ.get("GEMINI_RPM", 1000))
+UPSTREAM_TPM = float(os.environ.get("GEMINI_TPM", 1000000))
+# Longest a request may wait for capacity before it is rejected with a 429
+MAX_QUEUE_WAIT_SECONDS = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 10))
+# Output tokens reserved per call before the real usage is known
+EXPECTED_OUTPUT_TOKENS = 1500
+# Idle caller buckets are dropped once there are more than this many
+MAX_CALLER_BUCKETS = 10000
+
+QUEUE_WAIT = metrics.registry.histogram(
+    "story_rate_limit_wait_seconds", "Time requests waited for rate limit capacity", ("scope",)
+)
+REJECTED = metrics.registry.counter(
+    "story_rate_limit_rejections_total", "Requests rejected because capacity was not available in time", ("scope",)
+)
+QUEUE_DEPTH = metrics.registry.gauge(
+    "story_rate_limit_queue_depth", "Requests waiting for upstream key capacity"
+)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot get capacity within MAX_QUEUE_WAIT_SECONDS"""
+    error_class = "throttled"
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `per_minute` tokens per minute
+
+    Capacity is one minute's worth, so an idle caller can burst up to its full quota.
+    The balance may go negative: take() reserves capacity for a caller that has
+    already been told how long to wait.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` tokens are available (0 if they are available now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    @property
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class _FairQueue:
+    """
+    Waiters for one upstream key, served round-robin across callers
+
+    A caller with many queued requests gets one grant per turn, so a heavy user
+    cannot push everyone else behind a long backlog of their own requests.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        self.waiters = OrderedDict()
+        self.dispatcher = None
+
+    def wait_time(self, tokens):
+        return max(
+            self.rpm.wait_time(1) if self.rpm else 0.0,
+            self.tpm.wait_time(tokens) if self.tpm else 0.0
+        )
+
+    def grant(self, tokens):
+        if self.rpm:
+            self.rpm.take(1)
+        if self.tpm:
+            self.tpm.take(tokens)
+
+    def depth(self):
+        return sum(len(waiting) for waiting in self.waiters.values())
+
+    def put(self, caller, tokens):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(caller, deque()).append((future, tokens))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self._dispatch())
+        return future
+
+    async def _dispatch(self):
+        while self.waiters:
+            caller, waiting = next(iter(self.waiters.items()))
+            future, tokens = waiting[0]
+            if not future.done():
+                wait = self.wait_time(tokens)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                self.grant(tokens)
+                future.set_result(None)
+            # Timed-out waiters are simply dropped; granted callers go to the back of the line
+            waiting.popleft()
+            if waiting:
+                self.waiters.move_to_end(caller)
+            else:
+                del self.waiters[caller]
+
+
+class RateLimiter:
+    """
+    Per-caller and per-upstream-key token buckets with a short fair queue
+
+    Callers first pay from their own requests-per-minute bucket, then wait their turn
+    for the upstream key's RPM and TPM buckets. Requests that cannot be served within
+    max_wait seconds are rejected with RateLimitExceeded. Only use from the service loop.
+    """
+
+    def __init__(self, caller_rpm=CALLER_RPM, upstream_rpm=UPSTREAM_RPM, upstream_tpm=UPSTREAM_TPM, max_wait=MAX_QUEUE_WAIT_SECONDS):
+        self.caller_rpm = caller_rpm
+        self.upstream_rpm = upstream_rpm
+        self.upstream_tpm = upstream_tpm
+        self.max_wait = max_wait
+        self._callers = {}
+        self._upstreams = {}
+        self._granted = 0
+        self._rejected = 0
+        self._waited = 0
+
+    def _caller_bucket(self, caller):
+        bucket = self._callers.get(caller)
+        if bucket is None:
+            if len(self._callers) >= MAX_CALLER_BUCKETS:
+                self._callers = {name: kept for name, kept in self._callers.items() if not kept.idle}
+            bucket = self._callers[caller] = TokenBucket(self.caller_rpm)
+        return bucket
+
+    def _upstream_queue(self, api_key):
+        fingerprint = key_fingerprint(api_key)
+        queue = self._upstreams.get(fingerprint)
+        if queue is None:
+            queue = self._upstreams[fingerprint] = _FairQueue(self.upstream_rpm, self.upstream_tpm)
+        return queue
+
+    def _reject(self, scope, retry_after):
+        self._rejected += 1
+        REJECTED.inc(scope=scope)
+        raise RateLimitExceeded(f"Rate limit exceeded; retry in {retry_after:.1f}s", retry_after)
+
+    async def _charge_caller(self, caller):
+        """Take one request from the caller's bucket, sleeping until it is available; returns the seconds slept"""
+        if not (self.caller_rpm and caller):
+            return 0.0
+        bucket = self._caller_bucket(caller)
+        wait = bucket.wait_time(1)
+        if wait > self.max_wait:
+            self._reject("caller", wait)
+        bucket.take(1)
+        QUEUE_WAIT.observe(wait, scope="caller")
+        if wait <= 0:
+            return 0.0
+        sleep_started = time.monotonic()
+        await asyncio.sleep(wait)
+        return time.monotonic() - sleep_started
+
+    async def admit(self, caller):
+        """
+        Charge one user request to the caller's bucket, for requests that fan out into many calls
+
+        Long humanize inputs and parallel variations are admitted once here and their
+        upstream calls then acquire with charge_caller=False, so a request's own fan-out
+        never throttles it. Returns the seconds waited; raises RateLimitExceeded.
+        """
+        waited = await self._charge_caller(caller)
+        if waited > 0:
+            self._waited += 1
+        return waited
+
+    async def acquire(self, caller, api_key, tokens, charge_caller=True):
+        """
+        Wait until one upstream call of about `tokens` tokens may start
+
+        Args:
+            caller: Identity of whoever made the request (client address or key fingerprint)
+            api_key: Upstream key the call will be billed to
+            tokens: Estimated prompt plus output tokens of the call
+            charge_caller: False for the calls of a request already charged with admit();
+                they still take the key's capacity and their caller's turn in its queue
+
+        Returns the seconds spent waiting, 0.0 when capacity was granted at once; raises
+        RateLimitExceeded instead of waiting longer than max_wait.
+        """
+        # Only time spent sleeping or queued counts, not the bookkeeping around it
+        waited = await self._charge_caller(caller) if charge_caller else 0.0
+
+        queue = self._upstream_queue(api_key)
+        if not queue.waiters and queue.wait_time(tokens) == 0:
+            queue.grant(tokens)
+        else:
+            remaining = self.max_wait - waited
+            estimated = queue.wait_time(tokens)
+            if remaining <= 0 or (estimated > remaining and not queue.waiters):
+                if charge_caller:
+                    self._refund_caller(caller)
+                self._reject("upstream", max(estimated, 1.0))
+            future = queue.put(caller, tokens)
+            QUEUE_DEPTH.set(sum(pending.depth() for pending in self._upstreams.values()))
+            upstream_started = time.monotonic()
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                if charge_caller:
+                    self._refund_caller(caller)
+                self._reject("upstream", max(queue.wait_time(tokens), 1.0))
+            finally:
+                QUEUE_DEPTH.set(sum(pending.depth() for pending in self._upstreams.values()))
+            upstream_waited = time.monotonic() - upstream_started
+            waited += upstream_waited
+            QUEUE_WAIT.observe(upstream_waited, scope="upstream")
+
+        self._granted += 1
+        if waited > 0:
+            self._waited += 1
+            logging.debug(f"Request from {caller} waited {waited * 1000:.0f}ms for rate limit capacity")
+        return waited
+
+    def try_acquire(self, api_key, tokens):
+        """
+        Take the key's capacity for an optional extra call (a hedge) only if it is free now
+
+        Never queues or charges a caller: the extra call is skipped instead. Returns True
+        if the capacity was taken.
+        """
+        queue = self._upstream_queue(api_key)
+        if queue.waiters or queue.wait_time(tokens) > 0:
+            return False
+        queue.grant(tokens)
+        self._granted += 1
+        return True
+
+    def _refund_caller(self, caller):
+        if self.caller_rpm and caller in self._callers:
+            self._callers[caller].refund(1)
+
+    def settle(self, api_key, estimated_tokens, actual_tokens):
+        """Correct the key's TPM bucket once the real token usage of a call is known"""
+        queue = self._upstreams.get(key_fingerprint(api_key))
+        if queue is None or queue.tpm is None or not actual_tokens:
+            return
+        if actual_tokens > estimated_tokens:
+            queue.tpm.take(actual_tokens - estimated_tokens)
+        else:
+            queue.tpm.refund(estimated_tokens - actual_tokens)
+
+    def stats(self):
+        return {
+            "caller_rpm": self.caller_rpm,
+            "upstream_rpm": self.upstream_rpm,
+            "upstream_tpm": self.upstream_tpm,
+            "max_wait_seconds": self.max_wait,
+            "tracked_callers": len(self._callers),
+            "queued": sum(queue.depth() for queue in self._upstreams.values()),
+            "granted": self._granted,
+            "waited": self._waited,
+            "rejected": self._rejected
+        }
+
+
+# Shared limiter used by the service layer
+rate_limiter = RateLimiter()
@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+import metrics
+from gemini_clients import DEFAULT_MODEL_NAME
+
+# Attempts per upstream call, including the first one
+RETRY_MAX_ATTEMPTS = int(os.environ.get("GEMINI_RETRY_ATTEMPTS", 3))
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("GEMINI_RETRY_BASE_DELAY", 0.5))
+# Longest we sleep before a retry; a retry-after hint beyond this fails the call instead
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get("GEMINI_RETRY_MAX_DELAY", 8))
+# Per-attempt upstream timeout; the SDK's own (600s, hidden) retry loop is disabled
+UPSTREAM_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_TIMEOUT_SECONDS", 120))
+# Consecutive overload-type failures that open the breaker, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("GEMINI_BREAKER_RESET_SECONDS", 30))
+
+# Error classes worth retrying; everything else fails on the first attempt
+RETRYABLE_ERRORS = {"rate_limited", "overloaded", "server_error", "timeout"}
+# Error classes that mean upstream itself is unhealthy (quota and auth errors are per key)
+BREAKER_ERRORS = {"overloaded", "server_error", "timeout"}
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+RETRIES = metrics.registry.counter(
+    "story_upstream_retries_total", "Gemini calls retried after a transient failure", ("mode", "error_class")
+)
+UPSTREAM_FAILURES = metrics.registry.counter(
+    "story_upstream_failures_total", "Failed Gemini call attempts by error class", ("mode", "error_class")
+)
+BREAKER_STATE = metrics.registry.gauge(
+    "story_circuit_breaker_state", "Gemini circuit breaker state per model (0 closed, 1 half-open, 2 open)", ("model",)
+)
+BREAKER_REJECTIONS = metrics.registry.counter(
+    "story_circuit_breaker_rejections_total", "Gemini calls failed fast because the breaker was open", ("mode", "model")
+)
+
+
+class CircuitOpenError(api_exceptions.ServiceUnavailable):
+    """Raised instead of calling Gemini while the circuit breaker is open"""
+
+
+def classify_error(error):
+    """
+    Map an upstream exception to an error class
+
+    Returns one of: unauthenticated, permission_denied, rate_limited, overloaded,
+    server_error, timeout, not_found, invalid_request or unknown, or the error_class
+    attribute of our own exceptions (e.g. "throttled" for local rate limiting).
+    """
+    if getattr(error, "error_class", None):
+        return error.error_class
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, api_exceptions.DeadlineExceeded)):
+        return "timeout"
+    if isinstance(error, api_exceptions.Unauthenticated):
+        return "unauthenticated"
+    if isinstance(error, api_exceptions.PermissionDenied):
+        return "permission_denied"
+    if isinstance(error, api_exceptions.TooManyRequests):
+        return "rate_limited"
+    if isinstance(error, api_exceptions.ServiceUnavailable):
+        return "overloaded"
+    if isinstance(error, api_exceptions.ServerError):
+        return "server_error"
+    if isinstance(error, api_exceptions.NotFound):
+        return "not_found"
+    if isinstance(error, api_exceptions.ClientError):
+        return "invalid_request"
+
+    # Errors raised outside google.api_core (e.g. by proxies or test doubles) only carry text
+    text = str(error)
+    if "401" in text or "UNAUTHENTICATED" in text:
+        return "unauthenticated"
+    if "503" in text or "overloaded" in text:
+        return "overloaded"
+    if "429" in text or "quota" in text:
+        return "rate_limited"
+    return "unknown"
+
+
+def retry_after_seconds(error):
+    """Server-suggested wait before retrying, from RetryInfo details or the error text"""
+    for detail in getattr(error, "details", None) or []:
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None and hasattr(retry_delay, "ToTimedelta"):
+            return retry_delay.ToTimedelta().total_seconds()
+
+    response = getattr(error, "response", None)
+    header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+
+    # Gemini quota errors say e.g. "Please retry in 35.2s."
+    match = re.search(r"retry in ([\d.]+)\s*s", str(error))
+    return float(match.group(1)) if match else None
+
+
+class CircuitBreaker:
+    """
+    Fail fast while one Gemini model keeps failing with overload-type errors
+
+    Opens after `failure_threshold` consecutive failures, rejects calls for
+    `reset_seconds`, then lets a single trial call through (half-open). A successful
+    trial closes the breaker; a failed one opens it again. Thread-safe, because the
+    blocking streaming path shares it with the service loop.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.model_name = model_name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._times_opened = 0
+        BREAKER_STATE.set(BREAKER_STATES["closed"], model=model_name)
+
+    def _set_state(self, state):
+        self._state = state
+        BREAKER_STATE.set(BREAKER_STATES[state], model=self.model_name)
+
+    @property
+    def is_open(self):
+        """True while calls would be rejected; does not claim the half-open trial call"""
+        with self._lock:
+            return self._state == "open" and time.time() - self._opened_at < self.reset_seconds
+
+    def before_call(self, mode):
+        """
+        Raise CircuitOpenError if the call must not go upstream right now
+
+        Returns True when the call is the half-open trial, which must end in record_success,
+        record_failure or release_trial.
+        """
+        with self._lock:
+            if self._state == "open" and time.time() - self._opened_at >= self.reset_seconds:
+                self._set_state("half_open")
+                self._trial_in_flight = False
+            if self._state == "closed":
+                return False
+            if self._state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            retry_in = max(0.0, self.reset_seconds - (time.time() - self._opened_at))
+        BREAKER_REJECTIONS.inc(mode=mode, model=self.model_name)
+        raise CircuitOpenError(f"{self.model_name} is overloaded (circuit open); retry in {retry_in:.1f}s")
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            if self._state != "closed":
+                logging.info(f"Circuit breaker for {self.model_name} closed")
+                self._set_state("closed")
+
+    def release_trial(self):
+        """Free the half-open trial slot of a call that ended without an outcome, e.g. was cancelled"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, error_class):
+        with self._lock:
+            self._trial_in_flight = False
+            if error_class not in BREAKER_ERRORS:
+                # The call reached a healthy upstream; only the request or key was at fault
+                if self._state == "half_open":
+                    self._set_state("closed")
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._times_opened += 1
+                    logging.warning(f"Circuit breaker for {self.model_name} opened after {self._consecutive_failures} failure(s)")
+                self._set_state("open")
+                self._opened_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_seconds": self.reset_seconds,
+                "times_opened": self._times_opened
+            }
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff, full jitter and retry-after hints
+
+    Every attempt first asks the circuit breaker of the model being called, so retries
+    stop as soon as that breaker opens instead of piling more load onto an overloaded
+    upstream. Each model has its own breaker, so fallback models stay reachable.
+    """
+
+    def __init__(self, breaker_factory=CircuitBreaker, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY_SECONDS, max_delay=RETRY_MAX_DELAY_SECONDS):
+        self.breaker_factory = breaker_factory
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, model_name=DEFAULT_MODEL_NAME):
+        """Circuit breaker for one model, created on first use"""
+        with self._lock:
+            breaker = self._breakers.get(model_name)
+            if breaker is None:
+                breaker = self._breakers[model_name] = self.breaker_factory(model_name)
+            return breaker
+
+    def breaker_stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {model_name: breaker.stats() for model_name, breaker in breakers.items()}
+
+    def _retry_delay(self, attempt, error, error_class, mode):
+        """Seconds to wait before the next attempt, or None to give up and re-raise"""
+        if error_class not in RETRYABLE_ERRORS or attempt >= self.max_attempts:
+            return None
+        if isinstance(error, CircuitOpenError):
+            return None
+        hint = retry_after_seconds(error)
+        if hint is not None:
+            if hint > self.max_delay:
+                logging.warning(f"Not retrying {mode} call: upstream asked to wait {hint:.1f}s")
+                return None
+            return hint
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _failed(self, attempt, error, mode, call_stats, breaker):
+        error_class = classify_error(error)
+        if not isinstance(error, CircuitOpenError):
+            UPSTREAM_FAILURES.inc(mode=mode, error_class=error_class)
+            breaker.record_failure(error_class)
+        delay = self._retry_delay(attempt, error, error_class, mode)
+        if delay is not None:
+            RETRIES.inc(mode=mode, error_class=error_class)
+            call_stats["retries"] = call_stats.get("retries", 0) + 1
+            logging.info(f"Retrying {mode} call in {delay:.2f}s after {error_class} (attempt {attempt}/{self.max_attempts})")
+        return delay
+
+    async def call(self, attempt_call, mode, call_stats, model_name=DEFAULT_MODEL_NAME):
+        """Await attempt_call() until it succeeds or the policy gives up; must run on the service loop"""
+        breaker = self.breaker(model_name)
+        attempt = 0
+        while True:
+            attempt += 1
+            is_trial = breaker.before_call(mode)
+            try:
+                result = await attempt_call()
+            except Exception as e:
+                delay = self._failed(attempt, e, mode, call_stats, breaker)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled (a hedge lost, a sibling chunk failed) or interrupted: the call
+                # proved nothing, so the next one may be the half-open trial instead
+                if is_trial:
+                    breaker.release_trial()
+                raise
+            breaker.record_success()
+            return result
+
+    def call_sync(self, attempt_call, mode, call_stats, model_name=DEFAULT_MODEL_NAME):
+        """Blocking counterpart of call() for the streaming path"""
+        breaker = self.breaker(model_name)
+        attempt = 0
+        while True:
+            attempt += 1
+            is_trial = breaker.before_call(mode)
+            try:
+                result = attempt_call()
+            except Exception as e:
+                delay = self._failed(attempt, e, mode, call_stats, breaker)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled (a hedge lost, a sibling chunk failed) or interrupted: the call
+                # proved nothing, so the next one may be the half-open trial instead
+                if is_trial:
+                    breaker.release_trial()
+                raise
+            breaker.record_success()
+            return result
+
+
+# Shared policy (and per-model breakers) for every Gemini call in this process
+retry_policy = RetryPolicy()
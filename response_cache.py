@@ -0,0 +1,158 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Memory tier size and entry lifetime; the disk tier is only enabled when a directory is set
+CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 256))
+CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL", 3600))
+CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR")
+
+
+def _normalize(value):
+    """Collapse whitespace in strings and recurse into containers so equivalent inputs compare equal"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def make_cache_key(mode, inputs, **settings):
+    """
+    Build a stable cache key from the request inputs and the model settings
+
+    Args:
+        mode: "generate" or "humanize"
+        inputs: Dictionary of user inputs (topic, genre, raw_script, duration_seconds, ...)
+        settings: Model name, temperature and any other knobs that change the output
+    """
+    canonical = json.dumps(
+        {"mode": mode, "inputs": _normalize(inputs), "settings": _normalize(settings)},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier result cache: an in-memory LRU with TTL and an optional on-disk tier
+
+    Disk entries are JSON files named after the cache key, so results survive restarts
+    and can be shared by several worker processes pointed at the same directory.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl_seconds=CACHE_TTL_SECONDS, cache_dir=CACHE_DIR):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Return a copy of the cached value, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self._counters["expired"] += 1
+
+        stored_at, value = self._read_disk(key, now)
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._store_memory(key, stored_at, value)
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        """Store a result in both tiers"""
+        stored_at = time.time()
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store_memory(key, stored_at, value)
+        self._write_disk(key, stored_at, value)
+
+    def stats(self):
+        """Snapshot of hit/miss/eviction counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._entries)
+        stats["max_memory_entries"] = self.max_size
+        stats["ttl_seconds"] = self.ttl_seconds
+        stats["disk_enabled"] = bool(self.cache_dir)
+        return stats
+
+    def clear(self):
+        """Drop every memory entry; disk files are left for the TTL to expire"""
+        with self._lock:
+            self._entries.clear()
+
+    def _store_memory(self, key, stored_at, value):
+        # Caller must hold self._lock
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key, now):
+        if not self.cache_dir:
+            return None, None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unreadable response cache file {path}: {e}")
+            return None, None
+
+        if now - entry.get("stored_at", 0) > self.ttl_seconds:
+            with self._lock:
+                self._counters["expired"] += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None
+        return entry["stored_at"], entry["value"]
+
+    def _write_disk(self, key, stored_at, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": stored_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write response cache file {path}: {e}")
+
+
+# Shared cache used by the service layer
+response_cache = ResponseCache()
@@ -1,8 +1,313 @@
 import json
 import logging
-from flask import render_template, request, jsonify, flash
+import math
+import os
+import time
+from flask import render_template, request, jsonify, flash, Response, stream_with_context, g
 from app import app
-from gemini_service import generate_story_script, humanize_story_script
+from gemini_service import (
+    generate_story_script, humanize_story_script, stream_story_script, run_batch, select_view, single_flight,
+    GENRE_GUIDELINES, LANGUAGE_CONFIG, RESPONSE_VIEWS, RESPONSE_FIELDS, DEFAULT_VARIATIONS, MAX_VARIATIONS
+)
+from gemini_clients import client_registry, key_fingerprint
+from response_cache import response_cache
+from prompt_cache import context_cache
+from usage_ledger import usage_ledger, ROLLUPS
+from resilience import classify_error, retry_policy
+from model_router import model_router
+from rate_limiter import rate_limiter
+from hedging import hedger
+import metrics
+from job_store import JobStore, JobWorkerPool
+from subtitles import clean_subtitles, SubtitleError
+
+# Upper bounds for /generate/batch; callers may ask for less concurrency but never more
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+
+# Submit/poll job API. Workers start with the server (app.py) or on the first submission,
+# so importing this module neither creates jobs.db nor starts threads
+job_store = JobStore()
+job_store.init_app(app)
+job_workers = JobWorkerPool(job_store, {'generate': generate_story_script, 'humanize': humanize_story_script})
+
+
+def _is_truthy(value):
+    """Interpret JSON booleans and form strings like "true"/"1" as flags"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+def _validate_form(mode, form_data):
+    """Return an error message for missing required fields, or None if the form is valid"""
+    with metrics.time_stage('validation', _metric_mode(mode)):
+        return _form_error(mode, form_data)
+
+def _form_error(mode, form_data):
+    shape_error = _shape_error(form_data)
+    if shape_error:
+        return shape_error
+
+    variations = _variations(form_data)
+    if variations is None or not 1 <= variations <= MAX_VARIATIONS:
+        return f'variations must be a whole number from 1 to {MAX_VARIATIONS}'
+
+    if mode == 'humanize':
+        # Mode 1: Humanize - Validate required fields
+        if not form_data.get('raw_script'):
+            return 'Raw script is required for humanization mode'
+    else:
+        # Mode 2: Generate - Validate required fields
+        required_fields = ['topic', 'genre']
+        missing_fields = [field for field in required_fields if not form_data.get(field)]
+
+        if missing_fields:
+            return f'Missing required fields: {", ".join(missing_fields)}'
+    return None
+
+def _apply_subtitle_upload(mode, form_data):
+    """
+    Replace raw_script with the cleaned text of an uploaded subtitle_file (SRT/VTT)
+
+    Returns (stats, error): stats for notes.subtitles when a file was cleaned, or an error message.
+    """
+    upload = request.files.get('subtitle_file')
+    if mode != 'humanize' or not upload:
+        return None, None
+    try:
+        form_data['raw_script'], stats = clean_subtitles(upload.stream)
+    except SubtitleError as e:
+        return None, str(e)
+    logging.info(f"Cleaned subtitle upload: {stats['chars_before']} -> {stats['chars_after']} chars")
+    return stats, None
+
+def _variations(form_data):
+    """
+    Requested number of variations (DEFAULT_VARIATIONS if omitted), or None if it is not a whole number
+
+    Only JSON integers and strings of digits are accepted; int() would quietly truncate
+    2.7 or "2.0" instead of rejecting them.
+    """
+    variations = form_data.get('variations')
+    if variations is None or variations == '':
+        return DEFAULT_VARIATIONS
+    if isinstance(variations, str) and variations.strip().isdecimal():
+        return int(variations)
+    if isinstance(variations, int) and not isinstance(variations, bool):
+        return variations
+    return None
+
+def _response_shape(form_data):
+    """
+    Requested response view and field list
+
+    Lean ("primary") is the default; the raw model output is only sent with view=full.
+    fields may be a list or a comma-separated string.
+    """
+    view = form_data.get('view') or 'primary'
+    fields = form_data.get('fields')
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    return view, fields or None
+
+def _shape_error(form_data):
+    """Return an error message for an unknown view or field, or None"""
+    view, fields = _response_shape(form_data)
+    if view not in RESPONSE_VIEWS:
+        return f'view must be one of: {", ".join(RESPONSE_VIEWS)}'
+    unknown_fields = [field for field in fields or () if field not in RESPONSE_FIELDS]
+    if unknown_fields:
+        return f'Unknown fields: {", ".join(unknown_fields)} (choose from {", ".join(RESPONSE_FIELDS)})'
+    return None
+
+def _build_input_payload(form_data, duration_seconds, language):
+    """Build input payload for genre-based generation"""
+    return {
+        "api_key_mode": "env",
+        "generation": {
+            "duration_seconds": duration_seconds,
+            "duration_type": "short" if duration_seconds <= 60 else "long",
+            "language": language,
+            "voice_tags": True,
+            "youtube_optimized": True,
+            "algorithm_focus": "maximum_reach"
+        },
+        "content": {
+            "topic": form_data.get('topic'),
+            "genre": form_data.get('genre'),
+            "description": form_data.get('description', '')
+        },
+        "seo": {
+            "hashtag_style": "youtube_optimized",
+            "audience": f"16-35, {language.title()}, storytelling",
+            "platform": "youtube",
+            "optimization_goal": "viral_reach"
+        }
+    }
+
+def _caller_id(custom_api_key, remote_addr):
+    """Rate limit identity: the caller's own API key if they brought one, else their address"""
+    if custom_api_key:
+        return f'key:{key_fingerprint(custom_api_key)}'
+    return f'addr:{remote_addr or "unknown"}'
+
+def _service_arguments(mode, form_data, remote_addr=None):
+    """Map a validated /generate form onto keyword arguments for the matching service function"""
+    # Clients can skip the response cache to force a fresh generation
+    use_cache = not _is_truthy(form_data.get('no_cache'))
+    duration_seconds = int(form_data.get('duration_seconds', 45))
+    language = form_data.get('language', 'english')  # Default to English
+    custom_api_key = form_data.get('api_key')
+    caller = _caller_id(custom_api_key, remote_addr)
+    variations = _variations(form_data)
+
+    if mode == 'humanize':
+        return {
+            'raw_script': form_data.get('raw_script'),
+            'duration_seconds': duration_seconds,
+            'custom_api_key': custom_api_key,
+            'language': language,
+            'use_cache': use_cache,
+            'caller': caller,
+            'variations': variations
+        }
+    return {
+        'input_payload': _build_input_payload(form_data, duration_seconds, language),
+        'custom_api_key': custom_api_key,
+        'language': language,
+        'use_cache': use_cache,
+        'caller': caller,
+        'variations': variations,
+        # One upstream call per variation, in parallel; omitted means the PARALLEL_VARIATIONS default
+        'parallel_variations': _is_truthy(form_data['parallel_variations']) if 'parallel_variations' in form_data else None
+    }
+
+def _prepare_batch(batch_data, remote_addr=None):
+    """
+    Validate a /generate/batch body and split it into runnable jobs
+
+    Returns a dict with either 'error' or the jobs to run, the original position of each
+    job, the per-item results already known (validation failures) and the concurrency.
+    """
+    items = batch_data.get('items')
+    if not isinstance(items, list) or not items:
+        return {'error': 'Batch requests need a non-empty "items" list'}
+    if len(items) > BATCH_MAX_ITEMS:
+        return {'error': f'Batch requests are limited to {BATCH_MAX_ITEMS} items'}
+
+    try:
+        concurrency = int(batch_data.get('concurrency', BATCH_MAX_CONCURRENCY))
+    except (TypeError, ValueError):
+        return {'error': 'concurrency must be an integer'}
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+
+    # Items inherit the batch-level view, fields and variations unless they set their own
+    batch_shape = {key: batch_data[key] for key in ('view', 'fields', 'variations') if key in batch_data}
+
+    jobs, positions, shapes, results = [], [], [], [None] * len(items)
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {'index': index, 'status': 'error', 'error': 'Batch items must be objects'}
+            continue
+        item = dict(batch_shape, **item)
+        mode = item.get('mode', 'generate')
+        validation_error = _validate_form(mode, item)
+        if validation_error:
+            results[index] = {'index': index, 'status': 'error', 'error': validation_error}
+            continue
+        try:
+            jobs.append((mode, _service_arguments(mode, item, remote_addr)))
+        except (TypeError, ValueError) as e:
+            results[index] = {'index': index, 'status': 'error', 'error': f'Invalid item: {str(e)}'}
+            continue
+        positions.append(index)
+        shapes.append(_response_shape(item))
+
+    return {'jobs': jobs, 'positions': positions, 'shapes': shapes, 'results': results, 'concurrency': concurrency}
+
+def _batch_response(prepared, job_results, started):
+    """Merge job results back into item order and summarize the batch"""
+    results = prepared['results']
+    for position, shape, job_result in zip(prepared['positions'], prepared['shapes'], job_results):
+        job_result['index'] = position
+        if job_result['status'] == 'ok':
+            job_result['result'] = select_view(job_result['result'], *shape)
+        results[position] = job_result
+
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    return {
+        'results': results,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'concurrency': prepared['concurrency'],
+        'total_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+# Upstream error classes that get specific guidance and a 503 instead of a generic 500
+GUIDED_ERROR_CLASSES = ('unauthenticated', 'overloaded', 'rate_limited')
+
+def _throttled_body(result):
+    """Error body and Retry-After seconds for a request rejected by the local rate limiter"""
+    retry_after = max(1, math.ceil(result.get('retry_after') or 1))
+    return {'error': f'Too many requests. Please wait {retry_after} seconds and try again.', 'retry_after': retry_after}, retry_after
+
+def _error_class(api_error):
+    """Bucket a Gemini API failure (401 / 503 / 429 / other) for error messages and metrics"""
+    error_class = classify_error(api_error)
+    return error_class if error_class in GUIDED_ERROR_CLASSES else 'unavailable'
+
+def _api_error_message(mode, error_class):
+    """Provide specific error guidance for a class of Gemini API failure"""
+    if error_class == 'unauthenticated':
+        return 'Invalid API key. Please check your Gemini API key in the API Settings menu (top right). Get your free key from Google AI Studio.'
+    elif error_class == 'overloaded':
+        return 'Gemini service is overloaded. Please wait a few minutes and try again, or use your own API key for priority access.'
+    elif error_class == 'rate_limited':
+        return 'API quota exceeded. Please use your own Gemini API key for unlimited access, or try again later.'
+    elif mode == 'humanize':
+        return 'Script humanization service is temporarily unavailable. Please check your internet connection and try again.'
+    return 'Script generation service is temporarily unavailable. Please check your internet connection and try again.'
+
+def _metric_mode(mode):
+    return mode if mode in ('generate', 'humanize') else 'other'
+
+def _metric_labels(mode, form_data):
+    """Bounded mode/language/genre labels for request metrics; unknown user input maps to other"""
+    language = form_data.get('language', 'english')
+    genre = form_data.get('genre') if mode != 'humanize' else None
+    return {
+        'mode': _metric_mode(mode),
+        'language': language if language in LANGUAGE_CONFIG else 'other',
+        'genre': (genre if genre in GENRE_GUIDELINES else 'other') if genre else ''
+    }
+
+def _record_request_metrics(route, labels, status, error_class, started):
+    """Count a finished script request and observe its latency"""
+    metrics.REQUESTS.inc(route=route, mode=labels['mode'], status=status)
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, **labels)
+    if status >= 400:
+        metrics.ERRORS.inc(mode=labels['mode'], error_class=error_class or ('invalid_request' if status < 500 else 'internal'))
+
+# Views whose requests are counted and timed in the metrics
+METERED_ENDPOINTS = {'generate_script', 'generate_script_stream', 'generate_batch', 'submit_job'}
+
+@app.before_request
+def _start_request_metrics():
+    if request.endpoint in METERED_ENDPOINTS:
+        g.metrics_started = time.perf_counter()
+        metrics.REQUESTS_IN_FLIGHT.inc(route=request.url_rule.rule)
+
+@app.after_request
+def _finish_request_metrics(response):
+    if 'metrics_started' in g:
+        labels = g.get('metric_labels') or {'mode': 'other', 'language': '', 'genre': ''}
+        _record_request_metrics(request.url_rule.rule, labels, response.status_code, g.get('error_class'), g.metrics_started)
+    return response
+
+@app.teardown_request
+def _end_request_metrics(exception=None):
+    if 'metrics_started' in g:
+        metrics.REQUESTS_IN_FLIGHT.dec(route=request.url_rule.rule)
 
 @app.route('/')
 def index():
@@ -15,107 +320,228 @@ def generate_script():
     try:
         # Get form data
         form_data = request.get_json() if request.is_json else request.form.to_dict()
-        
+
         # Check mode
         mode = form_data.get('mode', 'generate')
-        
-        if mode == 'humanize':
-            # Mode 1: Humanize - Validate required fields
-            if not form_data.get('raw_script'):
-                return jsonify({
-                    'error': 'Raw script is required for humanization mode'
-                }), 400
-        else:
-            # Mode 2: Generate - Validate required fields
-            required_fields = ['topic', 'genre']
-            missing_fields = [field for field in required_fields if not form_data.get(field)]
-            
-            if missing_fields:
-                return jsonify({
-                    'error': f'Missing required fields: {", ".join(missing_fields)}'
-                }), 400
-        
+        g.metric_labels = _metric_labels(mode, form_data)
+
+        subtitle_stats, subtitle_error = _apply_subtitle_upload(mode, form_data)
+        validation_error = subtitle_error or _validate_form(mode, form_data)
+        if validation_error:
+            return jsonify({'error': validation_error}), 400
+
         logging.info(f"Processing {mode} request")
-        
-        if mode == 'humanize':
-            # Mode 1: Handle humanization mode
-            duration_seconds = int(form_data.get('duration_seconds', 45))
-            language = form_data.get('language', 'english')  # Default to English
-            try:
-                custom_api_key = form_data.get('api_key')
-                result = humanize_story_script(form_data.get('raw_script'), duration_seconds, custom_api_key, language)
-            except Exception as api_error:
-                logging.error(f"Gemini API error in humanize mode: {str(api_error)}")
-                
-                # Provide specific error guidance
-                if '401' in str(api_error) or 'UNAUTHENTICATED' in str(api_error):
-                    error_msg = 'Invalid API key. Please check your Gemini API key in the API Settings menu (top right). Get your free key from Google AI Studio.'
-                elif '503' in str(api_error) or 'overloaded' in str(api_error):
-                    error_msg = 'Gemini service is overloaded. Please wait a few minutes and try again, or use your own API key for priority access.'
-                elif '429' in str(api_error) or 'quota' in str(api_error):
-                    error_msg = 'API quota exceeded. Please use your own Gemini API key for unlimited access, or try again later.'
-                else:
-                    error_msg = 'Script humanization service is temporarily unavailable. Please check your internet connection and try again.'
-                
-                return jsonify({'error': error_msg}), 503
-        else:
-            # Mode 2: Handle generation mode
-            # No additional parsing needed
-            
-            # Build input payload for genre-based generation
-            duration_seconds = int(form_data.get('duration_seconds', 45))
-            language = form_data.get('language', 'english')  # Default to English
-            input_payload = {
-                "api_key_mode": "env",
-                "generation": {
-                    "duration_seconds": duration_seconds,
-                    "duration_type": "short" if duration_seconds <= 60 else "long",
-                    "language": language,
-                    "voice_tags": True,
-                    "youtube_optimized": True,
-                    "algorithm_focus": "maximum_reach"
-                },
-                "content": {
-                    "topic": form_data.get('topic'),
-                    "genre": form_data.get('genre'),
-                    "description": form_data.get('description', '')
-                },
-                "seo": {
-                    "hashtag_style": "youtube_optimized",
-                    "audience": f"16-35, {language.title()}, storytelling",
-                    "platform": "youtube",
-                    "optimization_goal": "viral_reach"
-                }
-            }
-            
-            # Generate script using Gemini API
-            try:
-                custom_api_key = form_data.get('api_key')
-                result = generate_story_script(input_payload, custom_api_key, language)
-            except Exception as api_error:
-                logging.error(f"Gemini API error in generate mode: {str(api_error)}")
-                
-                # Provide specific error guidance  
-                if '401' in str(api_error) or 'UNAUTHENTICATED' in str(api_error):
-                    error_msg = 'Invalid API key. Please check your Gemini API key in the API Settings menu (top right). Get your free key from Google AI Studio.'
-                elif '503' in str(api_error) or 'overloaded' in str(api_error):
-                    error_msg = 'Gemini service is overloaded. Please wait a few minutes and try again, or use your own API key for priority access.'
-                elif '429' in str(api_error) or 'quota' in str(api_error):
-                    error_msg = 'API quota exceeded. Please use your own Gemini API key for unlimited access, or try again later.'
-                else:
-                    error_msg = 'Script generation service is temporarily unavailable. Please check your internet connection and try again.'
-                
-                return jsonify({'error': error_msg}), 503
-        
+
+        service_kwargs = _service_arguments(mode, form_data, request.remote_addr)
+        try:
+            if mode == 'humanize':
+                # Mode 1: Handle humanization mode
+                result = humanize_story_script(**service_kwargs)
+            else:
+                # Mode 2: Handle generation mode
+                result = generate_story_script(**service_kwargs)
+        except Exception as api_error:
+            logging.error(f"Gemini API error in {mode} mode: {str(api_error)}")
+            g.error_class = _error_class(api_error)
+            return jsonify({'error': _api_error_message(mode, g.error_class)}), 503
+
         if result.get('error'):
+            if result.get('error_class') == 'throttled':
+                g.error_class = 'throttled'
+                body, retry_after = _throttled_body(result)
+                return jsonify(body), 429, {'Retry-After': str(retry_after)}
+            # Upstream failures the service layer classified still get specific guidance
+            if result.get('error_class') in GUIDED_ERROR_CLASSES:
+                g.error_class = result['error_class']
+                return jsonify({'error': _api_error_message(mode, g.error_class)}), 503
+            g.error_class = 'generation_failed'
             return jsonify({'error': result['error']}), 500
-        
-        return jsonify(result)
-        
+
+        if subtitle_stats:
+            result['notes']['subtitles'] = subtitle_stats
+        return jsonify(select_view(result, *_response_shape(form_data)))
+
+    except Exception as e:
+        logging.error(f"Error processing script: {str(e)}")
+        return jsonify({'error': f'Script processing failed: {str(e)}'}), 500
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_script_stream():
+    """
+    Streaming variant of /generate using Server-Sent Events
+
+    Emits a "variation" event for each story script as soon as the model finishes it,
+    then a "result" event with the same payload /generate returns, or an "error" event.
+    """
+    try:
+        form_data = request.get_json() if request.is_json else request.form.to_dict()
+        mode = form_data.get('mode', 'generate')
+        g.metric_labels = _metric_labels(mode, form_data)
+
+        subtitle_stats, subtitle_error = _apply_subtitle_upload(mode, form_data)
+        validation_error = subtitle_error or _validate_form(mode, form_data)
+        if validation_error:
+            return jsonify({'error': validation_error}), 400
+
+        logging.info(f"Processing streamed {mode} request")
+
+        service_kwargs = _service_arguments(mode, form_data, request.remote_addr)
+        if mode == 'humanize':
+            form_fields = {'raw_script': service_kwargs['raw_script'], 'duration_seconds': service_kwargs['duration_seconds']}
+        else:
+            form_fields = service_kwargs['input_payload']
     except Exception as e:
         logging.error(f"Error processing script: {str(e)}")
         return jsonify({'error': f'Script processing failed: {str(e)}'}), 500
 
+    response_shape = _response_shape(form_data)
+
+    def event_stream():
+        for event, data in stream_story_script(
+            mode, form_fields, service_kwargs['custom_api_key'], service_kwargs['language'],
+            use_cache=service_kwargs['use_cache'], caller=service_kwargs['caller'], variations=service_kwargs['variations'],
+            parallel_variations=service_kwargs.get('parallel_variations')
+        ):
+            if event == 'error':
+                data = {'error': data}
+            elif event == 'result':
+                if subtitle_stats:
+                    data['notes']['subtitles'] = subtitle_stats
+                data = select_view(data, *response_shape)
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/subtitles/clean', methods=['POST'])
+def clean_subtitle_upload():
+    """Clean an uploaded SRT/VTT subtitle_file into plain text for the humanize form"""
+    upload = request.files.get('subtitle_file')
+    if not upload:
+        return jsonify({'error': 'subtitle_file is required'}), 400
+    try:
+        raw_script, stats = clean_subtitles(upload.stream)
+    except SubtitleError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'raw_script': raw_script, 'subtitles': stats})
+
+@app.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """
+    Run a list of generate/humanize items with bounded parallelism
+
+    Each item takes the same fields as /generate. Items run concurrently up to the
+    requested concurrency (capped by BATCH_MAX_CONCURRENCY), and the response lists
+    every item's result or error together with the batch wall time.
+    """
+    started = time.perf_counter()
+    try:
+        batch_data = request.get_json(silent=True) or {}
+        prepared = _prepare_batch(batch_data, request.remote_addr)
+        if prepared.get('error'):
+            return jsonify({'error': prepared['error']}), 400
+
+        logging.info(f"Processing batch of {len(prepared['results'])} items with concurrency {prepared['concurrency']}")
+        job_results = run_batch(prepared['jobs'], prepared['concurrency'])
+        return jsonify(_batch_response(prepared, job_results, started))
+
+    except Exception as e:
+        logging.error(f"Error processing batch: {str(e)}")
+        return jsonify({'error': f'Batch processing failed: {str(e)}'}), 500
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a generate/humanize request and return its job id immediately
+
+    Takes the same fields as /generate. Poll GET /jobs/<job_id> for status and the result;
+    useful for long humanize inputs that would exceed proxy or serverless timeouts.
+    """
+    try:
+        form_data = request.get_json() if request.is_json else request.form.to_dict()
+        mode = form_data.get('mode', 'generate')
+        g.metric_labels = _metric_labels(mode, form_data)
+
+        validation_error = _validate_form(mode, form_data)
+        if validation_error:
+            return jsonify({'error': validation_error}), 400
+
+        job_id = job_store.submit(mode, _service_arguments(mode, form_data, request.remote_addr))
+        job_workers.start()
+        job_workers.notify()
+        logging.info(f"Queued {mode} job {job_id}")
+
+        return jsonify({'job_id': job_id, 'status': 'queued', 'poll_url': f'/jobs/{job_id}'}), 202
+
+    except Exception as e:
+        logging.error(f"Error queuing job: {str(e)}")
+        return jsonify({'error': f'Job submission failed: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, timings and (once finished) result or error of a submitted job; takes ?view= and ?fields= like /generate"""
+    shape_error = _shape_error(request.args)
+    if shape_error:
+        return jsonify({'error': shape_error}), 400
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job.get('result'):
+        job['result'] = select_view(job['result'], *_response_shape(request.args))
+    return jsonify(job)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Response cache hit/miss/eviction counters"""
+    return jsonify(response_cache.stats())
+
+@app.route('/stats', methods=['GET'])
+def service_stats():
+    """Counters for the response cache, coalescing, prompt prefix cache, retries, model routing, rate limits, hedging, client registry and job queue"""
+    return jsonify({
+        'cache': response_cache.stats(),
+        'coalescing': single_flight.stats(),
+        'context_cache': context_cache.stats(),
+        'circuit_breakers': retry_policy.breaker_stats(),
+        'model_routing': model_router.stats(),
+        'rate_limits': rate_limiter.stats(),
+        'hedging': hedger.stats(),
+        'retry_policy': {'max_attempts': retry_policy.max_attempts, 'base_delay': retry_policy.base_delay, 'max_delay': retry_policy.max_delay},
+        'clients': client_registry.stats(),
+        'jobs': job_store.counts()
+    })
+
+@app.route('/usage', methods=['GET'])
+def usage_rollup():
+    """
+    Token usage rollups from the usage ledger
+
+    Query parameters: group_by (hour, key, mode, language, genre or model; default hour),
+    hours (look-back window, default 24) and key (restrict to one key fingerprint).
+    """
+    group_by = request.args.get('group_by', 'hour')
+    if group_by not in ROLLUPS:
+        return jsonify({'error': f'group_by must be one of: {", ".join(ROLLUPS)}'}), 400
+    try:
+        since_hours = float(request.args.get('hours', 24))
+    except ValueError:
+        return jsonify({'error': 'hours must be a number'}), 400
+
+    rollups = usage_ledger.rollup(group_by, since_hours, request.args.get('key'))
+    totals = {
+        field: sum(rollup[field] for rollup in rollups)
+        for field in ('calls', 'prompt_tokens', 'cached_tokens', 'output_tokens', 'total_tokens')
+    }
+    return jsonify({'group_by': group_by, 'hours': since_hours, 'rollups': rollups, 'totals': totals})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, error, in-flight and latency metrics in the Prometheus text format"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('index.html'), 404
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+import threading
+
+# One long-lived event loop per process runs every async upstream call. Async gRPC
+# clients are bound to the loop they were created on, so keeping them all on this
+# loop lets the client registry reuse them across requests and server threads.
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def get_service_loop():
+    """Return the shared service event loop, starting its thread on first use"""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="gemini-service-loop", daemon=True)
+            _loop_thread.start()
+            logging.debug("Started Gemini service event loop")
+        return _loop
+
+
+def in_service_loop():
+    """True when called from the service loop's own thread"""
+    return _loop_thread is not None and threading.current_thread() is _loop_thread
+
+
+def run_on_service_loop(coro):
+    """
+    Run a coroutine on the service loop and block until it finishes
+
+    This is the bridge used by the synchronous service functions and Flask views.
+    """
+    if in_service_loop():
+        coro.close()
+        raise RuntimeError("run_on_service_loop() would deadlock when called from the service loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, get_service_loop()).result()
+
+
+async def await_on_service_loop(coro):
+    """Await a coroutine on the service loop from any other running event loop (e.g. an ASGI server)"""
+    if in_service_loop():
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, get_service_loop()))
@@ -0,0 +1,55 @@
+import asyncio
+import copy
+import logging
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical upstream calls into one
+
+    The first caller for a key starts the work as its own task; callers that arrive
+    while it is in flight await the same task and receive a copy of its result.
+    Because the task is shielded, a leader that disconnects does not cancel the call
+    for everyone else. All callers must share one event loop (the service loop).
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._leaders = 0
+        self._coalesced = 0
+
+    async def run(self, key, coro_factory):
+        """
+        Run coro_factory() once per key among concurrent callers
+
+        Returns (result, shared) where shared is True for callers that piggybacked on
+        another caller's in-flight call.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+
+        if shared:
+            self._coalesced += 1
+        else:
+            self._leaders += 1
+            task = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        result = await asyncio.shield(task)
+        return (copy.deepcopy(result) if shared else result), shared
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieve the exception so a failure nobody awaited any more is not reported as unhandled
+        if not task.cancelled() and task.exception() is not None:
+            logging.debug(f"Coalesced upstream call failed: {task.exception()}")
+
+    def stats(self):
+        """Counters for upstream calls made vs. requests that shared an in-flight call"""
+        return {
+            "in_flight": len(self._inflight),
+            "upstream_calls": self._leaders,
+            "coalesced_requests": self._coalesced
+        }
@@ -39,6 +39,10 @@ function initializeEventListeners() {
     // Genre selection
     document.getElementById('genre').addEventListener('change', handleGenreChange);
     
+    // Subtitle upload fills the raw script box with cleaned text
+    const subtitleInput = document.getElementById('subtitle_file');
+    if (subtitleInput) subtitleInput.addEventListener('change', handleSubtitleUpload);
+    
     // Mode card clicks
     document.getElementById('mode1Card').addEventListener('click', () => {
         document.getElementById('mode1').checked = true;
@@ -92,7 +96,9 @@ async function handleFormSubmit(event) {
         // Prepare data based on mode
         const data = {
             mode: isHumanizeMode ? 'humanize' : 'generate',
-            language: selectedLanguage
+            language: selectedLanguage,
+            // The page shows one script, so only one variation is generated
+            variations: 1
         };
         
         // Include API key if available
@@ -113,21 +119,25 @@ async function handleFormSubmit(event) {
             data.duration_seconds = parseInt(formData.get('generate_duration')) || 45;
         }
         
-        // Make API call
-        const response = await fetch('/generate', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(data)
-        });
-        
-        const result = await response.json();
-        
-        if (response.ok) {
-            displayResult(result);
+        // Make API call, streaming variations in as they are generated when supported
+        if (window.ReadableStream && window.TextDecoder) {
+            await streamGenerate(data);
         } else {
-            showError(result.error || 'Unknown error occurred');
+            const response = await fetch('/generate', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify(data)
+            });
+            
+            const result = await response.json();
+            
+            if (response.ok) {
+                displayResult(result);
+            } else {
+                showError(result.error || 'Unknown error occurred');
+            }
         }
         
     } catch (error) {
@@ -149,6 +159,121 @@ async function handleFormSubmit(event) {
     }
 }
 
+async function handleSubtitleUpload(event) {
+    const file = event.target.files[0];
+    const statsText = document.getElementById('subtitleStats');
+    if (!file) return;
+    
+    const upload = new FormData();
+    upload.append('subtitle_file', file);
+    statsText.textContent = 'Cleaning subtitles...';
+    
+    try {
+        const response = await fetch('/subtitles/clean', { method: 'POST', body: upload });
+        const result = await response.json();
+        if (!response.ok) {
+            statsText.textContent = result.error || 'Could not read the subtitle file';
+            return;
+        }
+        document.getElementById('raw_script').value = result.raw_script;
+        const stats = result.subtitles;
+        statsText.textContent = `Cleaned ${stats.cues} cues: ${stats.chars_before} → ${stats.chars_after} characters, ~${stats.tokens_before} → ~${stats.tokens_after} tokens`;
+    } catch (error) {
+        console.error('Subtitle upload failed:', error);
+        statsText.textContent = 'Subtitle upload failed. Please try again.';
+    }
+}
+
+async function streamGenerate(data) {
+    const response = await fetch('/generate/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(data)
+    });
+    
+    // Validation errors are returned as plain JSON before the stream starts
+    if (!response.ok) {
+        const result = await response.json();
+        showError(result.error || 'Unknown error occurred');
+        return;
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let finished = false;
+    
+    while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Server-Sent Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            finished = handleStreamEvent(rawEvent) || finished;
+        }
+    }
+    
+    if (!finished) {
+        showError('The connection closed before the script was complete. Please try again.');
+    }
+}
+
+function handleStreamEvent(rawEvent) {
+    // Returns true once the stream has delivered its final result or error
+    let eventName = 'message';
+    let dataText = '';
+    
+    rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            eventName = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataText += line.slice(5).trim();
+        }
+    });
+    
+    if (!dataText) return false;
+    const payload = JSON.parse(dataText);
+    
+    if (eventName === 'variation') {
+        displayVariation(payload);
+        return false;
+    }
+    if (eventName === 'result') {
+        displayResult(payload);
+        return true;
+    }
+    if (eventName === 'error') {
+        showError(payload.error || 'Unknown error occurred');
+        return true;
+    }
+    return false;
+}
+
+function displayVariation(variation) {
+    // Show the first finished story script right away; titles, tags and
+    // descriptions follow with the final result
+    const scriptField = document.getElementById('resultScript');
+    if (document.getElementById('resultContainer').style.display === 'block' && scriptField.value) {
+        return;
+    }
+    
+    document.getElementById('loadingSpinner').style.display = 'none';
+    document.getElementById('emptyState').style.display = 'none';
+    document.getElementById('resultTitle').value = '';
+    document.getElementById('resultOnScreen').value = '';
+    document.getElementById('resultDescription').value = '';
+    document.getElementById('resultHashtags').value = '';
+    scriptField.value = variation.script || '';
+    document.getElementById('resultContainer').style.display = 'block';
+}
+
 function showLoading() {
     const selectedLanguage = document.querySelector('input[name="language"]:checked')?.value || 'english';
     const isEnglish = selectedLanguage === 'english';
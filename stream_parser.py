@@ -0,0 +1,96 @@
+import json
+import logging
+
+
+class StoryScriptStreamParser:
+    """
+    Incrementally extract completed items of the "story_scripts" array from streamed JSON
+
+    Feed raw text chunks as they arrive from the model; every call returns the
+    story script objects that became complete with that chunk. The scan is a single
+    pass over the buffer that tracks string/escape state and brace depth, so the
+    total work stays linear in the size of the response.
+    """
+
+    ARRAY_KEY = '"story_scripts"'
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start = None
+
+    def feed(self, text):
+        """Add a chunk of model output and return any newly completed story scripts"""
+        self._buffer += text
+        completed = []
+
+        if self._done:
+            return completed
+
+        if not self._in_array and not self._find_array_start():
+            return completed
+
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._item_start = pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the story_scripts array itself
+                    self._done = True
+                    pos += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._item_start is not None:
+                    item = self._decode(buffer[self._item_start:pos + 1])
+                    if item is not None:
+                        completed.append(item)
+                    self._item_start = None
+            pos += 1
+
+        self._pos = pos
+        return completed
+
+    @property
+    def done(self):
+        """True once the closing bracket of the story_scripts array has been seen"""
+        return self._done
+
+    def _find_array_start(self):
+        key_index = self._buffer.find(self.ARRAY_KEY)
+        if key_index == -1:
+            return False
+        bracket_index = self._buffer.find("[", key_index + len(self.ARRAY_KEY))
+        if bracket_index == -1:
+            return False
+        self._in_array = True
+        self._pos = bracket_index + 1
+        return True
+
+    @staticmethod
+    def _decode(fragment):
+        try:
+            item = json.loads(fragment)
+        except json.JSONDecodeError as e:
+            logging.debug(f"Skipping undecodable streamed story script: {e}")
+            return None
+        return item if isinstance(item, dict) else None
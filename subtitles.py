@@ -0,0 +1,172 @@
+import html
+import io
+import os
+import re
+from difflib import SequenceMatcher
+
+from local_backend import estimate_tokens
+
+# Largest subtitle upload accepted, in decoded characters; the file is read line by line,
+# so memory use is bounded by the cleaned text rather than the upload
+SUBTITLE_MAX_CHARS = int(os.environ.get("SUBTITLE_MAX_CHARS", 2_000_000))
+# Consecutive cues at least this similar (0-1) are treated as repeats of the same line
+NEAR_DUPLICATE_RATIO = float(os.environ.get("SUBTITLE_NEAR_DUPLICATE_RATIO", 0.9))
+# Merged lines are flushed at this length even if no sentence has ended
+MAX_MERGED_CHARS = 1000
+
+TIMING_PATTERN = re.compile(r"^(\d+:)?\d{1,2}:\d{2}[.,]\d{1,3}\s*-->")
+CUE_NUMBER_PATTERN = re.compile(r"^\d+$")
+# VTT voice/class/timestamp tags, SRT font tags and SSA override codes like {\an8}
+MARKUP_PATTERN = re.compile(r"<[^>]*>|\{\\[^}]*\}")
+SENTENCE_END_PATTERN = re.compile(r"[.!?।…♪][\"')\]]*$")
+VTT_METADATA_BLOCKS = ("WEBVTT", "NOTE", "STYLE", "REGION")
+
+
+class SubtitleError(ValueError):
+    """The upload is not a usable SRT/VTT file"""
+
+
+def _is_text_block(block, timed):
+    """A finished block is text unless it is empty or a lone cue number whose timing never came"""
+    if not block:
+        return False
+    return timed or not (len(block) == 1 and CUE_NUMBER_PATTERN.match(block[0]))
+
+
+def _cue_texts(lines):
+    """
+    Yield the text of each cue, without cue numbers, identifiers, timings or markup
+
+    Lines are consumed one at a time and only the current cue is held in memory.
+    Blocks with no timing line are kept as text, so plain transcripts pass through.
+    """
+    block = []
+    timed = False
+    skipping = False
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if _is_text_block(block, timed):
+                yield " ".join(block)
+            block, timed, skipping = [], False, False
+            continue
+        if skipping:
+            continue
+        if not block and not timed and line.split(maxsplit=1)[0] in VTT_METADATA_BLOCKS:
+            skipping = True
+            continue
+        if TIMING_PATTERN.match(line):
+            # Anything before the timing line is a cue number or identifier
+            block, timed = [], True
+            continue
+        text = " ".join(html.unescape(MARKUP_PATTERN.sub("", line)).split())
+        if text:
+            block.append(text)
+    if _is_text_block(block, timed):
+        yield " ".join(block)
+
+
+def _words_key(words):
+    return [re.sub(r"\W+", "", word.lower()) for word in words]
+
+
+def _new_words(previous, current):
+    """
+    Words of the current cue that do not repeat the previous one
+
+    Rolling captions repeat the end of the last cue at the start of the next, so the
+    longest such overlap is dropped; a near-duplicate cue contributes nothing.
+    """
+    previous_key, current_key = _words_key(previous), _words_key(current)
+    if SequenceMatcher(None, " ".join(previous_key), " ".join(current_key)).ratio() >= NEAR_DUPLICATE_RATIO:
+        return []
+    for overlap in range(min(len(previous_key), len(current_key)), 0, -1):
+        if previous_key[-overlap:] == current_key[:overlap]:
+            return current[overlap:]
+    return current
+
+
+class SubtitleCleaner:
+    """
+    Turn an SRT/VTT file into plain narration text, one merged sentence group per line
+
+    Broken cue lines are merged until a sentence ends, and duplicate, near-duplicate and
+    rolling-caption repeats of the previous cue are collapsed. stats() reports the
+    character and estimated token counts before and after cleaning.
+    """
+
+    def __init__(self, max_chars=SUBTITLE_MAX_CHARS):
+        self.max_chars = max_chars
+        self.cues = 0
+        self.chars_before = 0
+        self.tokens_before = 0
+        self.chars_after = 0
+        self.tokens_after = 0
+
+    def _counted(self, lines):
+        for line in lines:
+            self.chars_before += len(line)
+            if self.chars_before > self.max_chars:
+                raise SubtitleError(f"Subtitle file is larger than {self.max_chars} characters")
+            if line.strip():
+                self.tokens_before += estimate_tokens(line.strip())
+            yield line
+
+    def _merged_lines(self, lines):
+        previous = []
+        pending = []
+        for text in _cue_texts(self._counted(lines)):
+            self.cues += 1
+            words = text.split()
+            new_words = _new_words(previous, words)
+            previous = words
+            if not new_words:
+                continue
+            pending.extend(new_words)
+            merged = " ".join(pending)
+            if SENTENCE_END_PATTERN.search(merged) or len(merged) >= MAX_MERGED_CHARS:
+                yield merged
+                pending = []
+        if pending:
+            yield " ".join(pending)
+
+    def clean(self, lines):
+        """Clean an iterable of text lines and return the narration text"""
+        cleaned = []
+        for line in self._merged_lines(lines):
+            self.chars_after += len(line) + (1 if cleaned else 0)
+            self.tokens_after += estimate_tokens(line)
+            cleaned.append(line)
+        if not cleaned:
+            raise SubtitleError("No subtitle text found in the file")
+        return "\n".join(cleaned)
+
+    def stats(self):
+        return {
+            "cues": self.cues,
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": self.tokens_before - self.tokens_after
+        }
+
+
+def clean_subtitles(stream, max_chars=SUBTITLE_MAX_CHARS):
+    """
+    Read an uploaded SRT/VTT file incrementally and return (text, stats)
+
+    Args:
+        stream: Binary file object, e.g. the stream of a Flask FileStorage
+        max_chars: Largest decoded upload accepted
+
+    Raises SubtitleError when the file is too large or contains no text.
+    """
+    cleaner = SubtitleCleaner(max_chars)
+    lines = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace")
+    try:
+        text = cleaner.clean(lines)
+    finally:
+        # Leave the underlying upload open for its owner to close
+        lines.detach()
+    return text, cleaner.stats()
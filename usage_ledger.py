@@ -0,0 +1,197 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+# Default ledger file; app.config["USAGE_DB_PATH"] overrides it (see UsageLedger.init_app)
+USAGE_DB_PATH = os.environ.get("USAGE_DB_PATH", "usage.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at REAL NOT NULL,
+    key_fingerprint TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    language TEXT NOT NULL,
+    genre TEXT,
+    duration_seconds INTEGER,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    latency_ms REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_usage_recorded_at ON usage (recorded_at);
+CREATE INDEX IF NOT EXISTS idx_usage_key ON usage (key_fingerprint, recorded_at);
+"""
+
+# group_by value -> SQL expression for the rollup bucket
+ROLLUPS = {
+    "hour": "CAST(recorded_at / 3600 AS INTEGER) * 3600",
+    "key": "key_fingerprint",
+    "mode": "mode",
+    "language": "language",
+    "genre": "genre",
+    "model": "model"
+}
+
+COLUMNS = ("recorded_at", "key_fingerprint", "mode", "language", "genre", "duration_seconds", "model",
+           "prompt_tokens", "cached_tokens", "output_tokens", "total_tokens", "latency_ms")
+
+
+def usage_counts(response):
+    """Token counts from a Gemini response's usage_metadata (zeros when it is missing)"""
+    usage = getattr(response, "usage_metadata", None)
+
+    def count(field):
+        value = getattr(usage, field, 0)
+        return value if isinstance(value, int) else 0
+
+    return {
+        "prompt_tokens": count("prompt_token_count"),
+        "cached_tokens": count("cached_content_token_count"),
+        "output_tokens": count("candidates_token_count"),
+        "total_tokens": count("total_token_count")
+    }
+
+
+class UsageLedger:
+    """
+    Append-only SQLite ledger of token usage, one row per upstream Gemini call
+
+    record() only enqueues, so it is safe to call from the service loop; a background
+    thread writes rows in batches. Rows are never updated or deleted by the app.
+    The database file is only created by the first write, so importing the module
+    touches no disk and a read-only deployment only fails (and logs) when it records.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, db_path=USAGE_DB_PATH):
+        self.db_path = db_path
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def init_app(self, app):
+        """Take the database path from app.config["USAGE_DB_PATH"] when the app sets one"""
+        with self._lock:
+            if self._schema_ready:
+                raise RuntimeError(f"Usage ledger already opened {self.db_path}")
+            self.db_path = app.config.get("USAGE_DB_PATH", self.db_path)
+
+    def _ensure_schema(self):
+        with self._lock:
+            if self._schema_ready:
+                return
+            with closing(self._connect()) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+            self._schema_ready = True
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, key_fingerprint, labels, model, counts, latency_ms):
+        """
+        Queue one usage row
+
+        Args:
+            key_fingerprint: key_fingerprint() of the API key that was billed
+            labels: Request labels with mode, language, genre and duration_seconds
+            model: Model that served the call
+            counts: Token counts from usage_counts()
+            latency_ms: Upstream round trip time
+        """
+        self._ensure_writer()
+        self._queue.put((
+            time.time(), key_fingerprint, labels["mode"], labels["language"], labels.get("genre"),
+            labels.get("duration_seconds"), model, counts["prompt_tokens"], counts["cached_tokens"],
+            counts["output_tokens"], counts["total_tokens"], round(latency_ms, 1)
+        ))
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            rows = [self._queue.get()]
+            while len(rows) < self.BATCH_SIZE:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._ensure_schema()
+                with closing(self._connect()) as conn:
+                    conn.executemany(
+                        f"INSERT INTO usage ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows
+                    )
+            except sqlite3.Error as e:
+                logging.error(f"Could not write {len(rows)} usage row(s): {e}")
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued row has been written"""
+        self._queue.join()
+
+    def rollup(self, group_by="hour", since_hours=24, key_fingerprint=None):
+        """
+        Aggregate usage per bucket
+
+        Args:
+            group_by: One of ROLLUPS ("hour", "key", "mode", "language", "genre", "model")
+            since_hours: Only include calls from this many hours back
+            key_fingerprint: Restrict to one API key
+        """
+        if group_by not in ROLLUPS:
+            raise ValueError(f"group_by must be one of {list(ROLLUPS)}")
+        if not self._schema_ready and not os.path.exists(self.db_path):
+            # Nothing recorded yet; do not create the file just to read it
+            return []
+        self._ensure_schema()
+
+        conditions, params = ["recorded_at >= ?"], [time.time() - since_hours * 3600]
+        if key_fingerprint:
+            conditions.append("key_fingerprint = ?")
+            params.append(key_fingerprint)
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"""SELECT {ROLLUPS[group_by]} AS bucket, COUNT(*) AS calls,
+                           SUM(prompt_tokens) AS prompt_tokens, SUM(cached_tokens) AS cached_tokens,
+                           SUM(output_tokens) AS output_tokens, SUM(total_tokens) AS total_tokens,
+                           AVG(latency_ms) AS avg_latency_ms
+                    FROM usage WHERE {' AND '.join(conditions)}
+                    GROUP BY bucket ORDER BY bucket""",
+                params
+            ).fetchall()
+
+        return [
+            {
+                group_by: row["bucket"],
+                "calls": row["calls"],
+                "prompt_tokens": row["prompt_tokens"],
+                "cached_tokens": row["cached_tokens"],
+                "output_tokens": row["output_tokens"],
+                "total_tokens": row["total_tokens"],
+                "avg_latency_ms": round(row["avg_latency_ms"], 1)
+            }
+            for row in rows
+        ]
+
+
+# Shared ledger used by the service layer
+usage_ledger = UsageLedger()